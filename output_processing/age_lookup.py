@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+
+class AgeLookup:
+    """
+    Dense `person -> age` array. The age of `person` is stored at `ages[person - offset]`, people missing from the
+    synthetic population are stored as `MISSING_AGE`.
+
+    `AgeLookup.load` caches the array next to the people file as `<people_file>.age.npy` (with its offset and the
+    size/mtime of the people file it was built from in `<people_file>.age.json`) and memory-maps it read-only, so every
+    process shares the same pages. Pickling a memory-mapped lookup only sends the path of the cache, which the
+    receiving process maps again.
+    """
+    MISSING_AGE = np.iinfo(np.uint8).max
+
+    def __init__(self, offset: int, ages: np.ndarray, cache_file: Optional[Path] = None) -> None:
+        self.offset = offset
+        self.ages = ages
+        self.cache_file = cache_file
+
+    @classmethod
+    def from_people(cls, people_df: pd.DataFrame) -> 'AgeLookup':
+        """Builds the lookup from a people `DataFrame` indexed by person id."""
+        people = people_df.index.to_numpy()
+        offset = int(people.min())
+        ages = np.full(int(people.max()) - offset + 1, cls.MISSING_AGE, dtype=np.uint8)
+        ages[people - offset] = people_df.age.to_numpy()
+        return cls(offset, ages)
+
+    @classmethod
+    def load(cls, people_file: Union[str, Path]) -> 'AgeLookup':
+        """Memory-maps the cached lookup for `people_file`, building the cache first if it is missing or stale."""
+        people_file = Path(people_file)
+        cache_file, metadata_file = cls.cache_paths(people_file)
+        source = cls.source_metadata(people_file)
+
+        try:
+            with metadata_file.open() as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            metadata = None
+
+        if metadata is None or metadata['source'] != source or not cache_file.exists():
+            age_lookup = cls.from_people(read_people_ages(people_file))
+            # Write to temporary files and rename them so that concurrent readers never see a partial cache
+            temporary_cache_file = cache_file.with_name('{}.{}.tmp'.format(cache_file.name, os.getpid()))
+            with temporary_cache_file.open('wb') as f:
+                np.save(f, age_lookup.ages)
+            os.replace(temporary_cache_file, cache_file)
+            temporary_metadata_file = metadata_file.with_name('{}.{}.tmp'.format(metadata_file.name, os.getpid()))
+            with temporary_metadata_file.open('w') as f:
+                json.dump({'offset': age_lookup.offset, 'source': source}, f)
+            os.replace(temporary_metadata_file, metadata_file)
+            metadata = {'offset': age_lookup.offset}
+
+        return cls.from_cache(cache_file, metadata['offset'])
+
+    @classmethod
+    def from_cache(cls, cache_file: Path, offset: int) -> 'AgeLookup':
+        return cls(offset, np.load(cache_file, mmap_mode='r'), cache_file)
+
+    @staticmethod
+    def cache_paths(people_file: Path) -> Tuple[Path, Path]:
+        return (people_file.with_name(people_file.name + '.age.npy'),
+                people_file.with_name(people_file.name + '.age.json'))
+
+    @staticmethod
+    def source_metadata(people_file: Path) -> Dict[str, Any]:
+        stat = people_file.stat()
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def content_hash(self) -> str:
+        """Identifies the ages in the lookup, e.g. to tell whether results computed with another lookup still apply."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(self.offset).encode())
+        digest.update(np.ascontiguousarray(self.ages))
+        return digest.hexdigest()
+
+    def lookup(self, people: np.ndarray) -> np.ndarray:
+        positions = people.astype(np.int64) - self.offset
+        if len(positions) and (positions.min() < 0 or positions.max() >= len(self.ages)):
+            raise KeyError("Received people missing from the synthetic population")
+        ages = self.ages[positions]
+        if (ages == self.MISSING_AGE).any():
+            raise KeyError("Received people missing from the synthetic population")
+        return ages
+
+    def __getstate__(self) -> Dict[str, Any]:
+        if self.cache_file is None:
+            return self.__dict__
+        return {'offset': self.offset, 'cache_file': self.cache_file}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        if 'ages' in state:
+            self.__dict__.update(state)
+        else:
+            self.__dict__.update(AgeLookup.from_cache(state['cache_file'], state['offset']).__dict__)
+
+
+def read_people_ages(people_file: Path) -> pd.DataFrame:
+    """Reads only the person id (the first column) and age columns of a synthetic population people file."""
+    person_column = pd.read_csv(people_file, nrows=0).columns[0]
+    return pd.read_csv(people_file, index_col=person_column, usecols=[person_column, 'age'])
@@ -1,13 +1,24 @@
 from argparse import ArgumentParser
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from typing import Any, Dict, Optional
 
+try:
+    from .stratification import DEFAULT_AGE_CONFIG, Stratification, bin_values, expand_config, load_config
+except ImportError:
+    from stratification import DEFAULT_AGE_CONFIG, Stratification, bin_values, expand_config, load_config
 
-def main(results_dir: str) -> None:
-    """Group the age related outputs using the age groupings Sarah wants."""
-    # Hard coding the age groupings for simplicity
-    age_cutoffs = [0, 5, 18, 45, 65, 120]
-    range_labels = ["0-4", "5-17", "18-44", "45-64", "65+"]
+
+def main(results_dir: str, config: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Group the age related outputs using the age groupings in `config`, a stratification config with only an `age`
+    attribute (see `stratification.py`), by default the ones Sarah wants. The single year of age outputs of
+    `raw_output_processing.py` are regrouped, so the reports are not read again.
+    """
+    config = DEFAULT_AGE_CONFIG if config is None else config
+    if list(config) != ['age']:
+        raise ValueError("Only ages can be regrouped, received a config for: {}".format(', '.join(config)))
 
     in_file_out_file_pairings = [
         ('infections_by_age.csv', 'infections_by_age_group.csv'),
@@ -18,8 +29,12 @@ def main(results_dir: str) -> None:
         in_path = Path(results_dir) / in_file
         ungrouped_data = pd.read_csv(in_path, index_col=0)
 
-        age_range_categorizations = pd.cut(ungrouped_data.index, bins=age_cutoffs, labels=range_labels, right=False)
-        grouped_data = ungrouped_data.groupby(age_range_categorizations).sum()
+        codes, labels = bin_values(ungrouped_data.index.to_numpy(), expand_config(config)['age'],
+                                   config['age'].get('labels'))
+        grouped = codes != Stratification.MISSING_GROUP
+        grouped_data = ungrouped_data[grouped].groupby(codes[grouped]).sum().reindex(
+            np.arange(len(labels)), fill_value=0)
+        grouped_data.index = pd.Index(labels)
 
         out_path = Path(results_dir) / out_file
         grouped_data.to_csv(out_path)
@@ -28,5 +43,7 @@ def main(results_dir: str) -> None:
 if __name__ == '__main__':
     parser = ArgumentParser(description="Group the age related outputs using the age groupings Sarah wants.")
     parser.add_argument('results_dir', type=str, help='The path to directory containing all the processed output files')
+    parser.add_argument('--config', type=str, default=None,
+                        help='The path to a YAML config with the age intervals to use, e.g. wrk/univax/config.yaml')
     args = parser.parse_args()
-    main(args.results_dir)
+    main(args.results_dir, load_config(args.config) if args.config is not None else None)
@@ -0,0 +1,97 @@
+from argparse import ArgumentParser
+import ast
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+try:
+    from .event_reader import EventReader
+    from .raw_output_processing import RealizationProcessor
+except ImportError:
+    from event_reader import EventReader
+    from raw_output_processing import RealizationProcessor
+
+
+def main(report_file: Optional[str], number_of_lines: int) -> None:
+    """
+    Compares the throughput, in lines per second, of the original `ast.literal_eval` parsing loop with `EventReader`.
+    If no report file is given a synthetic one with `number_of_lines` events is written to a temporary directory.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if report_file is None:
+            report_file = Path(tmpdir) / 'report1.json_lines'
+            write_synthetic_report(report_file, number_of_lines)
+        report_file = Path(report_file)
+
+        with report_file.open() as report:
+            lines = sum(1 for _ in report)
+
+        benchmarks = [
+            ('ast.literal_eval', lambda: literal_eval_parse(report_file)),
+            ('EventReader (all fields)', lambda: consume(EventReader(report_file))),
+            ('EventReader (RealizationProcessor fields)',
+             lambda: consume(EventReader(report_file, fields=RealizationProcessor.event_fields))),
+        ]
+        for name, benchmark in benchmarks:
+            start = time.perf_counter()
+            benchmark()
+            elapsed = time.perf_counter() - start
+            print('{:<45} {:>12,.0f} lines/sec ({:.2f} seconds)'.format(name, lines / elapsed, elapsed))
+
+
+def literal_eval_parse(report_file: Path) -> None:
+    """The parsing loop `RealizationProcessor.process` used before `EventReader`."""
+    with report_file.open() as report:
+        while True:
+            line = report.readline()
+            try:
+                ast.literal_eval(line)
+            except SyntaxError:
+                break
+
+
+def consume(reader: EventReader) -> None:
+    for _ in reader:
+        pass
+
+
+def write_synthetic_report(report_file: Path, number_of_lines: int, seed: int = 1) -> None:
+    """Writes a report shaped like PHIL's: one parameters line then a mix of infection and vaccination events."""
+    rng = random.Random(seed)
+    place_types = [('H', 72), ('S', 83), ('W', 87), ('N', 78), ('C', 67), ('O', 79)]
+    with report_file.open('w') as report:
+        report.write(json.dumps({'event': 'parameters', 'days': '200', 'start_date': '2012-01-01'},
+                                sort_keys=True, separators=(',', ':')))
+        report.write('\n')
+        for _ in range(number_of_lines - 1):
+            person = rng.randrange(1200000)
+            if rng.random() < 0.2:
+                event = {'event': 'vaccination', 'person': person, 'vaccine': 0, 'vaccine_day': rng.randrange(180)}
+            else:
+                exposed = rng.randrange(180)
+                infectious = exposed + rng.randrange(1, 3)
+                symptomatic = infectious + rng.randrange(2) if rng.random() < 0.67 else -1
+                label, place_type = rng.choice(place_types)
+                place = rng.randrange(400000)
+                event = {
+                    'event': 'infection', 'person': person, 'disease': 0, 'exposed': exposed,
+                    'infectious': infectious, 'symptomatic': symptomatic,
+                    'recovered': infectious + rng.randrange(3, 8), 'susceptible': -1,
+                    'infector': rng.randrange(1200000), 'place': place,
+                    'place_label': '{}{}'.format(label, place), 'place_type': place_type,
+                }
+            report.write(json.dumps(event, sort_keys=True, separators=(',', ':')))
+            report.write('\n')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Benchmarks parsing of PHIL's JSON-lines event report.")
+    parser.add_argument('--report_file', type=str, default=None,
+                        help='The report to parse, a synthetic report is generated if not given')
+    parser.add_argument('--number_of_lines', type=int, default=1000000,
+                        help='The number of lines in the synthetic report')
+    args = parser.parse_args()
+    main(args.report_file, args.number_of_lines)
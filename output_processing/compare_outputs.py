@@ -0,0 +1,45 @@
+from argparse import ArgumentParser
+import sys
+import pandas as pd
+from pathlib import Path
+
+OUTPUT_FILES = [
+    'ages_vaccinated.csv',
+    'infections_by_age.csv',
+    'new_infections_by_day.csv',
+    'total_infected_by_day.csv',
+]
+
+
+def main(expected_dir: str, actual_dir: str) -> bool:
+    """
+    Regression check for `raw_output_processing.py`: compares the 4 processed output files in `actual_dir` with the
+    ones previously written to `expected_dir` from the same realizations and reports any that differ. The order of the
+    realization columns is ignored, as it depends on the order the realizations were processed in.
+    """
+    all_match = True
+    for filename in OUTPUT_FILES:
+        expected = sort_realizations(pd.read_csv(Path(expected_dir) / filename, index_col=0))
+        actual = sort_realizations(pd.read_csv(Path(actual_dir) / filename, index_col=0))
+        try:
+            pd.testing.assert_frame_equal(expected, actual)
+            print('{}: match'.format(filename))
+        except AssertionError as error:
+            all_match = False
+            print('{}: MISMATCH\n{}'.format(filename, error))
+    return all_match
+
+
+def sort_realizations(data: pd.DataFrame) -> pd.DataFrame:
+    columns = sorted(range(len(data.columns)), key=lambda column: tuple(data.iloc[:, column]))
+    data = data.iloc[:, columns]
+    data.columns = range(len(columns))
+    return data
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Compares processed PHIL output files with a previous set of output files.")
+    parser.add_argument('expected_dir', type=str, help='The path to directory containing the expected output files')
+    parser.add_argument('actual_dir', type=str, help='The path to directory containing the output files to check')
+    args = parser.parse_args()
+    sys.exit(0 if main(args.expected_dir, args.actual_dir) else 1)
@@ -0,0 +1,323 @@
+from collections import OrderedDict, defaultdict
+import datetime
+import hashlib
+from operator import itemgetter
+import numpy as np
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+try:
+    from . import fsz
+except ImportError:
+    import fsz
+
+try:
+    # ujson is noticeably faster than the standard library decoder, but the standard library decoder is also C
+    # accelerated so it is a perfectly good fallback.
+    import ujson as json
+except ImportError:
+    import json
+
+
+# The columns PHIL writes for each type of event along with the dtype each column is stored as in an `EventBatch`.
+EVENT_FIELDS = {
+    'infection': OrderedDict([
+        ('person', np.int32),
+        ('disease', np.int16),
+        ('exposed', np.int32),
+        ('infectious', np.int32),
+        ('symptomatic', np.int32),
+        ('recovered', np.int32),
+        ('susceptible', np.int32),
+        ('infector', np.int32),
+        ('place', np.int32),
+        ('place_label', object),
+        ('place_type', np.int8),
+    ]),
+    'vaccination': OrderedDict([
+        ('person', np.int32),
+        ('vaccine', np.int16),
+        ('vaccine_day', np.int32),
+    ]),
+}
+
+# The records PHIL writes to the binary event report files with `event_report_format = binary`, see `src/Report.h`.
+# Each file starts with a `BINARY_REPORT_HEADER` and is followed by back-to-back records of the event type's dtype.
+BINARY_EVENT_DTYPES = {
+    'infection': np.dtype([
+        ('person', '<i4'),
+        ('disease', '<i4'),
+        ('exposed', '<i4'),
+        ('infectious', '<i4'),
+        ('symptomatic', '<i4'),
+        ('recovered', '<i4'),
+        ('susceptible', '<i4'),
+        ('infector', '<i4'),
+        ('place', '<i4'),
+        ('place_type', 'i1'),
+        ('place_label', 'S31'),
+    ]),
+    'vaccination': np.dtype([
+        ('person', '<i4'),
+        ('vaccine', '<i4'),
+        ('vaccine_day', '<i4'),
+    ]),
+}
+BINARY_REPORT_HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('record_size', '<u4')])
+BINARY_REPORT_MAGIC = b'PHILEVT'
+BINARY_REPORT_VERSION = 1
+
+DEFAULT_BATCH_SIZE = 1 << 16
+DEFAULT_BUFFER_SIZE = 1 << 24
+
+_EVENT_MARKER = b'"event":"'
+_JSON_LINES_SUFFIX = '.json_lines'
+
+
+class ParametersRecord(NamedTuple):
+    """The `parameters` event PHIL writes as the first line of every report."""
+    values: Dict[str, str]
+
+    @property
+    def start_date(self) -> datetime.datetime:
+        return datetime.datetime.fromisoformat(self.values['start_date'])
+
+
+class EventBatch(NamedTuple):
+    """A batch of events of a single type, stored as one typed `numpy` array per requested field."""
+    event: str
+    columns: Dict[str, np.ndarray]
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+
+class EventReader:
+    """
+    Streams a PHIL JSON-lines event report as `EventBatch`es of at most `batch_size` events.
+
+    `fields` maps each event type the caller wants to the fields it wants from that event, e.g.
+    `{'infection': ['person', 'infectious', 'recovered']}`. Events of any other type are skipped without being decoded
+    and only the requested fields are kept. When `fields` is `None` every field of every known event type is read.
+    The parameters record is always yielded, before any batch. Batches of different event types are not interleaved in
+    file order. If a `hashlib` `digest` is given it is updated with the raw contents of the report as it is read.
+
+    Reports PHIL wrote with `compress_event_report = 1` (`report1.json_lines.fsz`) are read the same way, with their
+    blocks decompressed by `number_of_threads` threads, see `fsz.read_blocks`.
+    """
+    def __init__(self, report_file: Union[str, Path], fields: Optional[Dict[str, Iterable[str]]] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 digest: Optional['hashlib._Hash'] = None, number_of_threads: Optional[int] = None) -> None:
+        self.report_file = Path(report_file)
+        self.strict = fields is None
+        if fields is None:
+            fields = {event: list(event_fields) for event, event_fields in EVENT_FIELDS.items()}
+        self.fields = {event: list(event_fields) for event, event_fields in fields.items()}
+        for event, event_fields in self.fields.items():
+            unknown_fields = set(event_fields) - set(EVENT_FIELDS.get(event, {}))
+            if unknown_fields:
+                raise ValueError("Unknown fields for {} events: {}".format(event, sorted(unknown_fields)))
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.digest = digest
+        self.number_of_threads = number_of_threads
+
+    def __iter__(self) -> Iterator[Union[ParametersRecord, EventBatch]]:
+        getters = {event: self._row_getter(event_fields) for event, event_fields in self.fields.items()}
+        rows = defaultdict(list)
+
+        for lines in self._read_lines():
+            for line in lines:
+                event = self._event_type(line)
+                if event is None:
+                    # Blank line
+                    continue
+
+                if event == 'parameters':
+                    record = json.loads(line)
+                    del record['event']
+                    yield ParametersRecord(record)
+                elif event in getters:
+                    event_rows = rows[event]
+                    event_rows.append(getters[event](json.loads(line)))
+                    if len(event_rows) >= self.batch_size:
+                        yield self._make_batch(event, event_rows)
+                        rows[event] = []
+                elif self.strict:
+                    raise RuntimeError("Received an unexpected event type: {}".format(line))
+
+        for event, event_rows in rows.items():
+            if event_rows:
+                yield self._make_batch(event, event_rows)
+
+    def _read_lines(self) -> Iterator[List[bytes]]:
+        """Yields the lines of the report in chunks, decompressing the blocks of fsz compressed reports in parallel."""
+        if fsz.is_fsz_file(self.report_file):
+            for block in fsz.read_blocks(self.report_file, self.number_of_threads, digest=self.digest):
+                yield block.splitlines(keepends=True)
+            return
+
+        with self.report_file.open('rb', buffering=self.buffer_size) as report:
+            while True:
+                lines = report.readlines(self.buffer_size)
+                if not lines:
+                    break
+                if self.digest is not None:
+                    self.digest.update(b''.join(lines))
+                yield lines
+
+    @staticmethod
+    def _event_type(line: bytes) -> Optional[str]:
+        """Finds the event type of a line without decoding the whole line."""
+        start = line.find(_EVENT_MARKER)
+        if start == -1:
+            if not line.strip():
+                return None
+            # Not written by PHIL's compact JSON writer, so fall back on decoding the line
+            return json.loads(line)['event']
+        start += len(_EVENT_MARKER)
+        return line[start:line.index(b'"', start)].decode()
+
+    @staticmethod
+    def _row_getter(event_fields: List[str]) -> Callable[[Dict], tuple]:
+        if len(event_fields) == 1:
+            # itemgetter only returns a tuple when asked for more than one item
+            field = event_fields[0]
+            return lambda record: (record[field],)
+        return itemgetter(*event_fields)
+
+    def _make_batch(self, event: str, rows: List[tuple]) -> EventBatch:
+        dtypes = EVENT_FIELDS[event]
+        columns = {
+            field: np.array(values, dtype=dtypes[field])
+            for field, values in zip(self.fields[event], zip(*rows))
+        }
+        return EventBatch(event, columns)
+
+
+class BinaryEventReader:
+    """
+    Reads the binary event report files PHIL writes with `event_report_format = binary` as `EventBatch`es, taking the
+    same arguments as `EventReader`. `report_file` is the JSON-lines report, which then only holds the parameters
+    record, and the events are read from the `binary_report_path`s next to it.
+
+    Each file is memory-mapped and every batch is a slice of it, so reading a field costs a strided copy rather than
+    any parsing. `place_label`s are only decoded when asked for. If a `hashlib` `digest` is given it is updated with
+    the raw contents of the JSON-lines report followed by those of each binary file read.
+    """
+    def __init__(self, report_file: Union[str, Path], fields: Optional[Dict[str, Iterable[str]]] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 digest: Optional['hashlib._Hash'] = None) -> None:
+        self.report_file = Path(report_file)
+        if fields is None:
+            fields = {event: list(event_fields) for event, event_fields in EVENT_FIELDS.items()}
+        self.fields = {event: list(event_fields) for event, event_fields in fields.items()}
+        for event, event_fields in self.fields.items():
+            unknown_fields = set(event_fields) - set(EVENT_FIELDS.get(event, {}))
+            if unknown_fields:
+                raise ValueError("Unknown fields for {} events: {}".format(event, sorted(unknown_fields)))
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.digest = digest
+
+    def __iter__(self) -> Iterator[Union[ParametersRecord, EventBatch]]:
+        # Only the parameters record is read from the JSON-lines report
+        yield from EventReader(self.report_file, fields={}, buffer_size=self.buffer_size, digest=self.digest)
+
+        for event, event_fields in self.fields.items():
+            records = self.read_records(event)
+            for start in range(0, len(records), self.batch_size):
+                batch = records[start:start + self.batch_size]
+                if self.digest is not None:
+                    self.digest.update(batch)
+                yield EventBatch(event, {field: self._column(event, field, batch) for field in event_fields})
+
+    def read_records(self, event: str) -> np.ndarray:
+        """Memory-maps the records of the `event` binary file, after checking its header."""
+        path = binary_report_path(self.report_file, event)
+        dtype = BINARY_EVENT_DTYPES[event]
+        with path.open('rb') as f:
+            header = np.fromfile(f, dtype=BINARY_REPORT_HEADER, count=1)
+        if len(header) != 1 or header['magic'][0] != BINARY_REPORT_MAGIC:
+            raise RuntimeError("{} is not a PHIL binary event report".format(path))
+        if header['version'][0] != BINARY_REPORT_VERSION or header['record_size'][0] != dtype.itemsize:
+            raise RuntimeError(
+                "{} has version {} with {} byte records, expected version {} with {} byte records".format(
+                    path, header['version'][0], header['record_size'][0], BINARY_REPORT_VERSION, dtype.itemsize))
+
+        if self.digest is not None:
+            self.digest.update(header)
+        size = path.stat().st_size - BINARY_REPORT_HEADER.itemsize
+        if size % dtype.itemsize:
+            raise RuntimeError("{} ends with a partial record".format(path))
+        if size == 0:
+            # numpy cannot memory-map an empty range
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', offset=BINARY_REPORT_HEADER.itemsize)
+
+    @staticmethod
+    def _column(event: str, field: str, records: np.ndarray) -> np.ndarray:
+        dtype = EVENT_FIELDS[event][field]
+        if dtype is object:
+            return np.char.decode(records[field]).astype(object)
+        return records[field].astype(dtype)
+
+
+def binary_report_path(report_file: Union[str, Path], event: str) -> Path:
+    """The binary file PHIL writes `event` events to, e.g. `OUT/report1.infection.bin` for `OUT/report1.json_lines`."""
+    report_file = Path(report_file)
+    name = report_file.name
+    for suffix in [fsz.FSZ_SUFFIX, _JSON_LINES_SUFFIX]:
+        if name.endswith(suffix) and len(name) > len(suffix):
+            name = name[:-len(suffix)]
+    return report_file.with_name('{}.{}.bin'.format(name, event))
+
+
+def read_parameters_record(report_file: Union[str, Path]) -> Optional[ParametersRecord]:
+    """The parameters record at the start of `report_file`, reading no further than it."""
+    for record in EventReader(report_file, fields={}, buffer_size=1 << 16):
+        if isinstance(record, ParametersRecord):
+            return record
+    return None
+
+
+def is_binary_report(report_file: Union[str, Path]) -> bool:
+    """
+    Whether PHIL wrote the events of `report_file` to binary files, i.e. with `event_report_format = binary`.
+
+    The parameters record decides, so that binary files left in the same directory by an earlier binary run do not
+    count. PHIL opens the binary files before it writes the report, so their mtimes cannot tell a stale file apart.
+    Reports whose parameters record has no `event_report_format` predate the binary format.
+    """
+    if not all(binary_report_path(report_file, event).exists() for event in BINARY_EVENT_DTYPES):
+        return False
+    record = read_parameters_record(report_file)
+    return record is not None and record.values.get('event_report_format') == 'binary'
+
+
+def report_source_files(report_file: Union[str, Path]) -> List[Path]:
+    """
+    Every file `open_report` reads `report_file` from: the report itself and, for binary reports, the binary file of
+    each event type. They are listed in the order a reader of every event type updates its `digest` with them, so
+    hashing them one after the other gives the same digest as reading the report.
+    """
+    files = [Path(report_file)]
+    if is_binary_report(report_file):
+        files.extend(binary_report_path(report_file, event) for event in BINARY_EVENT_DTYPES)
+    return files
+
+
+def stat_files(paths: Iterable[Path]) -> List[Dict[str, Any]]:
+    """The name, size and mtime of each of `paths`, e.g. to key results read from the `report_source_files`."""
+    stats = []
+    for path in paths:
+        stat = path.stat()
+        stats.append({'name': path.name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+    return stats
+
+
+def open_report(report_file: Union[str, Path], fields: Optional[Dict[str, Iterable[str]]] = None,
+                **kwargs: Any) -> Union[EventReader, BinaryEventReader]:
+    """Returns a `BinaryEventReader` if the report was written in the binary format and an `EventReader` otherwise."""
+    reader = BinaryEventReader if is_binary_report(report_file) else EventReader
+    return reader(report_file, fields=fields, **kwargs)
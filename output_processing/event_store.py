@@ -0,0 +1,156 @@
+from argparse import ArgumentParser
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+try:
+    from . import fsz
+    from .event_reader import EVENT_FIELDS, ParametersRecord, open_report, report_source_files, stat_files
+except ImportError:
+    import fsz
+    from event_reader import EVENT_FIELDS, ParametersRecord, open_report, report_source_files, stat_files
+
+VERSION = 2
+METADATA_FILE = 'metadata.json'
+
+
+def available() -> bool:
+    """Whether pyarrow, which the event store needs, is installed."""
+    return pa is not None
+
+
+def store_path(report_file: Union[str, Path]) -> Path:
+    """
+    The event store converted from `report_file`, e.g. `OUT/report1.events/` for `OUT/report1.json_lines` or
+    `OUT/report1.json_lines.fsz`.
+    """
+    report_file = Path(report_file)
+    if report_file.suffix == fsz.FSZ_SUFFIX:
+        report_file = report_file.with_suffix('')
+    return report_file.with_suffix('.events')
+
+
+def convert_report(report_file: Union[str, Path], store_dir: Optional[Union[str, Path]] = None) -> Path:
+    """
+    Converts a PHIL JSON-lines event report to a columnar event store: a directory holding one Parquet file per event
+    type (`infection.parquet`, `vaccination.parquet`) and a `metadata.json` with the parameters record, the size and
+    mtime of each file the report was read from (see `event_reader.report_source_files`) and their content hash. Day
+    columns are stored as integers and `place_label` is dictionary-encoded. Each batch read from the report becomes a
+    row group, so readers can skip row groups using their column statistics. Binary event reports (see
+    `event_reader.BinaryEventReader`) are converted the same way.
+    """
+    _require_pyarrow()
+    report_file = Path(report_file)
+    store_dir = store_path(report_file) if store_dir is None else Path(store_dir)
+    temporary_dir = store_dir.with_name('{}.{}.tmp'.format(store_dir.name, os.getpid()))
+    temporary_dir.mkdir(parents=True)
+
+    sources = stat_files(report_source_files(report_file))
+    digest = hashlib.blake2b(digest_size=16)
+    parameters = {}
+    writers = {}
+    try:
+        for batch in open_report(report_file, digest=digest):
+            if isinstance(batch, ParametersRecord):
+                parameters = batch.values
+                continue
+            if batch.event not in writers:
+                writers[batch.event] = pq.ParquetWriter(
+                    str(temporary_dir / '{}.parquet'.format(batch.event)), event_schema(batch.event))
+            writers[batch.event].write_table(to_table(batch.event, batch.columns))
+
+        # Every event type gets a file, even if there were no events of that type
+        for event in EVENT_FIELDS:
+            if event not in writers:
+                writers[event] = pq.ParquetWriter(str(temporary_dir / '{}.parquet'.format(event)), event_schema(event))
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    metadata = {
+        'version': VERSION,
+        'parameters': parameters,
+        'source': {'files': sources, 'content_hash': digest.hexdigest()},
+    }
+    with (temporary_dir / METADATA_FILE).open('w') as f:
+        json.dump(metadata, f)
+
+    if store_dir.exists():
+        shutil.rmtree(store_dir)
+    os.replace(temporary_dir, store_dir)
+    return store_dir
+
+
+def event_schema(event: str) -> 'pa.Schema':
+    return pa.schema([
+        (field, pa.dictionary(pa.int32(), pa.string()) if dtype is object else pa.from_numpy_dtype(dtype))
+        for field, dtype in EVENT_FIELDS[event].items()
+    ])
+
+
+def to_table(event: str, columns: Dict[str, np.ndarray]) -> 'pa.Table':
+    schema = event_schema(event)
+    arrays = []
+    for field in schema:
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(columns[field.name], type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(columns[field.name], type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def read_metadata(store_dir: Union[str, Path]) -> Dict[str, Any]:
+    with (Path(store_dir) / METADATA_FILE).open() as f:
+        return json.load(f)
+
+
+def is_current(store_dir: Union[str, Path], report_file: Union[str, Path]) -> bool:
+    """
+    Whether `store_dir` is a complete event store converted from the current contents of `report_file`, and of the
+    binary files its events were read from if any. A store whose report has since been deleted is still considered
+    current.
+    """
+    try:
+        metadata = read_metadata(store_dir)
+    except (OSError, ValueError):
+        return False
+    if metadata.get('version') != VERSION:
+        return False
+    report_file = Path(report_file)
+    if not report_file.exists():
+        return True
+    return metadata['source']['files'] == stat_files(report_source_files(report_file))
+
+
+def read_events(store_dir: Union[str, Path], event: str, columns: Optional[List[str]] = None,
+                filters: Optional[Sequence[Tuple[str, str, Any]]] = None) -> 'pa.Table':
+    """
+    Reads the `event` events from an event store. Only the requested `columns` are read, and `filters` (in
+    `pyarrow.parquet` form, e.g. `[('place_type', '==', 83)]`) are used to skip row groups as well as rows.
+    """
+    _require_pyarrow()
+    return pq.read_table(str(Path(store_dir) / '{}.parquet'.format(event)), columns=columns, filters=filters)
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("The event store requires pyarrow, install it with `pip install pyarrow`")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Converts PHIL JSON-lines event reports to columnar event stores.")
+    parser.add_argument('report_files', type=str, nargs='+', help='The paths to the event reports to convert')
+    args = parser.parse_args()
+    for report_file in args.report_files:
+        print('Converted {} to {}'.format(report_file, convert_report(report_file)))
@@ -0,0 +1,91 @@
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Tuple, Union
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+# The framing written by PHIL's `fsz -c` and by PHIL itself with `compress_event_report = 1` (see `src/Compression.cc`):
+# the magic bytes, followed by blocks of snappy compressed data, each preceded by its compressed size as a native
+# `size_t`. Every block ends on a newline, so blocks can be decompressed and parsed independently.
+FSZ_MAGIC = b'FSZ 20100404 v01'
+FSZ_SUFFIX = '.fsz'
+_BLOCK_HEADER = struct.Struct('=Q')
+
+
+def available() -> bool:
+    """Whether python-snappy, which decompressing fsz files needs, is installed."""
+    return snappy is not None
+
+
+def is_fsz_file(path: Union[str, Path]) -> bool:
+    with Path(path).open('rb') as f:
+        return f.read(len(FSZ_MAGIC)) == FSZ_MAGIC
+
+
+def read_compressed_blocks(f: BinaryIO) -> Iterator[Tuple[bytes, bytes]]:
+    """Yields the raw header and compressed data of each block of an open fsz file, positioned after its magic bytes."""
+    while True:
+        header = f.read(_BLOCK_HEADER.size)
+        if not header:
+            return
+        if len(header) < _BLOCK_HEADER.size:
+            raise RuntimeError("{} ends with a partial block header".format(f.name))
+        compressed_size, = _BLOCK_HEADER.unpack(header)
+        block = f.read(compressed_size)
+        if len(block) < compressed_size:
+            raise RuntimeError("{} ends with a partial block".format(f.name))
+        yield header, block
+
+
+def read_blocks(path: Union[str, Path], number_of_threads: Optional[int] = None, read_ahead: Optional[int] = None,
+                digest: Optional['hashlib._Hash'] = None) -> Iterator[bytes]:
+    """
+    Yields the decompressed blocks of an fsz file in order. Blocks are decompressed by `number_of_threads` threads
+    (snappy releases the GIL), with at most `read_ahead` blocks (twice the number of threads by default) read or
+    decompressed ahead of the one being consumed, so memory use stays bounded however large the file is. If a `hashlib`
+    `digest` is given it is updated with the raw contents of the file as it is read.
+    """
+    _require_snappy()
+    number_of_threads = number_of_threads or os.cpu_count() or 1
+    read_ahead = read_ahead or 2 * number_of_threads
+    with Path(path).open('rb') as f:
+        magic = f.read(len(FSZ_MAGIC))
+        if magic != FSZ_MAGIC:
+            raise RuntimeError("{} is not an fsz file".format(path))
+        if digest is not None:
+            digest.update(magic)
+
+        with ThreadPoolExecutor(max_workers=number_of_threads) as executor:
+            pending = deque()
+            for header, block in read_compressed_blocks(f):
+                if digest is not None:
+                    digest.update(header)
+                    digest.update(block)
+                pending.append(executor.submit(snappy.uncompress, block))
+                if len(pending) >= read_ahead:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+def _require_snappy() -> None:
+    if snappy is None:
+        raise ImportError("Reading fsz files requires python-snappy, install it with `pip install python-snappy`")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Decompresses an fsz file written by PHIL to stdout, like `fsz -u`.")
+    parser.add_argument('fsz_file', type=str, help='The path to the fsz file to decompress')
+    parser.add_argument('--threads', type=int, default=None, help='The number of threads to decompress blocks with')
+    args = parser.parse_args()
+    for decompressed_block in read_blocks(args.fsz_file, args.threads):
+        sys.stdout.buffer.write(decompressed_block)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+Compares the time and peak memory of OutputCollection.read_event_report with
+the list of dicts reader it replaced, on a synthetic event report or a given
+one.  Each reader runs in its own process, and the peak memory reported is
+how far that process grew beyond its size when it started.
+"""
+
+import argparse, os, random, resource, shutil, tempfile, time
+from collections import defaultdict
+from multiprocessing import Process, Queue
+
+import pandas as pd
+import ujson
+
+from convert_output import AutoDetectFile, EVENT_CHUNK_SIZE, read_json_event_report
+
+def read_event_report_dicts(filename):
+    """The read_event_report loop before the events were read into typed columns"""
+    output_lists = defaultdict(list)
+    with AutoDetectFile(filename) as f:
+        for line in f:
+            j = ujson.loads(line)
+            output_lists[j.pop('event')].append(j)
+    return {k:pd.DataFrame(v) for k,v in output_lists.iteritems()}
+
+def write_synthetic_report(filename, n_events, seed=1):
+    """
+    Writes a report shaped like PHIL's: a parameters line then a mix of
+    infection and vaccination events
+    """
+    rng = random.Random(seed)
+    place_types = [('H', 72), ('S', 83), ('W', 87), ('N', 78), ('C', 67), ('O', 79)]
+    with open(filename, 'w') as f:
+        f.write(ujson.dumps({'event': 'parameters', 'days': '200',
+            'start_date': '2012-01-01'}) + '\n')
+        for _ in xrange(n_events):
+            person = rng.randrange(1200000)
+            if rng.random() < 0.2:
+                event = {'event': 'vaccination', 'person': person,
+                        'vaccine': 0, 'vaccine_day': rng.randrange(180)}
+            else:
+                exposed = rng.randrange(180)
+                infectious = exposed + rng.randrange(1, 3)
+                symptomatic = infectious + rng.randrange(2) if rng.random() < 0.67 else -1
+                label, place_type = rng.choice(place_types)
+                place = rng.randrange(400000)
+                event = {'event': 'infection', 'person': person, 'disease': 0,
+                        'exposed': exposed, 'infectious': infectious,
+                        'symptomatic': symptomatic,
+                        'recovered': infectious + rng.randrange(3, 8),
+                        'susceptible': -1, 'infector': rng.randrange(1200000),
+                        'place': place, 'place_label': '%s%d' % (label, place),
+                        'place_type': place_type}
+            f.write(ujson.dumps(event) + '\n')
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def run(reader, filename, results):
+    start_rss = max_rss_mb()
+    tic = time.time()
+    events = reader(filename)
+    elapsed = time.time() - tic
+    size = sum(d.memory_usage(index=True, deep=True).sum()
+            for d in events.itervalues()) / float(1 << 20)
+    results.put((elapsed, max_rss_mb() - start_rss, size))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--reportfile', required=False,
+            help='The report to read, a synthetic report is written if not given')
+    parser.add_argument('-n', '--events', required=False, type=int,
+            default=10000000, help='The number of events in the synthetic report')
+    parser.add_argument('-c', '--chunk_size', required=False, type=int,
+            default=EVENT_CHUNK_SIZE,
+            help='The number of events read_event_report decodes at a time')
+    args = parser.parse_args()
+
+    tmpdir = None
+    filename = args.reportfile
+    if filename is None:
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'report1.json_lines')
+        write_synthetic_report(filename, args.events)
+    try:
+        readers = [
+            ('list of dicts', read_event_report_dicts),
+            ('typed columns', lambda f: read_json_event_report(f, args.chunk_size)),
+        ]
+        for name, reader in readers:
+            results = Queue()
+            p = Process(target=run, args=(reader, filename, results))
+            p.start()
+            elapsed, peak, size = results.get()
+            p.join()
+            print('%-15s %8.1f seconds %10.0f MB peak %10.0f MB of events' % (
+                name, elapsed, peak, size))
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,27 @@
 import pandas as pd
 import numpy as np
-import ujson, yaml, time, bz2, gzip, os, re
+import ujson, yaml, time, bz2, zlib, os, re, json, hashlib, shutil
 try:
     import lzma
 except ImportError as e:
     import backports.lzma as lzma
-from collections import OrderedDict, defaultdict
+try:
+    import pyarrow.parquet as pq
+except ImportError as e:
+    pq = None
+try:
+    import snappy
+except ImportError as e:
+    snappy = None
+try:
+    import zstandard as zstd
+except ImportError as e:
+    zstd = None
+from collections import OrderedDict, deque
+from operator import itemgetter
+from multiprocessing.pool import Pool, ThreadPool
+import struct
+import numbers
 #import pyximport
 #pyximport.install(reload_support=True)
 #import cyprinev.count_events as count_events
@@ -28,25 +44,470 @@ class Timer():
         self.tic = toc
         return t
 
+class ParallelDecompressedFile(object):
+    """
+    Reads a compressed file line by line, decompressing its blocks in
+    parallel by a pool of threads and keeping at most read_ahead blocks in
+    memory ahead of the current one.  compressed_blocks yields the raw
+    blocks of the file, at most about block_size bytes each, as (data,
+    independent) pairs.  Independent blocks start a compressed stream and
+    are decompressed by the pool; the rest continue the stream of the
+    block before them and are decompressed in order by the reading thread.
+    A block that turns out not to start a stream after all, because the
+    one before it has not ended, is read as a continuation too.
+    """
+    block_size = 1 << 22
+
+    def __init__(self, filename, mode='r', threads=4, read_ahead=8):
+        self.filename = filename
+        self.f = open(filename, 'rb')
+        self.pool = ThreadPool(threads)
+        self.read_ahead = read_ahead
+
+    def compressed_blocks(self):
+        raise NotImplementedError
+
+    def decompressor(self):
+        return None
+
+    def decompress(self, d, data):
+        """Returns the decompressed data and the decompressor to go on with"""
+        raise NotImplementedError
+
+    def ended(self, d):
+        return True
+
+    def decompress_independent(self, data):
+        try:
+            return self.decompress(self.decompressor(), data), None
+        except Exception as e:
+            return None, e
+
+    def blocks(self):
+        pending = deque()
+        d = None
+        for data, independent in self.compressed_blocks():
+            result = None
+            if independent:
+                result = self.pool.apply_async(self.decompress_independent, (data,))
+            pending.append((data, independent, result))
+            if len(pending) >= self.read_ahead:
+                block, d = self.next_block(pending.popleft(), d)
+                yield block
+        while pending:
+            block, d = self.next_block(pending.popleft(), d)
+            yield block
+        if d is not None and not self.ended(d):
+            raise IOError('%s ends in the middle of a compressed stream' % self.filename)
+
+    def next_block(self, entry, d):
+        data, independent, result = entry
+        if independent and (d is None or self.ended(d)):
+            decompressed, e = result.get()
+            if e is not None:
+                raise e
+            return decompressed
+        if d is None:
+            d = self.decompressor()
+        return self.decompress(d, data)
+
+    def __iter__(self):
+        rest = b''
+        for block in self.blocks():
+            lines = (rest + block).splitlines(True)
+            rest = lines.pop() if lines and not lines[-1].endswith(b'\n') else b''
+            for line in lines:
+                yield line
+        if rest:
+            yield rest
+
+    def close(self):
+        self.pool.terminate()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class FszFile(ParallelDecompressedFile):
+    """
+    Reads a file compressed with PHIL's fsz framing (fsz -c, or PHIL's
+    compress_event_report = 1 event reports), whose snappy compressed
+    blocks are independent.
+    """
+    magic = b'FSZ 20100404 v01'
+    block_header = struct.Struct('=Q')
+
+    def __init__(self, filename, mode='r', threads=4, read_ahead=8):
+        if snappy is None:
+            raise ImportError('Reading fsz files requires python-snappy')
+        super(FszFile, self).__init__(filename, mode, threads, read_ahead)
+        if self.f.read(len(self.magic)) != self.magic:
+            raise IOError('%s is not an fsz file' % filename)
+
+    def compressed_blocks(self):
+        while True:
+            header = self.f.read(self.block_header.size)
+            if not header:
+                return
+            size, = self.block_header.unpack(header)
+            yield self.f.read(size), True
+
+    def decompress(self, d, data):
+        return snappy.uncompress(data), d
+
+class SnappyFramedFile(ParallelDecompressedFile):
+    """
+    Reads a file in the snappy framing format (e.g. written by
+    python -m snappy -c), whose chunks of at most 64KB are independent.
+    Chunks are gathered into blocks of about block_size bytes.
+    """
+    magic = b'\xff\x06\x00\x00sNaPpY'
+    chunk_header = struct.Struct('<I')
+
+    def __init__(self, filename, mode='r', threads=4, read_ahead=8):
+        if snappy is None:
+            raise ImportError('Reading snappy framed files requires python-snappy')
+        super(SnappyFramedFile, self).__init__(filename, mode, threads, read_ahead)
+
+    def compressed_blocks(self):
+        chunks, size = [], 0
+        while True:
+            header = self.f.read(self.chunk_header.size)
+            if not header:
+                break
+            if len(header) < self.chunk_header.size:
+                raise IOError('%s ends with a partial chunk header' % self.filename)
+            n, = self.chunk_header.unpack(header)
+            chunk_type, length = n & 0xff, n >> 8
+            data = self.f.read(length)
+            # 0 is compressed and 1 uncompressed data, after a 4 byte crc;
+            # the rest are stream identifiers, padding and skippable chunks
+            if chunk_type in (0, 1):
+                chunks.append((chunk_type, data[4:]))
+                size += length
+            elif chunk_type < 0x80 and chunk_type != 0xff:
+                raise IOError('%s has a chunk of unknown type %d' % (
+                    self.filename, chunk_type))
+            if size >= self.block_size:
+                yield chunks, True
+                chunks, size = [], 0
+        if chunks:
+            yield chunks, True
+
+    def decompress(self, d, data):
+        return b''.join(snappy.uncompress(chunk) if chunk_type == 0 else chunk
+                for chunk_type, chunk in data), d
+
+class MultiStreamFile(ParallelDecompressedFile):
+    """
+    Reads a file of concatenated compressed streams, like those written by
+    pbzip2 or bgzip, decompressing the streams in parallel.  The file is
+    cut into blocks at the last candidate stream start (a match of
+    stream_start) in each block_size bytes read.  A candidate that is not
+    really a stream start leaves the stream before it unended, so the
+    block it starts is read as a continuation.  A single stream longer
+    than block_size, like that of a plain bzip2 or gzip file, is read in
+    order by the reading thread as before.
+    """
+    stream_start = None
+
+    def compressed_blocks(self):
+        data = b''
+        independent = True
+        while True:
+            read = self.f.read(self.block_size)
+            data += read
+            if not read:
+                if data:
+                    yield data, independent
+                return
+            last = None
+            for m in self.stream_start.finditer(data, 1):
+                last = m.start()
+            if last is not None:
+                yield data[:last], independent
+                data, independent = data[last:], True
+            elif len(data) >= self.block_size:
+                # Keep enough to find a stream start cut by the end of the block
+                keep = len(self.stream_start.pattern)
+                yield data[:-keep], independent
+                data, independent = data[-keep:], False
+
+    def decompress(self, d, data):
+        decompressed = []
+        while data:
+            if self.ended(d):
+                d = self.decompressor()
+            decompressed.append(d.decompress(data))
+            data = d.unused_data if self.ended(d) else b''
+        return b''.join(decompressed), d
+
+class MultiStreamBZ2File(MultiStreamFile):
+    stream_start = re.compile(b'BZh[1-9]1AY&SY')
+
+    def decompressor(self):
+        return bz2.BZ2Decompressor()
+
+    def ended(self, d):
+        if hasattr(d, 'eof'):
+            return d.eof
+        try:
+            d.decompress(b'')
+        except EOFError:
+            return True
+        return False
+
+class MultiMemberGzipFile(MultiStreamFile):
+    # The gzip magic, deflate and no reserved flags
+    stream_start = re.compile(b'\x1f\x8b\x08[\x00-\x1f]')
+
+    def decompressor(self):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def ended(self, d):
+        if hasattr(d, 'eof'):
+            return d.eof
+        if d.unused_data:
+            return True
+        # A byte past the end of a stream is left unused
+        probe = d.copy()
+        try:
+            probe.decompress(b'\x00')
+        except zlib.error:
+            return False
+        return bool(probe.unused_data)
+
+class ZstdFile(ParallelDecompressedFile):
+    """
+    Reads a zstd file, decompressing its frames in parallel; pzstd and
+    zstd --block-size write several.  The frames are found by walking the
+    headers of their blocks, and a frame longer than block_size is read in
+    order by the reading thread.
+    """
+    magic = 0xFD2FB528
+    skippable = (0x184D2A50, 0x184D2A5F)
+    block_header = struct.Struct('<I')
+
+    def __init__(self, filename, mode='r', threads=4, read_ahead=8):
+        if zstd is None:
+            raise ImportError('Reading zstd files requires zstandard')
+        super(ZstdFile, self).__init__(filename, mode, threads, read_ahead)
+
+    def read(self, size):
+        data = self.f.read(size)
+        if len(data) < size:
+            raise IOError('%s ends in the middle of a frame' % self.filename)
+        return data
+
+    def compressed_blocks(self):
+        while True:
+            header = self.f.read(4)
+            if not header:
+                return
+            if len(header) < 4:
+                raise IOError('%s ends with a partial frame header' % self.filename)
+            number, = self.block_header.unpack(header)
+            if self.skippable[0] <= number <= self.skippable[1]:
+                size, = self.block_header.unpack(self.read(4))
+                self.f.seek(size, 1)
+                continue
+            if number != self.magic:
+                raise IOError('%s has no zstd frame at %d' % (
+                    self.filename, self.f.tell() - 4))
+            descriptor = self.read(1)
+            flags = ord(descriptor)
+            single_segment = (flags >> 5) & 1
+            size = ((0 if single_segment else 1) + [0, 1, 2, 4][flags & 3] +
+                    [single_segment, 2, 4, 8][flags >> 6])
+            frame = [header, descriptor, self.read(size)]
+            length, independent = sum(len(x) for x in frame), True
+            last = False
+            while not last:
+                block = self.read(3)
+                n, = self.block_header.unpack(block + b'\x00')
+                last, block_type, size = n & 1, (n >> 1) & 3, n >> 3
+                if block_type == 3:
+                    raise IOError('%s has a corrupt zstd block' % self.filename)
+                # Run length encoded blocks are a single byte
+                frame += [block, self.read(1 if block_type == 1 else size)]
+                length += 3 + len(frame[-1])
+                if length >= self.block_size and not last:
+                    yield b''.join(frame), independent
+                    frame, length, independent = [], 0, False
+            if (flags >> 2) & 1:
+                frame.append(self.read(4))
+            yield b''.join(frame), independent
+
+    def decompressor(self):
+        return zstd.ZstdDecompressor().decompressobj()
+
+    def decompress(self, d, data):
+        return d.decompress(data), d
+
 def AutoDetectFile(filename):
     filetypes = [
-            ('bz2', bz2.BZ2File, '\x42\x5a\x68'),
-            ('gzip', gzip.GzipFile, '\x1f\x8b\x08'),
-            ('lzma', lzma.LZMAFile, '\xfd7zXZ\x00')]
+            ('bz2', MultiStreamBZ2File, b'\x42\x5a\x68'),
+            ('gzip', MultiMemberGzipFile, b'\x1f\x8b\x08'),
+            ('lzma', lzma.LZMAFile, b'\xfd7zXZ\x00'),
+            ('zstd', ZstdFile, b'\x28\xb5\x2f\xfd'),
+            ('snappy', SnappyFramedFile, SnappyFramedFile.magic),
+            ('fsz', FszFile, FszFile.magic)]
+    with open(filename, 'rb') as f:
+        head = f.read(max(len(magic) for _, _, magic in filetypes))
     for typename, fileopen, magic in filetypes:
-        try:
-            with open(filename, 'r') as f:
-                if f.read(len(magic)) != magic:
-                    raise Exception()
-            f = fileopen(filename, 'r')
-            log.info('Opened %s as %s' % (filename, typename))
-            return f
-        except:
-            log.debug('Unsuccessfully tried to open as %s' % typename)
+        if head.startswith(magic):
+            log.info('Opening %s as %s' % (filename, typename))
+            return fileopen(filename, 'r')
+        log.debug('Not a %s file' % typename)
     log.info('Opening as plain text file')
     f = open(filename, 'r')
     return f
 
+# The dtype of each field PHIL writes for each type of event, as in
+# output_processing/event_reader.py.  Days are signed as PHIL writes -1 for
+# days that never come.  Fields that are not listed are read as int64,
+# float64 or categorical by the type of their first value.
+EVENT_DTYPES = {
+    'infection': {
+        'person': np.int32,
+        'disease': np.int16,
+        'exposed': np.int32,
+        'infectious': np.int32,
+        'symptomatic': np.int32,
+        'recovered': np.int32,
+        'susceptible': np.int32,
+        'infector': np.int32,
+        'place': np.int32,
+        'place_label': 'category',
+        'place_type': np.int8},
+    'vaccination': {
+        'person': np.int32,
+        'vaccine': np.int16,
+        'vaccine_day': np.int32},
+}
+
+EVENT_CHUNK_SIZE = 1 << 16
+
+class EventColumns(object):
+    """
+    The events of one type in a report, decoded into a typed buffer for each
+    field.  Events are gathered chunk_size at a time and then converted to
+    arrays of the dtype of their field (strings to category codes), so at
+    most one chunk of events is ever held as python objects.  The fields are
+    those of the first event; a field missing from a later event is read as
+    -1, NaN or a missing category.
+    """
+    def __init__(self, record, chunk_size=EVENT_CHUNK_SIZE):
+        dtypes = EVENT_DTYPES.get(record['event'], {})
+        self.fields = sorted(k for k in record if k != 'event')
+        self.dtypes = [dtypes.get(k, self.infer_dtype(record[k]))
+                for k in self.fields]
+        self.missing = [None if d == 'category' else
+                (np.nan if d == np.float64 else -1) for d in self.dtypes]
+        # The code of each category, None being missing
+        self.categories = [{None: -1} if d == 'category' else None
+                for d in self.dtypes]
+        if len(self.fields) == 1:
+            # itemgetter only returns a tuple when asked for more than one item
+            field = self.fields[0]
+            self.getter = lambda record: (record[field],)
+        else:
+            self.getter = itemgetter(*self.fields)
+        self.chunk_size = chunk_size
+        self.chunks = [[] for k in self.fields]
+        self.rows = []
+        self.n = 0
+
+    @staticmethod
+    def infer_dtype(value):
+        if isinstance(value, numbers.Integral):
+            return np.int64
+        if isinstance(value, float):
+            return np.float64
+        return 'category'
+
+    def append(self, record):
+        try:
+            self.rows.append(self.getter(record))
+        except KeyError:
+            self.rows.append(tuple(record.get(k, m)
+                for k, m in zip(self.fields, self.missing)))
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        for i, values in enumerate(zip(*self.rows)):
+            index = self.categories[i]
+            if index is not None:
+                values = [index.setdefault(v, len(index) - 1) for v in values]
+                self.chunks[i].append(np.array(values, dtype=np.int32))
+            else:
+                self.chunks[i].append(np.array(values, dtype=self.dtypes[i]))
+        self.n += len(self.rows)
+        self.rows = []
+
+    def to_frame(self):
+        """
+        The events as a DataFrame, with categories in sorted order.  Each
+        column's chunks are freed as the column is added, so the peak memory
+        is about the size of the frame.
+        """
+        self.flush()
+        d = pd.DataFrame(index=pd.RangeIndex(self.n))
+        for i, k in enumerate(self.fields):
+            if self.chunks[i]:
+                values = np.concatenate(self.chunks[i])
+            else:
+                values = np.zeros(0, dtype=np.int32
+                        if self.categories[i] is not None else self.dtypes[i])
+            self.chunks[i] = None
+            index = self.categories[i]
+            if index is not None:
+                del(index[None])
+                categories = np.empty(len(index), dtype=object)
+                categories[np.fromiter(index.itervalues(), np.int32,
+                    len(index))] = list(index.iterkeys())
+                self.categories[i] = index = None
+                order = np.argsort(categories, kind='mergesort')
+                # The last entry keeps missing values missing
+                remap = np.empty(len(categories) + 1, dtype=np.int32)
+                remap[order] = arange(len(categories))
+                remap[-1] = -1
+                values = pd.Categorical.from_codes(remap[values],
+                        categories[order])
+            d[k] = values
+            del(values)
+        return d
+
+def read_json_event_report(filename, chunk_size=EVENT_CHUNK_SIZE):
+    """
+    Reads a json event report into a DataFrame for each type of event,
+    decoding the events into typed columns chunk_size at a time.
+    """
+    columns = OrderedDict()
+    timer = Timer()
+    with AutoDetectFile(filename) as f:
+        for line in f:
+            j = ujson.loads(line)
+            try:
+                columns[j['event']].append(j)
+            except KeyError:
+                columns[j['event']] = EventColumns(j, chunk_size)
+                columns[j['event']].append(j)
+
+    log.info('Read %s events from %s in %s seconds' % (
+        ', '.join(columns.keys()), filename, timer()))
+
+    events = {}
+    while columns:
+        k, c = columns.popitem(last=False)
+        events[k] = c.to_frame()
+        del(c)
+    return events
+
 def expand_config(config):
     x = {}
     for k,c in config.iteritems():
@@ -65,11 +526,159 @@ def expand_config(config):
             x[k] = None
     return(x)
 
+def school_key(school_id):
+    """School ids compare as integers when they are all digits, whatever their leading zeros"""
+    school_id = str(school_id)
+    return int(school_id) if school_id.isdigit() else school_id
+
+def label_school_key(place_label):
+    """The key of the school of a school or classroom place label, e.g. S01190746-05-01"""
+    return school_key(place_label[1:].split('-', 1)[0])
+
+def category_codes(values, intervals):
+    """
+    Bins values by expanded intervals like OutputCollection.bin_columns, and
+    returns the category code of each value (-1 for values outside every bin)
+    and the categories.  Without intervals each distinct value is a category.
+    """
+    if intervals is None:
+        c = pd.Categorical(values)
+    elif isinstance(intervals, list):
+        c = pd.cut(values, bins=intervals, right=False, include_lowest=True)
+    else:
+        c = pd.cut(values, bins=intervals)
+    return np.asarray(c.codes, dtype=np.int64), c.categories
+
+def hash_file(filename, chunk_size=1 << 24):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def narrowest_int(values):
+    """The narrowest signed integer dtype that holds all of values."""
+    if len(values) == 0:
+        return np.int8
+    lo, hi = values.min(), values.max()
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= lo and hi <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+class PopulationTableCache(object):
+    """
+    A synthetic population file (people, households, workplaces or schools)
+    cached as one .npy file per column in <file>.npcache/, which loads in a
+    fraction of the time parsing the csv takes.  Integer columns are stored
+    in the narrowest dtype that holds them and string columns as category
+    codes, with the categories in metadata.json, and the table has the same
+    dtypes whether or not it was read from the cache.  The cache is keyed by
+    the version of its format and the size and mtime of the file; if only
+    the mtime changed (e.g. after a copy) the content hash of the file
+    decides.  read also returns the content hash, to seed anything applied
+    randomly to the table so that every load agrees.
+    """
+    version = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.dirname = '%s.npcache' % filename
+        self.metadata_filename = os.path.join(self.dirname, 'metadata.json')
+
+    def read(self, persist=True):
+        st = os.stat(self.filename)
+        try:
+            with open(self.metadata_filename) as f:
+                metadata = json.load(f)
+        except (IOError, ValueError):
+            metadata = None
+
+        if (metadata is not None and metadata['version'] == self.version
+                and metadata['size'] == st.st_size):
+            if metadata['mtime'] == repr(st.st_mtime):
+                return self.load(metadata), metadata['content_hash']
+            content_hash = hash_file(self.filename)
+            if content_hash == metadata['content_hash']:
+                if persist:
+                    metadata['mtime'] = repr(st.st_mtime)
+                    try:
+                        self.write_metadata(self.dirname, metadata)
+                    except (IOError, OSError):
+                        pass
+                return self.load(metadata), content_hash
+
+        content_hash = hash_file(self.filename)
+        table = pd.read_csv(self.filename, low_memory=False)
+        for c in table.columns:
+            if pd.api.types.is_string_dtype(table[c]):
+                table[c] = table[c].astype('category')
+            elif pd.api.types.is_integer_dtype(table[c]):
+                table[c] = table[c].astype(narrowest_int(table[c].values))
+        if persist:
+            try:
+                self.save(table, content_hash, st)
+                log.info('Persisted %s as npy columns' % self.filename)
+            except (IOError, OSError):
+                log.info('Unable to persist %s as npy columns!' % self.filename)
+        return table, content_hash
+
+    def load(self, metadata):
+        columns = OrderedDict()
+        for i, c in enumerate(metadata['columns']):
+            values = np.load(os.path.join(self.dirname, '%d.npy' % i),
+                    mmap_mode='r')
+            if c in metadata['categories']:
+                values = pd.Categorical.from_codes(values,
+                        metadata['categories'][c])
+            columns[c] = values
+        log.info('Read %s from its npy columns' % self.filename)
+        return pd.DataFrame(columns, columns=metadata['columns'])
+
+    def save(self, table, content_hash, st):
+        # Write to a temporary directory and rename it so that concurrent
+        # readers never see a partial cache
+        tmp = '%s.%d.tmp' % (self.dirname, os.getpid())
+        os.makedirs(tmp)
+        categories = {}
+        for i, c in enumerate(table.columns):
+            values = table[c]
+            if hasattr(values, 'cat'):
+                categories[c] = list(values.cat.categories)
+                values = values.cat.codes
+            np.save(os.path.join(tmp, '%d.npy' % i), values.values)
+        self.write_metadata(tmp, {'version': self.version,
+            'columns': list(table.columns), 'categories': categories,
+            'size': st.st_size, 'mtime': repr(st.st_mtime),
+            'content_hash': content_hash})
+        if os.path.isdir(self.dirname):
+            shutil.rmtree(self.dirname)
+        os.rename(tmp, self.dirname)
+
+    def write_metadata(self, dirname, metadata):
+        tmp = os.path.join(dirname, 'metadata.json.%d.tmp' % os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(metadata, f)
+        os.rename(tmp, os.path.join(dirname, 'metadata.json'))
+
 ###############################################################################
 
 DTYPE = np.uint32
 NA = DTYPE(-1)
 
+# The OutputCollection that worker processes count reports with.  It is set
+# before the workers are forked, so they share its population and attribute
+# index with the parent copy-on-write instead of loading their own.
+_worker_collection = None
+
+def _count_report(reportfile, groupconfig, apollo, include_events):
+    events = _worker_collection.read_event_report(reportfile)
+    if apollo:
+        counts = _worker_collection.apply_count_events_apollo(events, groupconfig)
+    else:
+        counts = _worker_collection.apply_count_events(events, groupconfig)
+    return reportfile, counts, events if include_events else None
+
 class OutputCollection(object):
 
     @property
@@ -116,44 +725,41 @@ class OutputCollection(object):
             ('E_p',5),('I_i',6),('I_p',7),('Y_i',8),('Y_p',9),('R_i',10),
             ('R_p',11),('IS_i',12),('IS_p',13),('V_i',14),('V_p',15)])
 
-    def __init__(self, popdir, persist_synth_pop=True):
+    def __init__(self, popdir, persist_synth_pop=True, processes=1):
         log.debug('read default group config: %s' % [
             str(yaml.load(self.default_config))])
         self.persist = persist_synth_pop
         self.popdir = popdir
+        self.processes = processes
         self.load_popfiles()
+        self.load_person_attributes()
+        self._attribute_codes = {}
 
     def load_popfiles(self):
         base = os.path.basename(self.popdir)
         timer = Timer()
 
         popfile = os.path.join(self.popdir, '%s_synth_people.txt' % base) 
-        try:
-            self.population = pd.read_hdf('%s.h5' % popfile)
-            log.info('Read persisted population from hdf5')
-        except:
-            self.population = pd.read_csv(popfile, low_memory=False)
-            self.population.age += np.random.uniform(low=0.0, high=1.0,
-                    size=len(self.population.index))
-            #self.population.reset_index(inplace=True)
-            #self.population['person'] = self.population.index
-            self.population.rename(
-                    columns={
-                        'p_id': 'person',
-                        'sp_id': 'person',
-                        'sp_hh_id': 'hh_id'},
-                    inplace=True)
-            if self.persist:
-                try:
-                    self.population.to_hdf('%s.h5' % popfile,
-                            key='population', mode='w')
-                    log.info('Persisted population to hdf5')
-                except:
-                    log.info('Unable to persist population file as hdf5!')
+        self.popfile = popfile
+        self.hhfile = os.path.join(self.popdir, '%s_synth_households.txt' % base)
+        self.population, content_hash = PopulationTableCache(popfile).read(
+                self.persist)
+        # Spread the integer ages over each year of age, seeded by the content
+        # of the people file so that every load gives everyone the same age
+        self.population.age = self.population.age + np.random.RandomState(
+                int(content_hash[:8], 16)).uniform(low=0.0, high=1.0,
+                size=len(self.population.index))
+        #self.population.reset_index(inplace=True)
+        #self.population['person'] = self.population.index
+        self.population.rename(
+                columns={
+                    'p_id': 'person',
+                    'sp_id': 'person',
+                    'sp_hh_id': 'hh_id'},
+                inplace=True)
         log.info('read population in %s seconds' % timer())
 
-        self.households = pd.read_csv(
-                os.path.join(self.popdir, '%s_synth_households.txt' % base))
+        self.households = PopulationTableCache(self.hhfile).read(self.persist)[0]
         self.households.reset_index()
         self.households.rename(columns={'sp_id': 'hh_id'}, inplace=True)
         self.households['stcotr'] = (self.households.stcotrbg/10).astype(np.int64)
@@ -162,13 +768,165 @@ class OutputCollection(object):
         self.households = pd.merge(self.households, apollo_locations,
             on='stcotr', how='inner', suffixes=('','_'))
         log.info('read households in %s seconds' % timer())
-        self.workplaces = pd.read_csv(
-                os.path.join(self.popdir, '%s_workplaces.txt' % base))
+        self.workplaces = PopulationTableCache(os.path.join(
+            self.popdir, '%s_workplaces.txt' % base)).read(self.persist)[0]
         log.info('read workplaces in %s seconds' % timer())
-        self.schools = pd.read_csv(
-                os.path.join(self.popdir, '%s_schools.txt' % base))
+        self.schools = PopulationTableCache(os.path.join(
+            self.popdir, '%s_schools.txt' % base)).read(self.persist)[0]
         log.info('read schools in %s seconds' % timer())
 
+    def load_person_attributes(self):
+        """
+        Builds the person-indexed table of every population and household
+        attribute that events can be grouped by, joining the households onto
+        the population once per population rather than once per report.  The
+        table is sorted by person, row i holding person self.person_ids[i],
+        so the rows of people are found by binary search.  The table is
+        persisted as <synth_people>.attributes.h5, keyed by the size and
+        mtime of the people and households files it was joined from.
+        """
+        timer = Timer()
+        attrfile = '%s.attributes.h5' % self.popfile
+        source = pd.Series([os.path.getsize(self.popfile),
+            os.path.getmtime(self.popfile), os.path.getsize(self.hhfile),
+            os.path.getmtime(self.hhfile)], dtype=np.float64)
+        try:
+            if not np.array_equal(pd.read_hdf(attrfile, key='source').values,
+                    source.values):
+                raise IOError('%s is stale' % attrfile)
+            self.person_attributes = pd.read_hdf(attrfile, key='attributes')
+            log.info('Read persisted person attributes from hdf5')
+        except:
+            population_columns = {v:k for k,v in self.population_dict.items()}
+            household_columns = {v:k for k,v in self.household_dict.items()}
+            self.person_attributes = pd.merge(
+                    self.population[['person', 'hh_id'] + population_columns.keys()],
+                    self.households[['hh_id'] + household_columns.keys()],
+                    on='hh_id', how='inner', suffixes=('', '.h'))
+            self.person_attributes.rename(columns=population_columns, inplace=True)
+            self.person_attributes.rename(columns=household_columns, inplace=True)
+            self.person_attributes.sort_values('person', inplace=True)
+            self.person_attributes.reset_index(drop=True, inplace=True)
+            if self.persist:
+                try:
+                    self.person_attributes.to_hdf(attrfile, key='attributes', mode='w')
+                    source.to_hdf(attrfile, key='source', mode='a')
+                    log.info('Persisted person attributes to hdf5')
+                except:
+                    log.info('Unable to persist person attributes as hdf5!')
+
+        self.person_ids = self.person_attributes.person.values.astype(np.int64)
+        log.info('Indexed attributes of %d people in %s seconds' % (
+            len(self.person_ids), timer()))
+
+    def person_rows(self, people):
+        """
+        The rows of people in self.person_attributes, -1 for people missing
+        from it (whose events the old merge onto the population dropped).
+        """
+        people = np.asarray(people, dtype=np.int64)
+        rows = np.searchsorted(self.person_ids, people)
+        rows[rows == len(self.person_ids)] = 0
+        rows[self.person_ids[rows] != people] = -1
+        return rows
+
+    def attribute_codes(self, attribute, intervals):
+        """
+        The category code of every person for a population or household
+        attribute binned by the expanded intervals, as bin_columns bins it,
+        and the categories.  People outside every bin have the code -1.
+        Codes are computed once per attribute and intervals.
+        """
+        key = (attribute, tuple(intervals) if isinstance(intervals, list) else intervals)
+        if key not in self._attribute_codes:
+            self._attribute_codes[key] = category_codes(
+                    self.person_attributes[attribute].values, intervals)
+        return self._attribute_codes[key]
+
+    def group_event_rows(self, events, groupconfig):
+        """
+        Gathers the event days of every person, in event_map order, into one
+        row per infection plus one row (of NA days) per person never
+        infected, like merging the infections onto the population.  The
+        vaccination of each person is gathered into all of their rows.  Only
+        the groups of groupconfig that have anyone in them are numbered, in
+        the order groupby sorts them.  Returns the rows in a group, the group
+        of each row, the labels of each group under each key, the number of
+        people in each group and the number of days.
+        """
+        group_by_keys = groupconfig.keys()
+        expanded = expand_config(groupconfig)
+        infection = events['infection']
+        n_people = len(self.person_ids)
+
+        infection_rows = self.person_rows(infection.person.values)
+        infected = infection_rows >= 0
+        infection = infection[infected]
+        infection_rows = infection_rows[infected]
+        never_infected = np.ones(n_people, dtype=bool)
+        never_infected[infection_rows] = False
+        people = np.concatenate([infection_rows, np.flatnonzero(never_infected)])
+
+        rows = np.full((len(people), len(self.event_map)), NA, dtype=DTYPE)
+        vaccination = events.get('vaccination')
+        if vaccination is not None:
+            vaccination_rows = self.person_rows(vaccination.person.values)
+            vaccinated = vaccination_rows >= 0
+        for k,i in self.event_map.iteritems():
+            if k in infection:
+                rows[:len(infection), i] = infection[k].fillna(NA).values.astype(DTYPE)
+            elif vaccination is not None:
+                days = np.full(n_people, NA, dtype=DTYPE)
+                days[vaccination_rows[vaccinated]] = vaccination[k][vaccinated].fillna(
+                        NA).values.astype(DTYPE)
+                rows[:, i] = days[people]
+
+        # Combine the category codes of each key, the last key varying
+        # fastest, so that sorting by code sorts the groups like groupby does
+        codes = np.zeros(len(people), dtype=np.int64)
+        categories = []
+        for k in group_by_keys:
+            if k in self.infection_dict:
+                # Event attributes are only known for the rows of infections
+                k_codes, k_categories = category_codes(infection[k].values, expanded[k])
+                k_codes = np.concatenate([k_codes,
+                    np.full(len(people) - len(infection), -1, dtype=np.int64)])
+            elif k in self.person_attributes:
+                person_codes, k_categories = self.attribute_codes(k, expanded[k])
+                k_codes = person_codes[people]
+            else:
+                raise Exception('Unable to group by key: %s' % k)
+            codes = np.where((codes < 0) | (k_codes < 0), -1,
+                    codes * len(k_categories) + k_codes)
+            categories.append(k_categories)
+
+        n_days = rows[:, self.event_map['recovered']]
+        n_days = n_days[n_days != NA].max() + 1
+
+        grouped = codes >= 0
+        groups, row_groups = np.unique(codes[grouped], return_inverse=True)
+        # The number of distinct people in each group, whatever their number
+        # of infections
+        group_people = np.unique(row_groups * n_people + people[grouped])
+        n_people_in_group = np.bincount(group_people // n_people,
+                minlength=len(groups))
+        labels = [c[i] for c,i in zip(categories,
+            np.unravel_index(groups, [len(c) for c in categories]))]
+        return (rows[grouped], row_groups.astype(np.int64), labels,
+                n_people_in_group, n_days)
+
+    def group_index(self, labels, group_by_keys, inner):
+        """
+        The index of the counts of every group, with the rows of each group
+        indexed by the inner (name, values) levels, as concatenating the
+        counts of each group with its labels as keys would index them.
+        """
+        n_inner = len(inner[0][1])
+        return pd.MultiIndex.from_arrays(
+                [l.repeat(n_inner) for l in labels] +
+                [np.tile(v, len(labels[0])) for _,v in inner],
+                names=group_by_keys + [n for n,_ in inner])
+
     def query_population(self, groupby_attributes): 
     
         _rev_population_dict = {self.population_dict[x]:x for x in \
@@ -208,69 +966,104 @@ class OutputCollection(object):
         timer = Timer()
         group_by_keys = groupconfig.keys()
 
-        d_query_pop = self.query_population(group_by_keys)
-        log.info('Extracted groups from population data in %s seconds' % timer())
-        
-        d = pd.merge(events['infection'], d_query_pop,
-                     on='person', how='right', suffixes=('','_')
-                    ).sort_values(group_by_keys).reset_index(drop=True)
-        d = self.bin_columns(d, groupconfig)
+        rows, groups, labels, n_people_in_group, n_days = self.group_event_rows(
+                events, groupconfig)
+        log.info('Gathered events by group in %s seconds' % timer())
 
-        if 'vaccination' not in events:
-            d_vacc = pd.DataFrame(dict(person=[], vaccine=[], vaccine_day=[]))
-        else:
-            d_vacc = events['vaccination']
-
-        d = pd.merge(d, d_vacc, on='person', how='left')
-        d = d[self.event_map.keys() + group_by_keys + ['person']]
-        d[self.event_map.keys()] = d[self.event_map.keys()].fillna(NA).apply(
-                lambda x: x.astype(DTYPE), axis=0)
-        n_days = d.recovered[d.recovered != NA].max() + 1
-
-        def convert_counts_array(g):
-            a = count_events.get_counts_from_group(g[self.event_map.keys()].values.astype(np.uint32),
-                                                   np.uint32(n_days),
-                                                   self.event_map, self.state_map)
-            df = pd.DataFrame(
-                    np.asarray(a), columns=self.state_map.keys(),
-                    index=pd.Index(data=range(a.shape[0]), name='day'))
-            #df.index.name = 'day'
-            return df
-
-        log.info('Merged events with population data in %s seconds' % timer())
-        grouped_counts = d.groupby(group_by_keys).apply(convert_counts_array)
+        a = count_events.get_counts_by_group(rows, groups, len(n_people_in_group),
+                n_days, self.event_map, self.state_map)
+        grouped_counts = pd.DataFrame(
+                a.reshape(-1, len(self.state_map)), columns=self.state_map.keys(),
+                index=self.group_index(labels, group_by_keys, [('day', arange(n_days))]))
         # NOTE! NOTE! NOTE! This is a hack until proper support for multi-season
         # reporting can be added!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
         del grouped_counts['N_p']
-        N_p = pd.DataFrame(
-                    {'N_p':d.groupby(group_by_keys).apply(lambda d: len(d.person.unique()))})
-        grouped_counts = grouped_counts.join(N_p)
+        grouped_counts['N_p'] = n_people_in_group.repeat(n_days)
         grouped_counts.S_p = grouped_counts.N_p - grouped_counts.E_p - grouped_counts.R_p
         # NOTE! NOTE! NOTE!
         log.info('Tabulated grouped event counts in %s seconds' % timer())
         return grouped_counts 
 
-    def read_event_report(self, filename):
-        output_lists = defaultdict(list)
+    def read_event_report(self, filename, chunk_size=EVENT_CHUNK_SIZE):
+        if os.path.isdir(filename):
+            return self.read_event_store(filename)
+        return read_json_event_report(filename, chunk_size)
+
+    def read_event_store(self, dirname, columns=None, filters=None):
+        """
+        Reads an event store directory written by output_processing/event_store.py
+        (one parquet file per event type) instead of a json event report.
+        columns and filters map event types to the columns to read and the
+        pyarrow.parquet filters to push down, e.g.
+        filters={'infection': [('place_type', '==', 83)]}
+        """
+        if pq is None:
+            raise Exception('Reading event stores requires pyarrow')
+        columns = columns or {}
+        filters = filters or {}
+        events = {}
         timer = Timer()
-        with AutoDetectFile(filename) as f:
-            for line in f:
-                j = ujson.loads(line)
-                output_lists[j.pop('event')].append(j)
-        
-        log.info('Read %s events from %s in %s seconds' % (
-            ', '.join(output_lists.keys()), filename, timer()))
+        for f in sorted(os.listdir(dirname)):
+            if f.endswith('.parquet'):
+                k = f[:-len('.parquet')]
+                events[k] = pq.read_table(os.path.join(dirname, f),
+                        columns=columns.get(k), filters=filters.get(k)).to_pandas()
 
-        return {k:pd.DataFrame(v) for k,v in output_lists.iteritems()}
-
-    def count_events(self, reportfiles, groupconfig=None):
+        log.info('Read %s events from %s in %s seconds' % (
+            ', '.join(events.keys()), dirname, timer()))
+
+        return events
+
+    def map_reports(self, reportfiles, groupconfig, apollo=False,
+            include_events=False):
+        """
+        Counts the events of each report, yielding (reportfile, counts,
+        events) in the order of reportfiles; events is None unless
+        include_events.  With
+        more than one process the reports are counted by a pool of worker
+        processes forked once the population is loaded, and at most twice as
+        many reports as there are processes are counted ahead of the one
+        being consumed, so memory stays bounded however many reports there
+        are.
+        """
+        global _worker_collection
+        # Bin the population before forking so the workers share the codes
+        expanded = expand_config(groupconfig)
+        for k in groupconfig:
+            if k in self.person_attributes:
+                self.attribute_codes(k, expanded[k])
+        _worker_collection = self
+
+        if self.processes <= 1:
+            for f in reportfiles:
+                yield _count_report(f, groupconfig, apollo, include_events)
+            return
+
+        pool = Pool(self.processes)
+        try:
+            pending = deque()
+            for f in reportfiles:
+                pending.append(pool.apply_async(_count_report,
+                    (f, groupconfig, apollo, include_events)))
+                if len(pending) >= 2 * self.processes:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def count_events(self, reportfiles, groupconfig=None, include_events=False):
         rep_num = 0
-        for f in reportfiles:
+        for f, counts, events in self.map_reports(reportfiles, groupconfig,
+                False, include_events):
             k_orig = f
             k_safe = '%d__%s' % (rep_num, re.sub(r'[-.+ ]', '_', os.path.basename(f)))
-            events = self.read_event_report(f)
-            counts = self.apply_count_events(events, groupconfig)
-            yield({'key': k_safe, 'name': k_orig, 'counts': counts, 'events': events})
+            d = {'key': k_safe, 'name': k_orig, 'counts': counts}
+            if include_events:
+                d['events'] = events
+            yield(d)
             rep_num += 1
 
     def write_event_counts_to_hdf5(self, reportfiles, outfile, groupconfig=None):
@@ -297,7 +1090,8 @@ class OutputCollection(object):
         hdr = True
         keymap = []
         with open(csv_outfile_name, 'w') as f:
-            for d in self.count_events(reportfiles, groupconfig):
+            for d in self.count_events(reportfiles, groupconfig,
+                    include_school_infections):
                 df = d.pop('counts')
                 #df['key'] = d['key']
                 df['name'] = d['name']
@@ -314,194 +1108,226 @@ class OutputCollection(object):
         self.school_outfile = open('%s_school_infections.csv' % outfile, 'w')
 
         self._schools = self.schools[['school_id','name','address','city',
-            'zip','total','prek','kinder','gr01-gr12',
+            'zip','total','prek','kinder','gr01_gr12',
             'latitude','longitude']].reset_index()
+        self._school_rows = dict((school_key(s), i)
+                for i, s in enumerate(self._schools.school_id))
+        # The school row of every place label seen in any report
+        self._label_school_rows = {}
+
+    def school_rows(self, place_label):
+        """
+        The row of self._schools of the school at each place label, -1 if
+        none.  Each distinct label is only matched to its school once, so
+        the labels of the infections are never parsed row by row.
+        """
+        place_label = place_label.astype('category')
+        lookup = self._label_school_rows
+        rows = []
+        for label in place_label.cat.categories:
+            if label not in lookup:
+                lookup[label] = self._school_rows.get(label_school_key(label), -1)
+            rows.append(lookup[label])
+        # Missing labels (code -1) take the last row, which is no school
+        rows = np.array(rows + [-1], dtype=np.int64)
+        return rows[place_label.cat.codes.values]
 
     def write_school_infections(self, events, name, hdr):
         log.warn('WRITING SCHOOL INFECTIONS')
 
-        school_infections = events['infection'].query(
-                'place_type == 83 and place_label != "NULL"')[
-                        ['place_label','infector','person', 'exposed']]
-
-        school_infections['school_id'] = school_infections.place_label.str.extract(
-                '\D(\d+)\D*')
-
-        r = pd.merge(school_infections, self._schools, on='school_id')
+        infection = events['infection']
+        school_infections = infection[infection.place_type.values == 83][
+                ['place_label','infector','person', 'exposed']]
+        rows = self.school_rows(school_infections.place_label)
+        at_school = rows >= 0
+
+        # Join the schools to the infections by their row
+        r = school_infections[at_school].reset_index(drop=True)
+        schools = self._schools.take(rows[at_school]).reset_index(drop=True)
+        r['school_id'] = schools.school_id
+        r = pd.concat([r, schools.drop('school_id', axis=1)], axis=1)
         r['name'] = name
         r.rename(columns={'exposed': 'day'}, inplace=True)
         r.to_csv(self.school_outfile, index=False, header=hdr, mode='a') 
 
-    def write_apollo_internal(self, reportfiles, outfile, groupconfig=None):
+    def thin_apollo_counts(self, counts):
+        """
+        The non-zero counts of a frame of apply_count_events_apollo as a long
+        table, with a row for each group, day, vaccination status and state.
+        The infection_state and disease_state of a row are coded from the
+        column of its count, so that no state names are built or split per
+        row.  Rows are in the order of stacking the frame.
+        """
+        states = [c.split(':') for c in counts.columns]
+        infection_states = sorted(set(i for i, _ in states))
+        disease_states = sorted(set(d for _, d in states))
+        infection_codes = np.array([infection_states.index(i) for i, _ in states])
+        disease_codes = np.array([disease_states.index(d) for _, d in states])
+
+        values = counts.values
+        rows, columns = np.nonzero(values)
+        d = OrderedDict()
+        for i, name in enumerate(counts.index.names):
+            d[name] = counts.index.get_level_values(i).take(rows)
+        d['count'] = values[rows, columns]
+        d['infection_state'] = pd.Categorical.from_codes(
+                infection_codes[columns], infection_states)
+        d['disease_state'] = pd.Categorical.from_codes(
+                disease_codes[columns], disease_states)
+        return pd.DataFrame(d, columns=d.keys())
+
+    @property
+    def apollo_column_names(self):
+        return dict(age = 'age_range_category_label',
+                location = 'household_location_admin4',
+                income = 'household_median_income_category_label')
+
+    def apollo_min_itemsize(self, groupconfig):
+        """
+        The min_itemsize of the label columns of an apollo table: the longest
+        label among all the categories of each group key.  The widths of a
+        table's string columns are fixed by its first append, which may not
+        have the longest labels.  Only population attributes are sized, as
+        the categories of event attributes are not known before counting.
+        """
+        expanded = expand_config(groupconfig)
+        min_itemsize = {}
+        for k in groupconfig:
+            # gender is recoded to the categorical sex
+            if k == 'gender' or k not in self.person_attributes:
+                continue
+            _, categories = self.attribute_codes(k, expanded[k])
+            if categories.dtype == object and len(categories):
+                min_itemsize[self.apollo_column_names.get(k, k)] = max(
+                        len(str(c)) for c in categories)
+        return min_itemsize
+
+    def apollo_standard(self, d):
+        """Renames/recasts the columns of a thin table to the apollo standard"""
+        if 'gender' in d:
+            d['sex'] = pd.Categorical.from_codes(
+                    np.where(d.gender.values == 1, 1, 0), ['F', 'M'])
+            d.drop('gender', axis=1, inplace=True)
+        d.rename(columns=self.apollo_column_names, inplace=True)
+        if 'vaccination_status' in d:
+            d.vaccination_status = pd.Categorical.from_codes(
+                    d.vaccination_status.values.astype(np.int8),
+                    ['noVaccination', 'successfulVaccination'])
+        d.set_index([x for x in d.columns if x != 'count'], inplace=True)
+        return d
+
+    def write_apollo_internal(self, reportfiles, outfile, groupconfig=None,
+            chunk_size=1 << 16):
         log.info('Producing apollo output format')
         #outfile_name = '%s.apollo.csv.gz' % outfile
         outfile_name = '%s.apollo.h5' % outfile
         hdf = pd.HDFStore(path=outfile_name, mode='w', complib='zlib', complevel=4)
 
-        def reshape_thin(d):
-            ds = d.stack()
-            return pd.DataFrame(ds[ds!=0])
         timer = Timer()
-        d1 = pd.concat([reshape_thin(r['counts']) for r in self.count_events_apollo(reportfiles, groupconfig)],
-                copy=False)
-        log.info('Concatenated all realizations in %s seconds' % timer())
-        d2 = d1.groupby(level=range(len(d1.index.levels)
-            )).sum()
-        del(d1)
-        d2 /= float(len(reportfiles))
-        d2.reset_index(inplace=True)
+        # Keep a running sum of the realizations as they are counted, so
+        # memory does not grow with the number of realizations
+        total = None
+        for r in self.count_events_apollo(reportfiles, groupconfig):
+            counts = r['counts'].astype(np.int64)
+            if total is None or total.index.equals(counts.index):
+                total = counts if total is None else total + counts
+            else:
+                total = total.add(counts, fill_value=0)
+        log.info('Summed all realizations in %s seconds' % timer())
+        total = total.sort_index()
+        # The states of each group are written in the order of their names
+        total = total[sorted(total.columns)] / float(len(reportfiles))
         log.info('Calculated mean values for all groups in %s seconds' % timer())
-        d2.columns = [x for x in d2.columns[:-2]] + ['state_tuple','count']
 
-        d3 = d2.state_tuple.str.split(':', expand=True)
-        d3.columns = ['infection_state', 'disease_state']
-        
-        d2.drop('state_tuple', axis=1, inplace=True)
-        
-        for s in ['infection_state', 'disease_state']:
-            d2[s] = d3[s].astype('category')
-            d3.drop(s, axis=1, inplace=True)
-        del(d3)
-
-        if 'gender' in d2:
-            d2['sex'] = d2.gender.apply(lambda x: 'M' if x==1 else 'F').astype('category')
-            d2.drop('gender', axis=1, inplace=True)
-        if 'age' in d2:
-            d2.rename(columns={'age':'age_range_category_label'}, inplace=True)
-        if 'location' in d2:
-            d2.rename(columns={'location':'household_location_admin4'}, inplace=True)
-        if 'income' in d2:
-            d2.rename(columns={'income':'household_median_income_category_label'}, inplace=True)
-        if 'vaccination_status' in d2:
-            v_s_map = {0: 'noVaccination', 1: 'successfulVaccination'}
-            d2.vaccination_status = d2.vaccination_status.apply(lambda x: v_s_map[x]).astype('category')
-
-        log.info('Renamed/recast data table to apollo standard in %s seconds' % timer())
-
-        d2.set_index([x for x in d2.columns if x != 'count'], inplace=True)
         log.info('Begin writing apollo output format to %s' % outfile_name)
-        #d2.to_csv(outfile_name, compression='gzip')
-        hdf.put('apollo_aggregated_counts', d2, format='table')
+        min_itemsize = self.apollo_min_itemsize(groupconfig)
+        for start in range(0, len(total.index), chunk_size):
+            d = self.apollo_standard(self.thin_apollo_counts(
+                total.iloc[start:start + chunk_size]))
+            hdf.append('apollo_aggregated_counts', d, index=False,
+                    min_itemsize=min_itemsize)
+        hdf.create_table_index('apollo_aggregated_counts')
         hdf.close()
         log.info('Wrote apollo output format to disk in %s seconds' % timer())
 
-    def write_galapagos(self, reportfiles, outfile, groupconfig=None):
+    def write_galapagos(self, reportfiles, outfile, groupconfig=None,
+            chunk_size=1 << 20):
         log.info('Producing galapagos output format')
 
         outfile_name = '%s.galapagos.h5' % outfile
         hdf = pd.HDFStore(path=outfile_name, mode='w', complib='zlib', complevel=4)
 
-        def reshape_thin(d):
+        def add_existing_latent(d):
             if ('latent:asymptomatic' in d) & ('newly_latent:asymptomatic' in d):
                 d['existing_latent:asymptomatic']=d['latent:asymptomatic']-d['newly_latent:asymptomatic']
             else:
                 d['existing_latent:asymptomatic']=0
-            ds = d.stack()
-            return pd.DataFrame(ds[ds!=0])
-
-        def add_file_index(df,ind):
-            df['file_ind']=ind
-            df['file_ind']=(df['file_ind']).astype(np.uint8)
-            return df
-
-        def make_csv_struct_from_orig_dataframe(df):
-            d2 = pd.concat([pd.DataFrame(df['simulator_time']),pd.DataFrame(df['infection_state']),pd.DataFrame(df['count'])],axis=1)
-            d2sum = d2.groupby(['simulator_time','infection_state']).sum()
-            d2sum = d2sum.fillna(value=0)
-            d2sum['count']=(d2sum['count']).astype(np.uint32)
-            return d2sum
+            return d
 
         timer = Timer()
-        count_all=self.count_events_apollo(reportfiles,groupconfig)
-
-        d1 = pd.concat([add_file_index(reshape_thin(r['counts']),r['file_ind']) for r in count_all],copy=False)
-        log.info('Concatenated all realizations in %s seconds' % timer())
-
-        d1.reset_index(inplace=True)
-        d1.columns = [x for x in d1.columns[:-3]] + ['state_tuple','count','report_index']
-
-        d3 = d1.state_tuple.str.split(':', expand=True)
-        d3.columns = ['infection_state', 'disease_state']
-
-        d1.drop('state_tuple', axis=1, inplace=True)
-        for s in ['infection_state', 'disease_state']:
-            d1[s] = d3[s].astype('category')
-            d3.drop(s, axis=1, inplace=True)
-        del(d3)
-
-        if 'gender' in d1:
-            d1['sex'] = d1.gender.apply(lambda x: 'M' if x==1 else 'F').astype('category')
-            d1.drop('gender', axis=1, inplace=True)
-        if 'age' in d1:
-            d1.rename(columns={'age':'age_range_category_label'}, inplace=True)
-        if 'location' in d1:
-            d1.rename(columns={'location':'household_location_admin4'}, inplace=True)
-        if 'income' in d1:
-            d1.rename(columns={'income':'household_median_income_category_label'}, inplace=True)
-        if 'vaccination_status' in d1:
-            v_s_map = {0: 'noVaccination', 1: 'successfulVaccination'}
-            d1.vaccination_status = d1.vaccination_status.apply(lambda x: v_s_map[x]).astype('category')
-
-        log.info('Renamed/recast data table to galapagos standard in %s seconds' % timer())
-
-        d2 = make_csv_struct_from_orig_dataframe(d1)
-        d2.to_csv(outfile+'.galapagos.csv')
-        log.info('Wrote CSV file of infection state counts to '+outfile+'.galapagos.csv in %s seconds' % timer())
-
-        d1.set_index([x for x in d1.columns if x != 'count'], inplace=True)
-        log.info('Begin writing galapagos output format to %s' % outfile_name)
-        hdf.put('apollo_aggregated_counts', d1, format='table')
+        # The realizations are appended to the table as they are counted, at
+        # least chunk_size rows at a time as every append rewrites the
+        # categories, and the counts by day and infection state are summed as
+        # they go
+        state_counts = None
+        chunks = []
+        min_itemsize = self.apollo_min_itemsize(groupconfig)
+        for r in self.count_events_apollo(reportfiles, groupconfig):
+            d1 = self.thin_apollo_counts(add_existing_latent(r['counts']))
+            d1.insert(list(d1.columns).index('count') + 1, 'report_index',
+                    np.full(len(d1.index), r['file_ind'], dtype=np.uint8))
+            s = pd.Series(d1['count'].values.astype(np.int64)).groupby(
+                    [d1.simulator_time.values, d1.infection_state.cat.codes.values]).sum()
+            state_counts = s if state_counts is None else state_counts.add(s, fill_value=0)
+            infection_states = d1.infection_state.cat.categories
+            chunks.append(self.apollo_standard(d1))
+            if sum(len(c.index) for c in chunks) >= chunk_size:
+                hdf.append('apollo_aggregated_counts', pd.concat(chunks),
+                        index=False, min_itemsize=min_itemsize)
+                chunks = []
+            log.info('Added realization %d to %s in %s seconds' % (
+                r['file_ind'], outfile_name, timer()))
+        if chunks:
+            hdf.append('apollo_aggregated_counts', pd.concat(chunks),
+                    index=False, min_itemsize=min_itemsize)
+        # Index the table once rather than on every append
+        hdf.create_table_index('apollo_aggregated_counts')
         hdf.close()
         log.info('Wrote galapagos output format to disk in %s seconds' % timer())
 
-
+        days = state_counts.index.levels[0]
+        states = np.unique(state_counts.index.get_level_values(1))
+        d2sum = state_counts.reindex(pd.MultiIndex.from_product([days, states]),
+                fill_value=0).astype(np.uint32).to_frame('count')
+        d2sum.index = pd.MultiIndex.from_product([days,
+            pd.CategoricalIndex(infection_states[states])],
+            names=['simulator_time', 'infection_state'])
+        d2sum.to_csv(outfile+'.galapagos.csv')
+        log.info('Wrote CSV file of infection state counts to '+outfile+'.galapagos.csv in %s seconds' % timer())
 
     def count_events_apollo(self, reportfiles, groupconfig=None):
-        for f in reportfiles:
-            k_ind = reportfiles.index(f)
+        for k_ind, (f, counts, events) in enumerate(
+                self.map_reports(reportfiles, groupconfig, True)):
             k_orig = os.path.basename(f)
             k_safe = re.sub(r'[-.+ ]', '_', k_orig)
-            events = self.read_event_report(f)
-            counts = self.apply_count_events_apollo(events, groupconfig)
-            yield({'key': k_safe, 'name': k_orig, 'counts': counts, 'events': events,'file_ind':k_ind})
+            yield({'key': k_safe, 'name': k_orig, 'counts': counts, 'file_ind':k_ind})
 
     def apply_count_events_apollo(self, events, groupconfig):
         timer = Timer()
         group_by_keys = groupconfig.keys()
 
-        d_query_pop = self.query_population(group_by_keys)
-        log.info('Extracted groups from population data in %s seconds' % timer())
-        
-        d = pd.merge(events['infection'], d_query_pop,
-                     on='person', how='right', suffixes=('','_')
-                    ).sort_values(group_by_keys).reset_index(drop=True)
-        d = self.bin_columns(d, groupconfig)
-
-        if 'vaccination' not in events:
-            d_vacc = pd.DataFrame(dict(person=[], vaccine=[], vaccine_day=[]))
-        else:
-            d_vacc = events['vaccination']
-
-        d = pd.merge(d, d_vacc, on='person', how='left')
-        d = d[self.event_map.keys() + group_by_keys]
-        d[self.event_map.keys()] = d[self.event_map.keys()].fillna(NA).apply(
-                lambda x: x.astype(DTYPE), axis=0)
-        n_days = d.recovered[d.recovered != NA].max() + 1
-
-        def convert_counts_array(g):
-            a = count_events.get_counts_from_group_apollo(
-                    g[self.event_map.keys()].values.astype(np.uint32),
-                    np.uint32(n_days), self.event_map, self.apollo_state_map)
-            df = pd.DataFrame(
-                    np.asarray(a), columns=self.apollo_state_map.keys()+['vaccination_status'],
-                    index=pd.Index(
-                        data=range(n_days) + range(n_days),
-                        name='simulator_time'))
-            df.set_index('vaccination_status', append=True, inplace=True)
-            return df
-
-        log.info('Merged events with population data in %s seconds' % timer())
-        grouped_counts = d.groupby(group_by_keys).apply(convert_counts_array)
+        rows, groups, labels, n_people_in_group, n_days = self.group_event_rows(
+                events, groupconfig)
+        log.info('Gathered events by group in %s seconds' % timer())
+
+        a = count_events.get_counts_by_group_apollo(rows, groups,
+                len(n_people_in_group), n_days, self.event_map, self.apollo_state_map)
+        index = self.group_index(labels, group_by_keys, [
+            ('simulator_time', np.concatenate([arange(n_days), arange(n_days)])),
+            ('vaccination_status', a[0, :, -1])])
+        grouped_counts = pd.DataFrame(
+                a[:, :, :-1].reshape(-1, len(self.apollo_state_map)),
+                columns=self.apollo_state_map.keys(), index=index)
         log.info('Tabulated grouped event counts in %s seconds' % timer())
         return grouped_counts 
 
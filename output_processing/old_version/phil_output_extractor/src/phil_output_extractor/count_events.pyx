@@ -240,6 +240,216 @@ cpdef np.uint32_t[:,:] get_counts_from_group_apollo(np.uint32_t[:,:] rows,
     return a
 
 
+###############################################################################
+# Kernels counting every group at once: each state a row is in for a range of
+# days adds one on the first day and takes it away again after the last day
+# of a difference array, and a cumulative sum over the days gives the counts.
+# Ranges are clipped to the days counted.
+
+cdef inline void _add_days(np.int64_t[:,:,:] diff, Py_ssize_t g, long start,
+        long end, int state, long ndays, long offset) nogil:
+    # Adds one to state on the days [start, end) of group g, shifted by offset
+    if start < 0:
+        start = 0
+    if end > ndays:
+        end = ndays
+    if start < end:
+        diff[g, start + offset, state] += 1
+        diff[g, end + offset, state] -= 1
+
+cdef inline void _add_vaccinated_days(np.int64_t[:,:,:] diff, Py_ssize_t g,
+        long start, long end, int state, long vaccine_day, long ndays) nogil:
+    # Like _add_days, but the days from vaccine_day on are counted in the
+    # second (vaccinated) half of the days
+    _add_days(diff, g, start, min(end, vaccine_day), state, ndays, 0)
+    _add_days(diff, g, max(start, vaccine_day), end, state, ndays, ndays)
+
+def get_counts_by_group(np.uint32_t[:,:] rows, np.int64_t[:] groups,
+        int ngroups, int ndays, event_map, state_map):
+    """
+    The counts of get_counts_from_group for every group at once, as an
+    array of shape (ngroups, ndays, len(state_map)).  groups holds the group
+    of each row, from 0 to ngroups - 1.
+    """
+
+    cdef int exposed = event_map['exposed']
+    cdef int infectious = event_map['infectious']
+    cdef int symptomatic = event_map['symptomatic']
+    cdef int recovered = event_map['recovered']
+    cdef int susceptible = event_map['susceptible']
+    cdef int vaccine = event_map['vaccine']
+    cdef int vaccine_day = event_map['vaccine_day']
+
+    cdef int N_i = state_map['N_i']
+    cdef int S_i = state_map['S_i']
+    cdef int E_i = state_map['E_i']
+    cdef int I_i = state_map['I_i']
+    cdef int Y_i = state_map['Y_i']
+    cdef int R_i = state_map['R_i']
+    cdef int IS_i = state_map['IS_i']
+    cdef int V_i = state_map['V_i']
+
+    cdef int N_p = state_map['N_p']
+    cdef int S_p = state_map['S_p']
+    cdef int E_p = state_map['E_p']
+    cdef int I_p = state_map['I_p']
+    cdef int Y_p = state_map['Y_p']
+    cdef int R_p = state_map['R_p']
+    cdef int IS_p = state_map['IS_p']
+    cdef int V_p = state_map['V_p']
+
+    cdef np.int64_t[:,:,:] diff = np.zeros([ngroups, ndays + 1, len(state_map)],
+            dtype=np.int64)
+
+    cdef Py_ssize_t i, g
+    cdef long e, inf, y, rec, sus, n
+    cdef long last_day = ndays - 1
+    cdef long D = ndays
+    cdef long NA = np.uint32(-1)
+
+    with nogil:
+
+        for i in xrange(rows.shape[0]):
+
+            g = groups[i]
+            e = rows[i, exposed]
+            inf = rows[i, infectious]
+            y = rows[i, symptomatic]
+            rec = rows[i, recovered]
+            sus = rows[i, susceptible]
+
+            _add_days(diff, g, 0, D, N_p, D, 0)
+
+            if rows[i, vaccine] != NA:
+                if rows[i, vaccine_day] != NA and rows[i, vaccine_day] <= last_day:
+                    _add_days(diff, g, rows[i, vaccine_day], rows[i, vaccine_day] + 1, V_i, D, 0)
+                    _add_days(diff, g, rows[i, vaccine_day], D, V_p, D, 0)
+
+            if e == NA:
+                _add_days(diff, g, 0, D, S_p, D, 0)
+
+            else:
+                _add_days(diff, g, e, e + 1, E_i, D, 0)
+                _add_days(diff, g, e, inf, E_p, D, 0)
+                _add_days(diff, g, 0, e, S_p, D, 0)
+
+                if sus != NA:
+                    if sus == last_day:
+                        _add_days(diff, g, sus, sus + 1, S_p, D, 0)
+                        _add_days(diff, g, sus, sus + 1, S_i, D, 0)
+                    elif sus < last_day:
+                        _add_days(diff, g, sus, D, S_p, D, 0)
+
+                if inf != NA:
+                    _add_days(diff, g, inf, inf + 1, I_i, D, 0)
+                    _add_days(diff, g, inf, rec, I_p, D, 0)
+
+                if y != NA:
+                    _add_days(diff, g, y, y + 1, Y_i, D, 0)
+                    _add_days(diff, g, y, y + 1, IS_i, D, 0)
+                    _add_days(diff, g, y, rec, Y_p, D, 0)
+                    _add_days(diff, g, y, rec, IS_p, D, 0)
+
+                if rec != NA:
+                    _add_days(diff, g, rec, rec + 1, R_i, D, 0)
+                    if rec == last_day:
+                        _add_days(diff, g, rec, rec + 1, R_p, D, 0)
+                    else:
+                        if sus == NA or sus > D:
+                            n = D
+                        else:
+                            n = sus
+                        _add_days(diff, g, rec, n, R_p, D, 0)
+
+    return np.cumsum(diff, axis=1)[:, :ndays].astype(np.uint32)
+
+###############################################################################
+
+def get_counts_by_group_apollo(np.uint32_t[:,:] rows, np.int64_t[:] groups,
+        int ngroups, int ndays, event_map, state_map):
+    """
+    The counts of get_counts_from_group_apollo for every group at once, as
+    an array of shape (ngroups, 2 * ndays, len(state_map) + 1).  groups
+    holds the group of each row, from 0 to ngroups - 1.
+    """
+
+    cdef int exposed = event_map['exposed']
+    cdef int infectious = event_map['infectious']
+    cdef int symptomatic = event_map['symptomatic']
+    cdef int recovered = event_map['recovered']
+    cdef int susceptible = event_map['susceptible']
+    cdef int vaccine_day = event_map['vaccine_day']
+
+    cdef int s_r = state_map['susceptible:recovery']
+    cdef int l_a = state_map['latent:asymptomatic']
+    cdef int i_s = state_map['infectious:symptomatic']
+    cdef int i_a = state_map['infectious:asymptomatic']
+    cdef int r_r = state_map['recovered:recovery']
+    cdef int ns_s = state_map['newly_sick:symptomatic']
+    cdef int ns_a = state_map['newly_sick:asymptomatic']
+    cdef int nl_a = state_map['newly_latent:asymptomatic']
+
+    cdef np.int64_t[:,:,:] diff = np.zeros([ngroups, ndays * 2 + 1, len(state_map)],
+            dtype=np.int64)
+
+    cdef Py_ssize_t i, g
+    cdef long e, inf, y, rec, sus, v, n
+    cdef long last_day = ndays - 1
+    cdef long D = ndays
+    cdef long NA = np.uint32(-1)
+
+    with nogil:
+        for i in xrange(rows.shape[0]):
+
+            g = groups[i]
+            e = rows[i, exposed]
+            inf = rows[i, infectious]
+            y = rows[i, symptomatic]
+            rec = rows[i, recovered]
+            sus = rows[i, susceptible]
+            v = rows[i, vaccine_day]
+
+            if e == NA:
+                _add_vaccinated_days(diff, g, 0, D, s_r, v, D)
+
+            else:
+                _add_days(diff, g, e, e + 1, nl_a, D, 0)
+                _add_vaccinated_days(diff, g, e, inf, l_a, v, D)
+                _add_vaccinated_days(diff, g, 0, e, s_r, v, D)
+
+                # Single days are only counted as vaccinated on the day of
+                # vaccination itself
+                if sus != NA:
+                    if sus == last_day:
+                        _add_days(diff, g, sus, sus + 1, s_r, D, D if v == sus else 0)
+                    elif sus < last_day:
+                        _add_vaccinated_days(diff, g, sus, D, s_r, v, D)
+
+                if inf != NA:
+                    if y != NA:
+                        _add_days(diff, g, y, y + 1, ns_s, D, D if v == y else 0)
+                        _add_vaccinated_days(diff, g, y, rec, i_s, v, D)
+                        if y > inf:
+                            _add_vaccinated_days(diff, g, inf, y, i_a, v, D)
+                    else:
+                        _add_days(diff, g, inf, inf + 1, ns_a, D, D if v == inf else 0)
+                        _add_vaccinated_days(diff, g, inf, rec, i_a, v, D)
+
+                if rec != NA:
+                    if rec == last_day:
+                        _add_days(diff, g, rec, rec + 1, r_r, D, D if v == rec else 0)
+                    else:
+                        if sus == NA or sus > D:
+                            n = D
+                        else:
+                            n = sus
+                        _add_vaccinated_days(diff, g, rec, n, r_r, v, D)
+
+    a = np.zeros([ngroups, ndays * 2, len(state_map) + 1], dtype=np.uint32)
+    a[:, :, :len(state_map)] = np.cumsum(diff, axis=1)[:, :ndays * 2]
+    a[:, ndays:, len(state_map)] = 1
+    return a
+
 ###############################################################################
 
 cdef inline int _busy_sleep(int n) nogil:
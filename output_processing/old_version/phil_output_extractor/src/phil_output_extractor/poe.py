@@ -32,7 +32,7 @@ def main():
     
     parser.add_argument('-r', '--reportfiles', required=True,
             action='store', nargs='+',
-            help='List of event report json files')
+            help='List of event report json files or event store directories')
 
     parser.add_argument('-o', '--outfile', required=True,
             help='Base name for output file')
@@ -50,9 +50,14 @@ def main():
             'If not specified, the default behavior is to stratify by integer age,',
             'and tract-level location']))
 
+    parser.add_argument('-n', '--processes', required=False, type=int,
+            default=1, help=' '.join(['Number of worker processes counting',
+            'reports in parallel; they share the population loaded once']))
+
     args = parser.parse_args()
 
-    output_collection = OutputCollection(args.population)
+    output_collection = OutputCollection(args.population,
+            processes=args.processes)
 
     try:
         groupconfig = yaml.load(args.groupconfig)
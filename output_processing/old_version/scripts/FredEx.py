@@ -4,7 +4,8 @@
 FredEx: FRED Experiment Runner
 
 Reads a yaml experiment specification, writes out parameters files
-and submits jobs via qsub
+and submits jobs via qsub.  Each parameters file includes the default
+parameters file and only holds the parameters of its experiment.
 """
 
 __version__ = '0.0.0'
@@ -33,7 +34,7 @@ def run(config):
                '\n'.join(['%s = %s' % (str(x[i]), str(t[i])) for i in range(len(t))]))
 
 
-def write_params(base_string, t, outdir):
+def write_params(base_paramsfile, t, outdir):
     fred_out = os.path.join(outdir, '%s.outdir' % t[0])
     paramfile = '%s.params' % t[0]
     paramfile = os.path.join(fred_out, paramfile)
@@ -45,8 +46,8 @@ def write_params(base_string, t, outdir):
         pass
 
     with open(paramfile, 'w') as f:
-        f.write(base_string)
-        f.write('\n\n########## EXPERIMENT PARAMS ##########\n\n')
+        f.write('include = %s\n' % base_paramsfile)
+        f.write('\n########## EXPERIMENT PARAMS ##########\n\n')
         f.write('outdir = %s\n' % fred_out)
         f.write('event_report_file = %s\n' % reportfile)
         f.write(t[1])
@@ -85,15 +86,15 @@ def main():
     except:
         pass
 
-    with open(args.paramsfile, 'r') as f:
-        base_string = f.read()
+    # the experiments' parameters files include it instead of copying it
+    base_paramsfile = os.path.abspath(args.paramsfile)
 
     with open(args.config, 'r') as f:
         yaml_config = yaml.load(f)
     
     for t in run(yaml_config):
         jobname = t[0]
-        paramsfile = write_params(base_string, t, outdir)
+        paramsfile = write_params(base_paramsfile, t, outdir)
         qsub(paramsfile, args.qsubfile, jobname)
 
 
@@ -1,13 +1,41 @@
 from argparse import ArgumentParser
-import ast
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import datetime
-from multiprocessing import Process, Queue
+import hashlib
+import json
+import logging
+import os
+import time
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from typing import Any, Dict, Generator, List, Tuple
+from typing import List, NamedTuple, Optional, Tuple
 
+try:
+    from . import event_store
+    from .age_lookup import AgeLookup
+    from .event_reader import ParametersRecord, open_report, report_source_files, stat_files
+    from .stratification import Stratification, StratifiedCounts, load_config
+    from .summary_stats import RunningSummary
+except ImportError:
+    import event_store
+    from age_lookup import AgeLookup
+    from event_reader import ParametersRecord, open_report, report_source_files, stat_files
+    from stratification import Stratification, StratifiedCounts, load_config
+    from summary_stats import RunningSummary
 
-def main(results_dir: str, people_file: str, number_of_processes: int) -> None:
+# Ranges are hardcoded for simplicity
+NUMBER_OF_AGES = 110
+NUMBER_OF_DAYS = 200
+# Realizations start on some date between 2012-01-01 and 2012-01-07
+EARLIEST_DATE = datetime.datetime.fromisoformat("2012-01-01")
+
+log = logging.getLogger(__name__)
+
+
+def main(results_dir: str, people_file: str, number_of_processes: int, use_cache: bool = True,
+         summary_stats: bool = False, stratification: Optional[Stratification] = None,
+         use_phil_counts: bool = False) -> None:
     """
     Use multiple processors to process a batch of realizations of PHIL to compute the 4 outputs Sarah wants.
     These batch of realizations should all be contained in the same directory. That directory should have nothing but
@@ -21,144 +49,406 @@ def main(results_dir: str, people_file: str, number_of_processes: int) -> None:
         |      |- report1.json_lines
         |- 3/
         ...
+    Reports PHIL compressed with `compress_event_report = 1` (`report1.json_lines.fsz`) are read as well.
+    Each realization is a separate task, so whichever process is free picks up the next realization, and each result is
+    copied into its column of the output arrays as soon as it arrives.
+
+    Unless `use_cache` is `False`, each realization's outputs are also cached in its `OUT/` directory (see
+    `RealizationCache`), so rerunning on the same directory only parses new or changed reports, and an interrupted run
+    keeps the realizations it already finished.
+
+    If `summary_stats` is `True` the summary statistics of each of the 4 outputs are also written, as
+    `<output>_summary_stats.csv`. They are updated as each realization's results arrive (see
+    `summary_stats.RunningSummary`) rather than computed from the CSVs afterwards.
+
+    If a `stratification` is given, the vaccinations and infections are also counted for each of its groups, in the
+    same pass over each realization's events, and written as `vaccinated_by_group.csv`, `infected_by_group.csv`,
+    `new_infections_by_day_and_group.csv` and `total_infected_by_day_and_group.csv`.
+
+    If `use_phil_counts` is `True` the counts PHIL wrote itself are used instead of the events, see
+    `RealizationProcessor`. They cannot be stratified.
     """
-    people_df = pd.read_csv(people_file, index_col=0)
-    people_to_age_mapping = people_df.age.to_dict()
-
-    ages_vaccinated_queue = Queue()
-    infections_by_age_queue = Queue()
-    new_infections_by_day_queue = Queue()
-    total_infected_by_day_queue = Queue()
-
-    jobs = []
-    realization_assignments = assign_realizations_to_processes(results_dir, number_of_processes)
-    for realizations in realization_assignments:
-        process = Process(
-            target=process_realizations,
-            args=(
-                realizations,
-                people_to_age_mapping,
-                ages_vaccinated_queue,
-                infections_by_age_queue,
-                new_infections_by_day_queue,
-                total_infected_by_day_queue,
-            )
-        )
-        jobs.append(process)
-        process.start()
+    if use_phil_counts and stratification is not None:
+        raise ValueError("PHIL's counts cannot be stratified, stratify the events instead")
 
-    # This is a little fragile as it assumes you only have your realizations in the results directory
-    number_of_realizations = len([directory for directory in Path(results_dir).iterdir() if directory.is_dir()])
+    # The ages are cached next to the people file and memory-mapped, so the processes share a single copy
+    age_lookup = AgeLookup.load(people_file)
+    cache_key = None
+    if use_cache:
+        cache_key = age_lookup.content_hash()
+        if stratification is not None:
+            cache_key += stratification.content_hash()
+
+    realizations = find_realizations(results_dir)
+    ages_vaccinated = np.zeros((NUMBER_OF_AGES, len(realizations)), dtype=np.int64)
+    infections_by_age = np.zeros((NUMBER_OF_AGES, len(realizations)), dtype=np.int64)
+    new_infections_by_day = np.zeros((NUMBER_OF_DAYS, len(realizations)), dtype=np.int64)
+    total_infected_by_day = np.zeros((NUMBER_OF_DAYS, len(realizations)), dtype=np.int64)
+    stratified_counts = []
+    summaries = {
+        'ages_vaccinated': RunningSummary(NUMBER_OF_AGES),
+        'infections_by_age': RunningSummary(NUMBER_OF_AGES),
+        'new_infections_by_day': RunningSummary(NUMBER_OF_DAYS),
+        'total_infected_by_day': RunningSummary(NUMBER_OF_DAYS),
+    }
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=number_of_processes, initializer=initialize_worker,
+                             initargs=(age_lookup, cache_key, stratification, use_phil_counts)) as executor:
+        columns = {
+            executor.submit(process_realization, realization): column
+            for column, realization in enumerate(realizations)
+        }
+        for completed, future in enumerate(as_completed(columns), 1):
+            result = future.result()
+            column = columns[future]
+            ages_vaccinated[:, column] = result.ages_vaccinated
+            infections_by_age[:, column] = result.infections_by_age
+            new_infections_by_day[:, column] = result.new_infections_by_day
+            total_infected_by_day[:, column] = result.total_infected_by_day
+            if summary_stats:
+                for output, summary in summaries.items():
+                    summary.add(getattr(result, output))
+            if stratification is not None:
+                stratified_counts.append((column, result.stratified_counts))
+            log.info('%s realization %s in %.1f seconds (%d/%d)', 'Loaded cached' if result.cached else 'Processed',
+                     result.realization.name, result.seconds, completed, len(realizations))
+    log.info('Processed %d realizations in %.1f seconds', len(realizations), time.perf_counter() - start)
 
-    ages_vaccinated = []
-    infections_by_age = []
-    new_infections_by_day = []
-    total_infected_by_day = []
-    for _ in range(number_of_realizations):
-        ages_vaccinated.append(ages_vaccinated_queue.get())
-        infections_by_age.append(infections_by_age_queue.get())
-        new_infections_by_day.append(new_infections_by_day_queue.get())
-        total_infected_by_day.append(total_infected_by_day_queue.get())
+    ages = pd.RangeIndex(NUMBER_OF_AGES)
+    days = pd.date_range(EARLIEST_DATE, periods=NUMBER_OF_DAYS)
+    pd.DataFrame(ages_vaccinated, index=ages).to_csv(
+        '{}/ages_vaccinated.csv'.format(results_dir), index_label='age')
+    pd.DataFrame(infections_by_age, index=ages).to_csv(
+        '{}/infections_by_age.csv'.format(results_dir), index_label='age')
+    pd.DataFrame(new_infections_by_day, index=days).to_csv(
+        '{}/new_infections_by_day.csv'.format(results_dir), index_label='day')
+    pd.DataFrame(total_infected_by_day, index=days).to_csv(
+        '{}/total_infected_by_day.csv'.format(results_dir), index_label='day')
 
-    for process in jobs:
-        process.join()
+    if summary_stats:
+        summaries['ages_vaccinated'].to_frame(ages).to_csv(
+            '{}/ages_vaccinated_summary_stats.csv'.format(results_dir), index_label='age')
+        summaries['infections_by_age'].to_frame(ages).to_csv(
+            '{}/infections_by_age_summary_stats.csv'.format(results_dir), index_label='age')
+        summaries['new_infections_by_day'].to_frame(days).to_csv(
+            '{}/new_infections_by_day_summary_stats.csv'.format(results_dir), index_label='day')
+        summaries['total_infected_by_day'].to_frame(days).to_csv(
+            '{}/total_infected_by_day_summary_stats.csv'.format(results_dir), index_label='day')
 
-    pd.DataFrame(ages_vaccinated).T.to_csv('{}/ages_vaccinated.csv'.format(results_dir), index_label='age')
-    pd.DataFrame(infections_by_age).T.to_csv('{}/infections_by_age.csv'.format(results_dir), index_label='age')
-    pd.DataFrame(new_infections_by_day).T.to_csv('{}/new_infections_by_day.csv'.format(results_dir), index_label='day')
-    pd.DataFrame(total_infected_by_day).T.to_csv('{}/total_infected_by_day.csv'.format(results_dir), index_label='day')
+    if stratification is not None:
+        write_stratified_counts(results_dir, stratification, stratified_counts, len(realizations))
 
 
-def assign_realizations_to_processes(results_dir: str, number_of_processes: int) -> Generator[List[Path], None, None]:
-    results_dir = Path(results_dir)
+def write_stratified_counts(results_dir: str, stratification: Stratification,
+                            stratified_counts: List[Tuple[int, StratifiedCounts]],
+                            number_of_realizations: int) -> None:
+    """Writes the counts of each group, with one column per realization like the other outputs."""
+    groups = stratification.number_of_groups
+    vaccinated_by_group = np.zeros((groups, number_of_realizations), dtype=np.int64)
+    infected_by_group = np.zeros((groups, number_of_realizations), dtype=np.int64)
+    new_infections_by_day_and_group = np.zeros((NUMBER_OF_DAYS, groups, number_of_realizations), dtype=np.int64)
+    total_infected_by_day_and_group = np.zeros((NUMBER_OF_DAYS, groups, number_of_realizations), dtype=np.int64)
+    for column, counts in stratified_counts:
+        vaccinated_by_group[:, column] = counts.vaccinated
+        infected_by_group[:, column] = counts.infected
+        new_infections_by_day_and_group[:, :, column] = counts.new_infections
+        total_infected_by_day_and_group[:, :, column] = counts.total_infected
+
+    groups_index = stratification.index()
+    days_index = stratification.day_index(pd.date_range(EARLIEST_DATE, periods=NUMBER_OF_DAYS, name='day'))
+    pd.DataFrame(vaccinated_by_group, index=groups_index).to_csv('{}/vaccinated_by_group.csv'.format(results_dir))
+    pd.DataFrame(infected_by_group, index=groups_index).to_csv('{}/infected_by_group.csv'.format(results_dir))
+    pd.DataFrame(new_infections_by_day_and_group.reshape(NUMBER_OF_DAYS * groups, -1), index=days_index).to_csv(
+        '{}/new_infections_by_day_and_group.csv'.format(results_dir))
+    pd.DataFrame(total_infected_by_day_and_group.reshape(NUMBER_OF_DAYS * groups, -1), index=days_index).to_csv(
+        '{}/total_infected_by_day_and_group.csv'.format(results_dir))
+
+
+def find_realizations(results_dir: str) -> List[Path]:
     # This is a little fragile as it assumes you only have your realizations in the results directory
-    realizations = [directory for directory in results_dir.iterdir() if directory.is_dir()]
-    for i in range(number_of_processes):
-        yield realizations[i::number_of_processes]
+    return sorted(directory for directory in Path(results_dir).iterdir() if directory.is_dir())
+
+
+# The age lookup and stratification each worker process was initialized with, their hash if results are cached, and
+# whether PHIL's counts are used instead of the events
+_worker_age_lookup = None
+_worker_cache_key = None
+_worker_stratification = None
+_worker_use_phil_counts = False
+
 
+def initialize_worker(age_lookup: AgeLookup, cache_key: Optional[str],
+                      stratification: Optional[Stratification] = None, use_phil_counts: bool = False) -> None:
+    global _worker_age_lookup, _worker_cache_key, _worker_stratification, _worker_use_phil_counts
+    _worker_age_lookup = age_lookup
+    _worker_cache_key = cache_key
+    _worker_stratification = stratification
+    _worker_use_phil_counts = use_phil_counts
 
-def process_realizations(realizations: List[Path], people_to_age_mapping: Dict[int, int], ages_vaccinated_queue: Queue,
-                         infections_by_age_queue: Queue, new_infections_by_day_queue: Queue,
-                         total_infected_by_day_queue: Queue) -> None:
+
+def process_realization(realization: Path) -> 'RealizationResult':
+    """Method given to the worker processes to process a single realization, or load it from its cache."""
+    start = time.perf_counter()
+    processor = RealizationProcessor(realization, _worker_age_lookup, _worker_stratification, _worker_use_phil_counts)
+    # The report may have been deleted after it was converted to an event store, in which case there is nothing to key
+    # the cache on
+    source_files = processor.source_files()
+    if _worker_cache_key is None or not all(path.exists() for path in source_files):
+        result = processor.process()
+    else:
+        cache = RealizationCache(source_files, _worker_cache_key)
+        result = cache.load(realization)
+        if result is None:
+            result = processor.process()
+            cache.save(result, processor.content_hash)
+    return result._replace(seconds=time.perf_counter() - start)
+
+
+class RealizationResult(NamedTuple):
+    """The 4 outputs of a single realization. Ages are indexed from 0 and days are indexed from `EARLIEST_DATE`."""
+    realization: Path
+    ages_vaccinated: np.ndarray
+    infections_by_age: np.ndarray
+    new_infections_by_day: np.ndarray
+    total_infected_by_day: np.ndarray
+    seconds: float = 0.0
+    cached: bool = False
+    # Only counted when processing with a stratification
+    stratified_counts: Optional[StratifiedCounts] = None
+
+
+class RealizationCache:
     """
-    Method given to each process to process each realization and put the results into the queue for the main process to
-    combine and write to a file.
+    The outputs of a single realization, cached next to the first of the files they were computed from, e.g. as
+    `report1.json_lines.counts.npz`.
+
+    The cache is keyed by the size, mtime and content hash of every file the outputs were read from (the report and,
+    for binary reports, its binary files, see `event_reader.report_source_files`, or PHIL's counts), and by the hash of
+    the age lookup (and of the stratification, if any) they were computed with. A cache whose sizes match but whose
+    mtimes do not (e.g. after the report was copied) is only reused if the files still have the same content hash.
     """
-    for realization in realizations:
-        processor = RealizationProcessor(realization, people_to_age_mapping)
-        ages_vaccinated, infections_by_age, new_infections_by_day, total_infected_by_day = processor.process()
+    VERSION = 3
 
-        ages_vaccinated_queue.put(ages_vaccinated)
-        infections_by_age_queue.put(infections_by_age)
-        new_infections_by_day_queue.put(new_infections_by_day)
-        total_infected_by_day_queue.put(total_infected_by_day)
+    def __init__(self, source_files: List[Path], key: str) -> None:
+        self.source_files = source_files
+        self.cache_file = source_files[0].with_name(source_files[0].name + '.counts.npz')
+        self.key = key
+
+    def load(self, realization: Path) -> Optional[RealizationResult]:
+        try:
+            with np.load(self.cache_file) as cached:
+                metadata = json.loads(str(cached['metadata']))
+                outputs = [cached[output] for output in RealizationResult._fields[1:5]]
+                stratified_counts = None
+                if metadata.get('stratified'):
+                    stratified_counts = StratifiedCounts(
+                        *[cached['stratified_' + output] for output in StratifiedCounts._fields])
+        except (OSError, KeyError, ValueError):
+            return None
+
+        if metadata['version'] != self.VERSION or metadata['key'] != self.key:
+            return None
+        sources = stat_files(self.source_files)
+        if [(source['name'], source['size']) for source in metadata['sources']] != [
+                (source['name'], source['size']) for source in sources]:
+            return None
+        result = RealizationResult(realization, *outputs, cached=True, stratified_counts=stratified_counts)
+        if metadata['sources'] != sources:
+            content_hash = hash_files(self.source_files)
+            if metadata['content_hash'] != content_hash:
+                return None
+            self.save(result, content_hash)
+        return result
+
+    def save(self, result: RealizationResult, content_hash: str) -> None:
+        metadata = {
+            'version': self.VERSION,
+            'key': self.key,
+            'stratified': result.stratified_counts is not None,
+            'sources': stat_files(self.source_files),
+            'content_hash': content_hash,
+        }
+        # Write to a temporary file and rename it so that an interrupted run never leaves a partial cache behind
+        temporary_file = self.cache_file.with_name('{}.{}.tmp'.format(self.cache_file.name, os.getpid()))
+        stratified_counts = {}
+        if result.stratified_counts is not None:
+            stratified_counts = {
+                'stratified_' + output: counts for output, counts in result.stratified_counts._asdict().items()
+            }
+        with temporary_file.open('wb') as f:
+            np.savez(
+                f,
+                metadata=np.array(json.dumps(metadata)),
+                ages_vaccinated=result.ages_vaccinated,
+                infections_by_age=result.infections_by_age,
+                new_infections_by_day=result.new_infections_by_day,
+                total_infected_by_day=result.total_infected_by_day,
+                **stratified_counts,
+            )
+        os.replace(temporary_file, self.cache_file)
+
+
+def hash_files(paths: List[Path], chunk_size: int = 1 << 24) -> str:
+    """The content hash of `paths` read one after the other, as the report readers compute it."""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        with path.open('rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
 
 
 class RealizationProcessor:
     """
     Class used to process each individual realization's output file. It will not write out any files, it will simply
-    return the `Dict`s containing the output data.
+    return a `RealizationResult` containing the output data. If the report has been converted to an event store (see
+    `event_store.py`) and pyarrow is installed, only the needed columns are read from the store instead.
+
+    With `use_phil_counts`, the counts PHIL wrote itself (`aggregate_event_report = 1`, with the default one age group
+    per year of age) in its `report1.age_counts.csv` and `report1.day_counts.csv` tables are used and the events are
+    not read at all, so the event report may be turned off (`event_report_line_list = 0`). These do not match the
+    counts of the events exactly: PHIL only counts the people infected on the days it simulated, and counts people by
+    the age it gave them, which for people over 89 is not the binned age in the synthetic population (see
+    `Demographics.cc`).
     """
-    def __init__(self, directory: Path, people_to_age_mapping: Dict[int, int]) -> None:
+    # Only these fields are decoded from the report, every other field and event type is skipped
+    event_fields = {
+        'infection': ['person', 'infectious', 'recovered'],
+        'vaccination': ['person'],
+    }
+
+    def __init__(self, directory: Path, age_lookup: AgeLookup,
+                 stratification: Optional[Stratification] = None, use_phil_counts: bool = False) -> None:
+        self.directory = directory
         self.output_file = directory / "OUT" / "report1.json_lines"
-        self.people_to_age_mapping = people_to_age_mapping
+        if not self.output_file.exists() and self.output_file.with_name("report1.json_lines.fsz").exists():
+            # PHIL ran with `compress_event_report = 1`
+            self.output_file = self.output_file.with_name("report1.json_lines.fsz")
+        self.age_counts_file = directory / "OUT" / "report1.age_counts.csv"
+        self.day_counts_file = directory / "OUT" / "report1.day_counts.csv"
+        self.age_lookup = age_lookup
+        self.stratification = stratification
+        self.use_phil_counts = use_phil_counts
         self.start_date = None
-        # Ranges are hardcoded for simplicity
-        self.ages_vaccinated = {age: 0 for age in range(110)}
-        self.infections_by_age = {age: 0 for age in range(110)}
-        # Realizations start on some date between 2012-01-01 and 2012-01-07
-        earliest_date = datetime.datetime.fromisoformat("2012-01-01")
-        self.new_infections_by_day = {earliest_date + datetime.timedelta(days=day): 0 for day in range(200)}
-        self.total_infected_by_day = {earliest_date + datetime.timedelta(days=day): 0 for day in range(200)}
-
-    def process(self) -> Tuple[Dict[int, int], Dict[int, int], Dict[int, int], Dict[int, int]]:
-        with self.output_file.open() as report:
-            # Get the start date from the header
-            line = report.readline()
-            header = ast.literal_eval(line)
-            start_date = header['start_date']
-            self.start_date = datetime.datetime.fromisoformat(start_date)
-
-            while True:
-                line = report.readline()
-                try:
-                    line = ast.literal_eval(line)
-                    if line['event'] == 'vaccination':
-                        self.process_vaccination(line)
-                    elif line['event'] == 'infection':
-                        self.process_infection(line)
-                    else:
-                        # Not the best way to handle unexpected events in a multiprocess environment,
-                        # but I don't think any other types of events currently exist in PHIL.
-                        raise RuntimeError("Received an unexpected event type: {}", line)
-                except SyntaxError:
-                    # An empty line will raise a SyntaxError when you try to evaluate it, so
-                    # this is a simple way to tell when we've reached the end of the file.
-                    break
-
-        return self.ages_vaccinated, self.infections_by_age, self.new_infections_by_day, self.total_infected_by_day
-
-    def process_vaccination(self, event: Dict[str, Any]) -> None:
-        person_vaccinated = event['person']
-        age_vaccinated = self.people_to_age_mapping[person_vaccinated]
-        self.ages_vaccinated[age_vaccinated] += 1
-
-    def process_infection(self, event: Dict[str, Any]) -> None:
-        # infections_by_age
-        person_infected = event['person']
-        age_infected = self.people_to_age_mapping[person_infected]
-        self.infections_by_age[age_infected] += 1
-
-        day_infected = event['infectious']
-        date_infected = self.start_date + datetime.timedelta(days=day_infected)
-
-        # new_infections_by_day
-        self.new_infections_by_day[date_infected] += 1
-
-        # total_infected_by_day
-        for day in range(day_infected, event['recovered']):
-            date = self.start_date + datetime.timedelta(days=day)
-            self.total_infected_by_day[date] += 1
+        self.content_hash = None
+        self.columns = {
+            (event, field): []
+            for event, fields in self.event_fields.items()
+            for field in fields
+        }
+
+    def source_files(self) -> List[Path]:
+        """The files the outputs are read from, see `RealizationCache`."""
+        if self.use_phil_counts:
+            return [self.age_counts_file, self.day_counts_file]
+        if not self.output_file.exists():
+            return [self.output_file]
+        return report_source_files(self.output_file)
+
+    def process(self) -> RealizationResult:
+        if self.use_phil_counts:
+            return self.read_counts()
+
+        store_dir = event_store.store_path(self.output_file)
+        if event_store.available() and event_store.is_current(store_dir, self.output_file):
+            self.read_event_store(store_dir)
+        else:
+            self.read_report()
+
+        day_offset = (self.start_date - EARLIEST_DATE).days
+        people_vaccinated = self.column('vaccination', 'person')
+        people_infected = self.column('infection', 'person')
+        days_infected = self.column('infection', 'infectious') + day_offset
+        days_recovered = self.column('infection', 'recovered') + day_offset
+        ages_vaccinated = self.count_vaccinations(people_vaccinated)
+        infections_by_age, new_infections_by_day, total_infected_by_day = self.count_infections(
+            people_infected, days_infected, days_recovered)
+        stratified_counts = None
+        if self.stratification is not None:
+            stratified_counts = self.stratification.count(
+                people_vaccinated, people_infected, days_infected, days_recovered, NUMBER_OF_DAYS)
+        return RealizationResult(
+            self.directory, ages_vaccinated, infections_by_age, new_infections_by_day, total_infected_by_day,
+            stratified_counts=stratified_counts)
+
+    def read_report(self) -> None:
+        digest = hashlib.blake2b(digest_size=16)
+        # PHIL runs with `event_report_format = binary` write their events next to the report, see `BinaryEventReader`
+        reader = open_report(self.output_file, fields=self.event_fields, digest=digest)
+        for batch in reader:
+            # The parameters record is the first line of the report, so the start date is always set before any
+            # events are processed.
+            if isinstance(batch, ParametersRecord):
+                self.start_date = batch.start_date
+            else:
+                for field, values in batch.columns.items():
+                    self.columns[(batch.event, field)].append(values)
+        self.content_hash = digest.hexdigest()
+
+    def read_event_store(self, store_dir: Path) -> None:
+        metadata = event_store.read_metadata(store_dir)
+        self.start_date = ParametersRecord(metadata['parameters']).start_date
+        self.content_hash = metadata['source']['content_hash']
+        for event, fields in self.event_fields.items():
+            table = event_store.read_events(store_dir, event, columns=fields)
+            for field in fields:
+                self.columns[(event, field)].append(table.column(field).to_numpy())
+
+    def read_counts(self) -> RealizationResult:
+        """Reads the counts PHIL wrote, which must be by single years of age."""
+        age_counts = pd.read_csv(self.age_counts_file)
+        if not (age_counts.age_to - age_counts.age_from == 1).all():
+            raise ValueError("{} is not counted by single years of age".format(self.age_counts_file))
+        self.content_hash = hash_files(self.source_files())
+        day_counts = pd.read_csv(self.day_counts_file, parse_dates=['date'])
+        days = (day_counts.date - EARLIEST_DATE).dt.days.to_numpy()
+        return RealizationResult(
+            self.directory,
+            self.place_counts(age_counts.age_from.to_numpy(), age_counts.vaccinated.to_numpy(), NUMBER_OF_AGES, 'age'),
+            self.place_counts(age_counts.age_from.to_numpy(), age_counts.infected.to_numpy(), NUMBER_OF_AGES, 'age'),
+            self.place_counts(days, day_counts.new_infections.to_numpy(), NUMBER_OF_DAYS, 'day'),
+            self.place_counts(days, day_counts.total_infected.to_numpy(), NUMBER_OF_DAYS, 'day'),
+        )
+
+    @staticmethod
+    def place_counts(positions: np.ndarray, counts: np.ndarray, length: int, name: str) -> np.ndarray:
+        """Places `counts` at `positions` in an array of `length` counts, like `bincount` does for single events."""
+        outside = (positions < 0) | (positions >= length)
+        if counts[outside].any():
+            raise KeyError("Received an {} outside of the range [0, {})".format(name, length))
+        result = np.zeros(length, dtype=np.int64)
+        result[positions[~outside]] = counts[~outside]
+        return result
+
+    def column(self, event: str, field: str) -> np.ndarray:
+        values = self.columns[(event, field)]
+        return np.concatenate(values).astype(np.int64) if values else np.zeros(0, dtype=np.int64)
+
+    def count_vaccinations(self, people_vaccinated: np.ndarray) -> np.ndarray:
+        return self.bincount(self.age_lookup.lookup(people_vaccinated), NUMBER_OF_AGES, 'age')
+
+    def count_infections(self, people_infected: np.ndarray, days_infected: np.ndarray,
+                         days_recovered: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        infections_by_age = self.bincount(self.age_lookup.lookup(people_infected), NUMBER_OF_AGES, 'age')
+        new_infections_by_day = self.bincount(days_infected, NUMBER_OF_DAYS, 'day')
+
+        # Each person is infected on every day in [infectious, recovered), so add one on the day they become
+        # infectious and take it away again on the day they recover, then a cumulative sum gives the prevalence.
+        ill = days_recovered > days_infected
+        if ill.any() and days_recovered[ill].max() > NUMBER_OF_DAYS:
+            raise KeyError("Received an infection outside of the first {} days".format(NUMBER_OF_DAYS))
+        changes = (np.bincount(days_infected[ill], minlength=NUMBER_OF_DAYS + 1)
+                   - np.bincount(days_recovered[ill], minlength=NUMBER_OF_DAYS + 1))
+        total_infected_by_day = np.cumsum(changes)[:NUMBER_OF_DAYS]
+
+        return infections_by_age, new_infections_by_day, total_infected_by_day
+
+    @staticmethod
+    def bincount(values: np.ndarray, length: int, name: str) -> np.ndarray:
+        if len(values) and (values.min() < 0 or values.max() >= length):
+            raise KeyError("Received an {} outside of the range [0, {})".format(name, length))
+        return np.bincount(values, minlength=length)
 
 
 if __name__ == '__main__':
@@ -166,9 +456,27 @@ if __name__ == '__main__':
     parser.add_argument('results_dir', type=str, help='The path to directory containing all the output files')
     parser.add_argument('people_file', type=str, help='The path to the synthetic population people file')
     parser.add_argument('number_of_processors', type=int, help='The number of processors you want to use')
+    parser.add_argument('--no_cache', action='store_true',
+                        help="Reprocess every realization instead of using each realization's cached outputs")
+    parser.add_argument('--summary_stats', action='store_true',
+                        help='Also write the summary statistics of each output, computed as the realizations arrive')
+    parser.add_argument('--stratify', type=str, default=None,
+                        help='The path to a YAML stratification config (e.g. wrk/univax/config.yaml) to also count by')
+    parser.add_argument('--households_file', type=str, default=None,
+                        help='The path to the synthetic population households file, if stratifying by income or tract')
+    parser.add_argument('--phil_counts', action='store_true',
+                        help='Use the counts PHIL wrote with aggregate_event_report = 1 instead of counting the events')
     args = parser.parse_args()
+    if args.phil_counts and args.stratify is not None:
+        parser.error("PHIL's counts cannot be stratified")
+    logging.basicConfig(level=logging.INFO, format='[%(name)s] %(asctime)s %(message)s')
     main(
         args.results_dir,
         args.people_file,
         args.number_of_processors,
+        not args.no_cache,
+        args.summary_stats,
+        Stratification.load(load_config(args.stratify), args.people_file, args.households_file)
+        if args.stratify is not None else None,
+        args.phil_counts,
     )
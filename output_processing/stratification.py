@@ -0,0 +1,303 @@
+from argparse import ArgumentParser
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# The attributes people can be grouped by, and the file and column each is read from. `gender` is the name the old
+# `convert_output.py` configs (e.g. `wrk/univax/config.yaml`) use for sex, and a tract is the first 11 digits of the
+# household's block group.
+PEOPLE_ATTRIBUTES = {'age': 'age', 'sex': 'sex', 'gender': 'sex', 'race': 'race'}
+HOUSEHOLD_ATTRIBUTES = {'income': 'hh_income', 'tract': 'stcotrbg', 'stcotrbg': 'stcotrbg'}
+
+# The age groupings Sarah wants
+DEFAULT_AGE_CONFIG = {
+    'age': {
+        'intervals': [0, 5, 18, 45, 65, 120],
+        'labels': ['0-4', '5-17', '18-44', '45-64', '65+'],
+    },
+}
+
+
+def load_config(config_file: Union[str, Path]) -> Dict[str, Any]:
+    """Reads a YAML stratification config, e.g. `wrk/univax/config.yaml`."""
+    if yaml is None:
+        raise ImportError("Reading stratification configs requires PyYAML, install it with `pip install pyyaml`")
+    with Path(config_file).open() as f:
+        return yaml.safe_load(f) or {}
+
+
+def expand_config(config: Dict[str, Any]) -> Dict[str, Union[List[float], int, None]]:
+    """
+    Expands the `intervals` of each attribute of a stratification config like the old `convert_output.expand_config`:
+    a list of bin edges, in which `{'from': a, 'to': b, 'by': c}` stands for the edges `a, a + c, ..., b`, or a number
+    of equal width bins. Attributes without intervals (e.g. `sex:`) have one group per distinct value, and are `None`.
+    """
+    expanded = {}
+    for attribute, spec in config.items():
+        if spec is not None and 'intervals' in spec:
+            if isinstance(spec['intervals'], list):
+                edges = []
+                for interval in spec['intervals']:
+                    if isinstance(interval, dict):
+                        edges.extend(np.arange(interval['from'], interval['to'] + interval['by'], interval['by']))
+                    else:
+                        edges.append(interval)
+                expanded[attribute] = edges
+            else:
+                # intervals is just the number of bins
+                expanded[attribute] = int(spec['intervals'])
+        else:
+            expanded[attribute] = None
+    return expanded
+
+
+def bin_values(values: np.ndarray, intervals: Union[List[float], int, None],
+               labels: Optional[Sequence[str]] = None) -> Tuple[np.ndarray, List[Any]]:
+    """
+    Bins `values` into the groups given by expanded `intervals` (see `expand_config`). Returns the group code of each
+    value and the label of each group. Bins given by their edges are closed on the left, `[a, b)`, as in
+    `convert_output.bin_columns`, and values outside every bin get the code `Stratification.MISSING_GROUP`. A number of
+    intervals gives equal width bins spanning the values, made as `pd.cut(values, bins=intervals)` makes them: closed
+    on the right, `(a, b]`, with the first edge lowered by 0.1% of the range so that the first bin includes the
+    minimum.
+    """
+    values = np.asarray(values)
+    if intervals is None:
+        groups, codes = np.unique(values, return_inverse=True)
+        default_labels = groups.tolist()
+    else:
+        if isinstance(intervals, list):
+            edges = np.asarray(intervals, dtype=np.float64)
+            if len(edges) < 2 or (np.diff(edges) <= 0).any():
+                raise ValueError("Interval edges must be increasing: {}".format(intervals))
+            codes = np.searchsorted(edges, values, side='right') - 1
+            codes[(codes < 0) | (codes >= len(edges) - 1)] = Stratification.MISSING_GROUP
+            default_labels = [_interval_label(lower, upper) for lower, upper in zip(edges[:-1], edges[1:])]
+        else:
+            edges = _equal_width_edges(values, intervals)
+            codes = np.searchsorted(edges, values, side='left') - 1
+            # Only NaN values sort past the last edge
+            codes[codes >= intervals] = Stratification.MISSING_GROUP
+            default_labels = ['({:g}, {:g}]'.format(lower, upper) for lower, upper in zip(edges[:-1], edges[1:])]
+
+    if labels is None:
+        labels = default_labels
+    elif len(labels) != len(default_labels):
+        raise ValueError("Received {} labels for {} groups".format(len(labels), len(default_labels)))
+    return codes.astype(np.int32), list(labels)
+
+
+def _equal_width_edges(values: np.ndarray, intervals: int) -> np.ndarray:
+    """The edges of `intervals` equal width bins spanning `values`, as `pd.cut` computes them for right closed bins."""
+    if intervals < 1:
+        raise ValueError("The number of intervals must be positive: {}".format(intervals))
+    if not len(values):
+        return np.arange(intervals + 1, dtype=np.float64)
+    lowest, highest = float(np.nanmin(values)), float(np.nanmax(values))
+    if lowest == highest:
+        adjustment = 0.001 * abs(lowest) if lowest != 0 else 0.001
+        return np.linspace(lowest - adjustment, highest + adjustment, intervals + 1)
+    edges = np.linspace(lowest, highest, intervals + 1)
+    edges[0] -= (highest - lowest) * 0.001
+    return edges
+
+
+def _interval_label(lower: float, upper: float) -> str:
+    if float(lower).is_integer() and float(upper).is_integer():
+        # Integer attributes (age, income) only take the values lower, ..., upper - 1
+        return '{:g}-{:g}'.format(lower, upper - 1) if upper - 1 > lower else '{:g}'.format(lower)
+    return '[{:g}, {:g})'.format(lower, upper)
+
+
+class StratifiedCounts(NamedTuple):
+    """The counts of a single realization by group, and by day (rows) and group (columns)."""
+    vaccinated: np.ndarray
+    infected: np.ndarray
+    new_infections: np.ndarray
+    total_infected: np.ndarray
+
+
+class Stratification:
+    """
+    Dense `person -> group code` array for a stratification config. The attributes in the config are binned once, when
+    the lookup is built, and their group codes combined into one code per person, so a realization's events are
+    counted for every combination of groups with a single `bincount` per output. The code of `person` is stored at
+    `codes[person - offset]`. People missing from the synthetic population are stored as `MISSING_PERSON`, and people
+    outside every group of an attribute (e.g. older than the last age edge) as `MISSING_GROUP`, and are not counted.
+    """
+    MISSING_GROUP = -1
+    MISSING_PERSON = -2
+
+    def __init__(self, attributes: List[str], levels: List[List[Any]], offset: int, codes: np.ndarray) -> None:
+        self.attributes = attributes
+        self.levels = levels
+        self.offset = offset
+        self.codes = codes
+
+    @classmethod
+    def load(cls, config: Dict[str, Any], people_file: Union[str, Path],
+             households_file: Optional[Union[str, Path]] = None) -> 'Stratification':
+        """
+        Builds the lookup from a synthetic population. The households file, which income and tract are read from, is
+        found next to the people file (`*_synth_households.txt` for `*_synth_people.txt`) unless it is given.
+        """
+        people_file = Path(people_file)
+        unknown = [attribute for attribute in config
+                   if attribute not in PEOPLE_ATTRIBUTES and attribute not in HOUSEHOLD_ATTRIBUTES]
+        if unknown:
+            raise ValueError("Unable to group by: {}".format(', '.join(unknown)))
+
+        person_column, household_column = _id_columns(people_file, ['sp_hh_id', 'hh_id'])
+        people_columns = sorted({PEOPLE_ATTRIBUTES[attribute]
+                                 for attribute in config if attribute in PEOPLE_ATTRIBUTES})
+        household_columns = sorted({HOUSEHOLD_ATTRIBUTES[attribute]
+                                    for attribute in config if attribute in HOUSEHOLD_ATTRIBUTES})
+        usecols = [person_column] + people_columns
+        if household_columns:
+            if household_column is None:
+                raise ValueError("{} has no household id column to read income or tract with".format(people_file))
+            usecols.append(household_column)
+        people = pd.read_csv(people_file, index_col=person_column, usecols=usecols)
+
+        if household_columns:
+            if households_file is None:
+                households_file = people_file.with_name(people_file.name.replace('people', 'households'))
+            households_file = Path(households_file)
+            household_id_column = pd.read_csv(households_file, nrows=0).columns[0]
+            households = pd.read_csv(households_file, index_col=household_id_column,
+                                     usecols=[household_id_column] + household_columns)
+            people = people.join(households, on=household_column)
+            # People whose household is missing from the households file are not in any income or tract group
+            without_household = people[household_columns].isna().any(axis=1).to_numpy()
+            people[household_columns] = people[household_columns].fillna(0).astype(np.int64)
+        else:
+            without_household = None
+
+        columns = {}
+        for attribute in config:
+            if attribute in PEOPLE_ATTRIBUTES:
+                columns[attribute] = people[PEOPLE_ATTRIBUTES[attribute]].to_numpy()
+            elif attribute == 'tract':
+                columns[attribute] = people['stcotrbg'].to_numpy() // 10
+            else:
+                columns[attribute] = people[HOUSEHOLD_ATTRIBUTES[attribute]].to_numpy()
+        return cls.from_columns(config, people.index.to_numpy(), columns, without_household)
+
+    @classmethod
+    def from_columns(cls, config: Dict[str, Any], people: np.ndarray, columns: Dict[str, np.ndarray],
+                     missing: Optional[np.ndarray] = None) -> 'Stratification':
+        """
+        Builds the lookup from the person ids and the value of each attribute in `config` for each person. People marked
+        in `missing` are not in any group.
+        """
+        expanded = expand_config(config)
+        codes = np.zeros(len(people), dtype=np.int64)
+        missing = np.zeros(len(people), dtype=bool) if missing is None else missing.copy()
+        known = ~missing
+        levels = []
+        # Combine the attribute codes in mixed radix, the last attribute varying fastest
+        for attribute, intervals in expanded.items():
+            spec = config[attribute] or {}
+            attribute_codes = np.full(len(people), cls.MISSING_GROUP, dtype=np.int32)
+            attribute_codes[known], labels = bin_values(columns[attribute][known], intervals, spec.get('labels'))
+            missing |= attribute_codes == cls.MISSING_GROUP
+            codes = codes * len(labels) + attribute_codes
+            levels.append(labels)
+        codes[missing] = cls.MISSING_GROUP
+
+        offset = int(people.min()) if len(people) else 0
+        lookup = np.full(int(people.max()) - offset + 1 if len(people) else 0, cls.MISSING_PERSON, dtype=np.int32)
+        lookup[people - offset] = codes
+        return cls(list(expanded), levels, offset, lookup)
+
+    @property
+    def number_of_groups(self) -> int:
+        return int(np.prod([len(labels) for labels in self.levels], dtype=np.int64))
+
+    def index(self) -> pd.Index:
+        """The label(s) of each group, in group code order."""
+        if len(self.attributes) == 1:
+            return pd.Index(self.levels[0], name=self.attributes[0])
+        return pd.MultiIndex.from_product(self.levels, names=self.attributes)
+
+    def day_index(self, days: pd.Index) -> pd.MultiIndex:
+        """The labels of the rows of the by day and group outputs, every group of the first day first."""
+        return pd.MultiIndex.from_product([days] + self.levels, names=[days.name or 'day'] + self.attributes)
+
+    def content_hash(self) -> str:
+        """Identifies the groups and the group of everyone in the population."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([self.attributes, self.levels, self.offset], default=str).encode())
+        digest.update(np.ascontiguousarray(self.codes))
+        return digest.hexdigest()
+
+    def lookup(self, people: np.ndarray) -> np.ndarray:
+        positions = people.astype(np.int64) - self.offset
+        if len(positions) and (positions.min() < 0 or positions.max() >= len(self.codes)):
+            raise KeyError("Received people missing from the synthetic population")
+        codes = self.codes[positions]
+        if (codes == self.MISSING_PERSON).any():
+            raise KeyError("Received people missing from the synthetic population")
+        return codes
+
+    def count(self, people_vaccinated: np.ndarray, people_infected: np.ndarray, days_infected: np.ndarray,
+              days_recovered: np.ndarray, number_of_days: int) -> StratifiedCounts:
+        """
+        Counts the vaccinations and infections of a single realization by group, and the new infections and the
+        people infected (from the day they become infectious up to the day they recover) by day and group.
+        """
+        groups = self.number_of_groups
+        vaccinated_groups = self.lookup(people_vaccinated)
+        vaccinated = np.bincount(vaccinated_groups[vaccinated_groups != self.MISSING_GROUP], minlength=groups)
+
+        infected_groups = self.lookup(people_infected)
+        counted = infected_groups != self.MISSING_GROUP
+        infected_groups = infected_groups[counted].astype(np.int64)
+        days_infected = days_infected[counted]
+        days_recovered = days_recovered[counted]
+        infected = np.bincount(infected_groups, minlength=groups)
+
+        if len(days_infected) and (days_infected.min() < 0 or days_infected.max() >= number_of_days):
+            raise KeyError("Received a day outside of the range [0, {})".format(number_of_days))
+        new_infections = np.bincount(days_infected * groups + infected_groups,
+                                     minlength=number_of_days * groups).reshape(number_of_days, groups)
+
+        # As in `RealizationProcessor.count_infections`, add one on the day each person becomes infectious and take it
+        # away again on the day they recover, then a cumulative sum over the days gives the prevalence of each group
+        ill = days_recovered > days_infected
+        if ill.any() and days_recovered[ill].max() > number_of_days:
+            raise KeyError("Received an infection outside of the first {} days".format(number_of_days))
+        length = (number_of_days + 1) * groups
+        changes = (np.bincount(days_infected[ill] * groups + infected_groups[ill], minlength=length)
+                   - np.bincount(days_recovered[ill] * groups + infected_groups[ill], minlength=length))
+        total_infected = np.cumsum(changes.reshape(number_of_days + 1, groups), axis=0)[:number_of_days]
+
+        return StratifiedCounts(vaccinated, infected, new_infections, total_infected)
+
+
+def _id_columns(people_file: Path, household_columns: List[str]) -> Tuple[str, str]:
+    """The person id column (the first column) of a people file and its household id column."""
+    header = pd.read_csv(people_file, nrows=0).columns
+    household_column = next((column for column in household_columns if column in header), None)
+    return header[0], household_column
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Prints the number of people in each group of a stratification config.")
+    parser.add_argument('config_file', type=str, help='The path to the YAML stratification config')
+    parser.add_argument('people_file', type=str, help='The path to the synthetic population people file')
+    parser.add_argument('--households_file', type=str, default=None,
+                        help='The path to the synthetic population households file, if income or tract are used')
+    args = parser.parse_args()
+    stratification = Stratification.load(load_config(args.config_file), args.people_file, args.households_file)
+    codes = stratification.codes[stratification.codes >= 0]
+    print(pd.Series(np.bincount(codes, minlength=stratification.number_of_groups), index=stratification.index(),
+                    name='people').to_string())
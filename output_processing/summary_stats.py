@@ -1,10 +1,25 @@
 from argparse import ArgumentParser
+import csv
+import itertools
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
 
+# The quantiles Sarah wants besides the median, in the order their columns are written
+QUANTILES = [0.025, 0.975, 0.25, 0.75]
+SUMMARY_COLUMNS = ['mean', 'median', 'std', '2.5%', '97.5%', '25%', '75%', 'min', 'max']
 
-def main(results_dir: str) -> None:
-    """Computes the summary statistics Sarah wants on the 4 processed output files."""
+# Rows of the processed output files read at a time, so that only a few rows of the realization matrix are ever in
+# memory at once
+DEFAULT_CHUNK_SIZE = 256
+
+
+def main(results_dir: str, realizations: Optional[List[str]] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+    """
+    Computes the summary statistics Sarah wants on the 4 processed output files. Only the `realizations` columns are
+    read if given, and each file is read `chunk_size` rows at a time.
+    """
     filenames = [
         'age_groups_vaccinated',
         'infections_by_age_group',
@@ -14,37 +29,178 @@ def main(results_dir: str) -> None:
 
     for filename in filenames:
         in_path = Path(results_dir) / '{}.csv'.format(filename)
-        raw_data = pd.read_csv(in_path, index_col=0)
-
-        summary_stats = pd.concat([
-            raw_data.mean(axis=1),
-            raw_data.median(axis=1),
-            raw_data.std(axis=1),
-            raw_data.quantile(0.025, axis=1),
-            raw_data.quantile(0.975, axis=1),
-            raw_data.quantile(0.25, axis=1),
-            raw_data.quantile(0.75, axis=1),
-            raw_data.min(axis=1),
-            raw_data.max(axis=1),
-        ], axis=1)
-        summary_stats.columns = [
-            'mean',
-            'median',
-            'std',
-            '2.5%',
-            '97.5%',
-            '25%',
-            '75%',
-            'min',
-            'max',
-        ]
-
+        summary_stats = summarize_csv(in_path, realizations, chunk_size)
         out_path = Path(results_dir) / '{}_summary_stats.csv'.format(filename)
         summary_stats.to_csv(out_path)
 
 
+def summarize_csv(path: Path, realizations: Optional[List[str]] = None,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> pd.DataFrame:
+    """
+    Summarizes a processed output file (rows = ages/days, columns = realizations) a few rows at a time. The rows are
+    parsed straight into `numpy` arrays, as building a `DataFrame` with thousands of realization columns costs far more
+    than parsing them.
+    """
+    with Path(path).open() as f:
+        header = next(csv.reader([f.readline()]))
+        index_label = header[0]
+        if realizations is None:
+            usecols = range(1, len(header))
+        else:
+            positions = {column: position for position, column in enumerate(header)}
+            usecols = [positions[realization] for realization in realizations]
+
+        chunks = []
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                break
+            index = pd.Index([_index_label(line) for line in lines], name=index_label)
+            try:
+                data = np.loadtxt(lines, delimiter=',', quotechar='"', usecols=usecols, dtype=np.int64, ndmin=2)
+                integral = True
+            except ValueError:
+                data = np.loadtxt(lines, delimiter=',', quotechar='"', usecols=usecols, dtype=np.float64, ndmin=2)
+                integral = False
+            chunks.append(to_frame(summarize(data), index, integral))
+    return pd.concat(chunks)
+
+
+def _index_label(line: str) -> str:
+    """The first field of a CSV line. Labels holding commas, e.g. the group `"[0, 5)"`, are quoted."""
+    if line.startswith('"'):
+        return next(csv.reader([line]))[0]
+    return line.split(',', 1)[0]
+
+
+def summarize(data: np.ndarray) -> np.ndarray:
+    """
+    Computes all of the summary statistics of each row of `data` (rows = ages/days, columns = realizations) from a
+    single sort of each row. Returns one column per statistic in `SUMMARY_COLUMNS`. The quantiles interpolate linearly
+    and the standard deviation has one degree of freedom, like pandas.
+    """
+    # The moments are computed before sorting, and from a column-major copy like the one pandas keeps, so that they are
+    # summed in the same order as pandas sums them
+    data = np.asfortranarray(data, dtype=np.float64)
+    count = data.shape[1]
+    statistics = np.empty((data.shape[0], len(SUMMARY_COLUMNS)))
+    statistics[:, 0] = data.mean(axis=1)
+    statistics[:, 2] = data.std(axis=1, ddof=1) if count > 1 else np.nan
+    data = np.sort(data, axis=1)
+    statistics[:, 1] = _sorted_quantile(data, 0.5)
+    for column, quantile in enumerate(QUANTILES, 3):
+        statistics[:, column] = _sorted_quantile(data, quantile)
+    statistics[:, 7] = data[:, 0]
+    statistics[:, 8] = data[:, -1]
+    return statistics
+
+
+def to_frame(statistics: np.ndarray, index: Sequence, integral: bool) -> pd.DataFrame:
+    """The summary statistics as a `DataFrame`. The minimum and maximum of integer data are kept as integers."""
+    summary_stats = pd.DataFrame(statistics, index=index, columns=SUMMARY_COLUMNS)
+    if integral:
+        summary_stats = summary_stats.astype({'min': np.int64, 'max': np.int64})
+    return summary_stats
+
+
+def _sorted_quantile(data: np.ndarray, quantile: float) -> np.ndarray:
+    position = (data.shape[1] - 1) * quantile
+    lower = int(np.floor(position))
+    upper = min(lower + 1, data.shape[1] - 1)
+    return data[:, lower] + (position - lower) * (data[:, upper] - data[:, lower])
+
+
+class RunningSummary:
+    """
+    Summary statistics of a processed output that can be updated as each realization's results arrive and merged with
+    the summaries of other sets of realizations, without ever holding the realization matrix.
+
+    The mean and standard deviation are kept as running moments. The quantiles, minimum and maximum are exact: each row
+    keeps a count of every distinct value seen, which stays small because the outputs are counts that repeat across
+    realizations.
+    """
+    def __init__(self, rows: int) -> None:
+        self.rows = rows
+        self.count = 0
+        self.mean = np.zeros(rows)
+        # Sum of squared differences from the mean
+        self.m2 = np.zeros(rows)
+        self.value_counts = [(np.zeros(0), np.zeros(0, dtype=np.int64)) for _ in range(rows)]
+        self.integral = True
+
+    def add(self, realization: np.ndarray) -> None:
+        """Adds the results of a single realization, one value per row."""
+        self.add_many(np.asarray(realization).reshape(self.rows, 1))
+
+    def add_many(self, data: np.ndarray) -> None:
+        """Adds the results of several realizations (rows = ages/days, columns = realizations)."""
+        data = np.asarray(data)
+        other = RunningSummary(self.rows)
+        other.integral = np.issubdtype(data.dtype, np.integer)
+        data = data.astype(np.float64)
+        other.count = data.shape[1]
+        other.mean = data.mean(axis=1)
+        other.m2 = ((data - other.mean[:, np.newaxis]) ** 2).sum(axis=1)
+        other.value_counts = [np.unique(row, return_counts=True) for row in data]
+        self.merge(other)
+
+    def merge(self, other: 'RunningSummary') -> None:
+        """Adds the realizations summarized by `other`."""
+        if other.rows != self.rows:
+            raise ValueError("Cannot merge a summary of {} rows with one of {} rows".format(other.rows, self.rows))
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.integral = self.integral and other.integral
+        self.value_counts = [
+            _merge_value_counts(mine, theirs) for mine, theirs in zip(self.value_counts, other.value_counts)
+        ]
+
+    def statistics(self) -> np.ndarray:
+        """The summary statistics of each row, one column per statistic in `SUMMARY_COLUMNS`."""
+        if self.count == 0:
+            raise ValueError("No realizations have been summarized")
+        statistics = np.empty((self.rows, len(SUMMARY_COLUMNS)))
+        statistics[:, 0] = self.mean
+        statistics[:, 2] = np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+        for row, (values, counts) in enumerate(self.value_counts):
+            statistics[row, [1, 3, 4, 5, 6]] = _value_count_quantiles(values, counts, [0.5] + QUANTILES)
+            statistics[row, 7] = values[0]
+            statistics[row, 8] = values[-1]
+        return statistics
+
+    def to_frame(self, index: Sequence) -> pd.DataFrame:
+        return to_frame(self.statistics(), index, self.integral)
+
+
+def _merge_value_counts(first: Tuple[np.ndarray, np.ndarray],
+                        second: Tuple[np.ndarray, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    values, inverse = np.unique(np.concatenate([first[0], second[0]]), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([first[1], second[1]]), minlength=len(values))
+    return values, counts.astype(np.int64)
+
+
+def _value_count_quantiles(values: np.ndarray, counts: np.ndarray, quantiles: List[float]) -> np.ndarray:
+    """The quantiles of the sorted `values` repeated `counts` times, interpolated linearly like `_sorted_quantile`."""
+    # The position in the sorted realizations after the last occurrence of each value
+    ends = np.cumsum(counts)
+    positions = (ends[-1] - 1) * np.asarray(quantiles)
+    lower = np.floor(positions)
+    lower_values = values[np.searchsorted(ends, lower, side='right')]
+    upper_values = values[np.searchsorted(ends, np.minimum(lower + 1, ends[-1] - 1), side='right')]
+    return lower_values + (positions - lower) * (upper_values - lower_values)
+
+
 if __name__ == '__main__':
     parser = ArgumentParser(description="Computes the summary statistics Sarah wants on the 4 processed output files.")
     parser.add_argument('results_dir', type=str, help='The path to directory containing all the processed output files')
+    parser.add_argument('--realizations', type=str, nargs='+', default=None,
+                        help='Only summarize these realization columns')
+    parser.add_argument('--chunk_size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='The number of rows to read at a time')
     args = parser.parse_args()
-    main(args.results_dir)
+    main(args.results_dir, args.realizations, args.chunk_size)
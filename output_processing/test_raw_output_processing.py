@@ -0,0 +1,55 @@
+"""
+Regression test for `raw_output_processing.py`: the 4 outputs it writes for the realizations in
+`test_data/raw_output_processing` must match exactly the ones the original `raw_output_processing.py` (before the
+reports were read in bulk with numpy) wrote for them, which are committed in `test_data/raw_output_processing/expected`.
+"""
+import shutil
+import pandas as pd
+import pytest
+from pathlib import Path
+
+try:
+    from .compare_outputs import OUTPUT_FILES, sort_realizations
+    from .raw_output_processing import main
+except ImportError:
+    from compare_outputs import OUTPUT_FILES, sort_realizations
+    from raw_output_processing import main
+
+TEST_DATA = Path(__file__).parent / 'test_data' / 'raw_output_processing'
+
+
+@pytest.fixture
+def people_file(tmp_path: Path) -> Path:
+    """A copy of the committed people file, as its ages are cached next to it."""
+    return Path(shutil.copy(TEST_DATA / 'people.txt', tmp_path))
+
+
+@pytest.fixture
+def results_dir(tmp_path: Path) -> Path:
+    """The committed reports laid out as PHIL writes them, one `<realization>/OUT/report1.json_lines` each."""
+    results_dir = tmp_path / 'results'
+    for report in sorted(TEST_DATA.glob('realization*.json_lines')):
+        out_dir = results_dir / report.stem[len('realization'):] / 'OUT'
+        out_dir.mkdir(parents=True)
+        shutil.copy(report, out_dir / 'report1.json_lines')
+    return results_dir
+
+
+def assert_outputs_match(results_dir: Path) -> None:
+    for filename in OUTPUT_FILES:
+        # The order of the realization columns depends on the order the original processed the realizations in
+        expected = sort_realizations(pd.read_csv(TEST_DATA / 'expected' / filename, index_col=0))
+        actual = sort_realizations(pd.read_csv(results_dir / filename, index_col=0))
+        pd.testing.assert_frame_equal(expected, actual, obj=filename)
+
+
+@pytest.mark.parametrize('use_cache', [False, True])
+def test_outputs_match_original(results_dir: Path, people_file: Path, use_cache: bool) -> None:
+    main(str(results_dir), str(people_file), 2, use_cache=use_cache)
+    assert_outputs_match(results_dir)
+    if use_cache:
+        # Rerunning loads every realization from its cache
+        for filename in OUTPUT_FILES:
+            (results_dir / filename).unlink()
+        main(str(results_dir), str(people_file), 2, use_cache=True)
+        assert_outputs_match(results_dir)
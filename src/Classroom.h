@@ -40,6 +40,15 @@ class Classroom: public Place {
      */
     void get_parameters(int diseases);
 
+    /**
+     * Makes the next call of get_parameters read the parameters again
+     *
+     * @see Place_List::read_contact_parameters()
+     */
+    static void reset_parameters() {
+        Classroom::Classroom_parameters_set = false;
+    }
+
     /**
      * Add a person to the classroom. This method increments the number of people in
      * the classroom and also sets the age level for the classroom, if the person added
@@ -76,6 +76,21 @@ void SnappyFileCompression::compress_file_to_stdout() {
             total_uncompressed_bytes, total_compressed_bytes, total_header_bytes + FSZ_MAGIC_LEN());
 }
 
+void SnappyFileCompression::write_magic_bytes(FILE * fp) {
+    fwrite(FSZ_MAGIC(), sizeof(char), FSZ_MAGIC_LEN(), fp);
+}
+
+size_t SnappyFileCompression::write_compressed_block(FILE * fp, const char * data, size_t size) {
+    // same layout as compress_file_to_stdout:
+    // [ size compressed_size ][ char * compressed_data ]
+    std::string compressed_output;
+    snappy::Compress(data, size, &compressed_output);
+    size_t compressed_size = compressed_output.size();
+    fwrite((char *) &compressed_size, sizeof(char), sizeof(size_t), fp);
+    fwrite(compressed_output.data(), sizeof(char), compressed_size, fp);
+    return compressed_size;
+}
+
 void SnappyFileCompression::uncompress_file_to_stdout() {
     using namespace std;
     // open the compressed input file
@@ -73,6 +73,21 @@ class SnappyFileCompression {
 
   public:
 
+    static size_t get_default_block_size() {
+        return default_block_size;
+    }
+
+    /*
+     * Writes the magic bytes that start every fsz file to fp
+     */
+    static void write_magic_bytes(FILE * fp);
+
+    /*
+     * Compresses size bytes of data and writes them to fp as a single block,
+     * preceeded by its compressed size.  Returns the compressed size.
+     */
+    static size_t write_compressed_block(FILE * fp, const char * data, size_t size);
+
     SnappyFileCompression(char * _infile_name) {
         infile_name = new char[ std::strlen(_infile_name) + 1 ];
         std::strcpy(infile_name, _infile_name);
@@ -65,11 +65,7 @@ void Disease::setup(int disease, Population *pop, double *mut_prob) {
         fflush(Global::Statusfp);
     }
 
-    Params::get_param_from_string("R0",&R0);
-    Params::get_param_from_string("R0_a",&R0_a);
-    Params::get_param_from_string("R0_b",&R0_b);
-
-    Params::get_indexed_param("trans",id,&transmissibility);
+    read_transmissibility();
     Params::get_indexed_param("mortality_rate",id,&mortality_rate);
     Params::get_indexed_param("immunity_loss_mu",id,&immunity_loss_mu);
     Params::get_indexed_param("immunity_loss_sigma",id,&immunity_loss_sigma);
@@ -81,10 +77,6 @@ void Disease::setup(int disease, Population *pop, double *mut_prob) {
         seasonality_Kb = log(seasonality_max - seasonality_min);
     }
 
-    if (Disease::R0 > 0) {
-        transmissibility = Disease::R0_a*Disease::R0*Disease::R0 + Disease::R0_b*Disease::R0;
-    }
-
     mutation_prob = mut_prob;
     population = pop;
 
@@ -162,6 +154,18 @@ void Disease::setup(int disease, Population *pop, double *mut_prob) {
     }
 }
 
+void Disease::read_transmissibility() {
+    Params::get_param_from_string("R0",&R0);
+    Params::get_param_from_string("R0_a",&R0_a);
+    Params::get_param_from_string("R0_b",&R0_b);
+
+    Params::get_indexed_param("trans",id,&transmissibility);
+
+    if (Disease::R0 > 0) {
+        transmissibility = Disease::R0_a*Disease::R0*Disease::R0 + Disease::R0_b*Disease::R0;
+    }
+}
+
 void Disease::print() {
     // Since most of Disease has been moved to IntraHost (or classes derived from it)
     // the old print() function no longer worked.
@@ -43,6 +43,12 @@ class Disease {
      */
     void setup(int s, Population *pop,  double *mut_prob);
 
+    /**
+     * Read the transmissibility of the Disease, given either by trans or by R0; called by setup
+     * and again when the parameters were changed with Params::set_param
+     */
+    void read_transmissibility();
+
     /**
      * Print out information about this object
      */
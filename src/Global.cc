@@ -25,6 +25,10 @@ char Global::Tracefilebase[PHIL_STRING_SIZE];
 char Global::VaccineTracefilebase[PHIL_STRING_SIZE];
 char Global::VaccineInfectionTrackerfilebase[PHIL_STRING_SIZE];
 char Global::EventReportFile[PHIL_STRING_SIZE];
+char Global::EventReportFormat[PHIL_STRING_SIZE];
+char Global::EventReportBase[PHIL_STRING_SIZE];
+char Global::Worker_socket[PHIL_STRING_SIZE];
+int Global::Worker_processes = 1;
 int Global::Incremental_Trace = 0;
 int Global::Trace_Headers = 0;
 int Global::Rotate_start_date = 0;
@@ -86,6 +90,12 @@ bool Global::Report_Place_Of_Infection = false;
 bool Global::Report_Distance_Of_Infection = false;
 bool Global::Report_Presenteeism = false;
 bool Global::Assign_Teachers = false;
+bool Global::Binary_Event_Report = false;
+bool Global::Compress_Event_Report = false;
+bool Global::Report_Writer_Thread = false;
+int Global::Report_Writer_Max_Queued_Records = 0;
+bool Global::Event_Report_Line_List = true;
+bool Global::Aggregate_Event_Report = false;
 int Global::Print_GAIA_Data = 0;
 
 // per-strain immunity reporting off by default
@@ -122,6 +132,8 @@ FILE *Global::ErrorLogfp = NULL;
 FILE *Global::Immunityfp = NULL;
 FILE *Global::Householdfp = NULL;
 FILE *Global::Reportfp = NULL;
+FILE *Global::InfectionReportfp = NULL;
+FILE *Global::VaccinationReportfp = NULL;
 
 
 void Global::get_global_parameters() {
@@ -143,6 +155,9 @@ void Global::get_global_parameters() {
     Params::get_param_from_string("track_vaccine_infection_events", &Global::Track_vaccine_infection_events);
     Params::get_param_from_string("vaccine_infection_tracker_file", Global::VaccineInfectionTrackerfilebase);
     Params::get_param_from_string("event_report_file", Global::EventReportFile);
+    Params::get_param_from_string("event_report_format", Global::EventReportFormat);
+    Params::get_param_from_string("worker_socket", Global::Worker_socket);
+    Params::get_param_from_string("worker_processes", &Global::Worker_processes);
     Params::get_param_from_string("track_age_distribution", &Global::Track_age_distribution);
     Params::get_param_from_string("track_network_stats", &Global::Track_network_stats);
     Params::get_param_from_string("track_household_distribution", &Global::Track_household_distribution);
@@ -213,6 +228,24 @@ void Global::get_global_parameters() {
     Global::Report_Distance_Of_Infection = temp_int;
     Params::get_param_from_string("report_presenteeism",&temp_int);
     Global::Report_Presenteeism = temp_int;
+    Params::get_param_from_string("compress_event_report", &temp_int);
+    Global::Compress_Event_Report = temp_int;
+    Params::get_param_from_string("report_writer_thread", &temp_int);
+    Global::Report_Writer_Thread = temp_int;
+    Params::get_param_from_string("report_writer_max_queued_records", &Global::Report_Writer_Max_Queued_Records);
+    Params::get_param_from_string("event_report_line_list", &temp_int);
+    Global::Event_Report_Line_List = temp_int;
+    Params::get_param_from_string("aggregate_event_report", &temp_int);
+    Global::Aggregate_Event_Report = temp_int;
+
+    // json: one json record per line in the event report
+    // binary: fixed-width records in one file per event type next to the event report,
+    // which then only holds the parameters record (see Report.h)
+    if (strcmp(Global::EventReportFormat, "binary") == 0) {
+        Global::Binary_Event_Report = true;
+    } else if (strcmp(Global::EventReportFormat, "json") != 0) {
+        Utils::phil_abort("Unknown event_report_format %s\n", Global::EventReportFormat);
+    }
 
     // Sanity Checks
     if (Global::Diseases > Global::MAX_NUM_DISEASES) {
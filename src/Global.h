@@ -155,6 +155,10 @@ class Global {
     static char VaccineTracefilebase[];
     static char VaccineInfectionTrackerfilebase[];
     static char EventReportFile[];
+    static char EventReportFormat[];
+    static char EventReportBase[];
+    static char Worker_socket[];
+    static int Worker_processes;
     static int Incremental_Trace;
     static int Trace_Headers;
     static int Rotate_start_date;
@@ -219,6 +223,12 @@ class Global {
     static bool Report_Distance_Of_Infection;
     static bool Report_Presenteeism;
     static bool Assign_Teachers;
+    static bool Binary_Event_Report;
+    static bool Compress_Event_Report;
+    static bool Report_Writer_Thread;
+    static int Report_Writer_Max_Queued_Records;
+    static bool Event_Report_Line_List;
+    static bool Aggregate_Event_Report;
     static int Print_GAIA_Data;
 
     // global singleton objects
@@ -250,6 +260,8 @@ class Global {
     static FILE *Householdfp;
     static FILE *BlockDayfp;
     static FILE *Reportfp;
+    static FILE *InfectionReportfp;
+    static FILE *VaccinationReportfp;
 
     /**
      * Fills the static variables with values from the parameter file.
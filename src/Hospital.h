@@ -37,6 +37,15 @@ class Hospital : public Place {
      */
     void get_parameters(int diseases);
 
+    /**
+     * Makes the next call of get_parameters read the parameters again
+     *
+     * @see Place_List::read_contact_parameters()
+     */
+    static void reset_parameters() {
+        Hospital::Hospital_parameters_set = false;
+    }
+
     /**
      * @see Place::get_group(int disease, Person * per)
      */
@@ -44,6 +44,15 @@ class Household: public Place {
      */
     void get_parameters(int diseases);
 
+    /**
+     * Makes the next call of get_parameters read the parameters again
+     *
+     * @see Place_List::read_contact_parameters()
+     */
+    static void reset_parameters() {
+        Household::Household_parameters_set = false;
+    }
+
     /**
      * @see Place::get_group(int disease, Person * per)
      */
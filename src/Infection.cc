@@ -274,6 +274,13 @@ void Infection::print() const {
 }
 
 void Infection::print_json() const {
+    if (Global::Aggregate_Event_Report) {
+        Global::Rpt.count_infection(host->get_init_age(), get_infectious_date(), get_symptomatic_date(),
+                                    get_recovery_date());
+    }
+    if (!Global::Event_Report_Line_List) {
+        return;
+    }
     int place_id = -1;
     char place_type = -1;
     if (place != NULL) {
@@ -288,6 +295,22 @@ void Infection::print_json() const {
         }
     }
     int corrected_susceptible_date = get_susceptible_date() < Global::Days ? get_susceptible_date() : -1;
+    if (Global::Binary_Event_Report) {
+        Infection_Event_Record r;
+        r.person = host->get_id();
+        r.disease = disease->get_id();
+        r.exposed = get_exposure_date();
+        r.infectious = get_infectious_date();
+        r.symptomatic = get_symptomatic_date();
+        r.recovered = get_recovery_date();
+        r.susceptible = corrected_susceptible_date;
+        r.infector = infector == NULL ? -1 : infector->get_id();
+        r.place = place_id;
+        r.place_type = place_type;
+        r.set_place_label(place != NULL ? place->get_label() : "NULL");
+        Global::Rpt.append(r);
+        return;
+    }
     json j = {
         {"event", "infection"},
         {"person", host->get_id()},
@@ -39,6 +39,15 @@ class Neighborhood : public Place {
      */
     void get_parameters(int diseases);
 
+    /**
+     * Makes the next call of get_parameters read the parameters again
+     *
+     * @see Place_List::read_contact_parameters()
+     */
+    static void reset_parameters() {
+        Neighborhood::Neighborhood_parameters_set = false;
+    }
+
     /**
      * @see Place::get_group(int disease, Person * per)
      */
@@ -18,110 +18,97 @@ char Params::param_value[MAX_PARAMS][MAX_PARAM_SIZE];
 int Params::param_count;
 
 int Params::read_parameters(char *paramfile) {
-    FILE *fp;
     char name[MAX_PARAM_SIZE];
     Params::param_count = 0;
 
     strcpy(name, "$PHIL_HOME/input_files/params.default");
-    fp = Utils::phil_open_file(name);
-    if (fp != NULL) {
-        while (fscanf(fp, "%s", name) == 1) {
-            if (name[0] == '#') {
-                int ch = 1;
-                while (ch != '\n')
-                    ch = fgetc(fp);
-                continue;
-            } else {
-                if (fscanf(fp, " = %[^\n]", Params::param_value[Params::param_count]) == 1) {
-
-                    //Remove end of line comments if they are there
-                    string temp_str(Params::param_value[Params::param_count]);
-                    size_t pos;
-                    string whitespaces(" \t\f\v\n\r");
-
-                    pos = temp_str.find("#");
-                    if (pos != string::npos)
-                        temp_str = temp_str.substr(0, pos);
-
-                    //trim trailing whitespace
-                    pos = temp_str.find_last_not_of(whitespaces);
-                    if (pos != string::npos) {
-                        if (pos != (temp_str.length() - 1))
-                            temp_str.erase(pos + 1);
-                    } else
-                        temp_str.clear(); //str is all whitespace
-
-                    strcpy(Params::param_value[Params::param_count], temp_str.c_str());
-
-                    strcpy(Params::param_name[Params::param_count], name);
-                    if (Global::Debug > 2) {
-                        printf("READ_PARAMS: %s = %s\n", Params::param_name[Params::param_count],
-                               Params::param_value[Params::param_count]);
-                    }
-                    Params::param_count++;
-                } else {
-                    Utils::phil_abort("Bad format in params.default file on line starting with %s\n",name);
-                }
-            }
+    Params::read_parameter_file(name, 0);
+    strcpy(name, paramfile);
+    Params::read_parameter_file(name, 0);
+
+    if (Global::Debug > 1) {
+        for (int i = 0; i < Params::param_count; i++) {
+            printf("READ_PARAMS: %s = %s\n", Params::param_name[i], Params::param_value[i]);
         }
-    } else {
-        Utils::phil_abort("Help!  Can't read paramfile %s\n", "params.default");
     }
-    fclose(fp);
+
+    return Params::param_count;
+}
+
+void Params::read_parameter_file(char *paramfile, int depth) {
+    FILE *fp;
+    char name[MAX_PARAM_SIZE];
 
     fp = Utils::phil_open_file(paramfile);
-    if (fp != NULL) {
-        while (fscanf(fp, "%s", name) == 1) {
-            if (name[0] == '#') {
-                int ch = 1;
-                while (ch != '\n')
-                    ch = fgetc(fp);
-                continue;
-            } else {
-                if (fscanf(fp, " = %[^\n]", Params::param_value[Params::param_count]) == 1) {
-
-                    //Remove end of line comments if they are there
-                    string temp_str(Params::param_value[Params::param_count]);
-                    size_t pos;
-                    string whitespaces(" \t\f\v\n\r");
-
-                    pos = temp_str.find("#");
-                    if (pos != string::npos)
-                        temp_str = temp_str.substr(0, pos);
-
-                    //trim trailing whitespace
-                    pos = temp_str.find_last_not_of(whitespaces);
-                    if (pos != string::npos) {
-                        if (pos != (temp_str.length() - 1))
-                            temp_str.erase(pos + 1);
-                    } else
-                        temp_str.clear(); //str is all whitespace
-
-                    strcpy(Params::param_value[Params::param_count], temp_str.c_str());
-
-                    strcpy(Params::param_name[Params::param_count], name);
-                    if (Global::Debug > 2) {
-                        printf("READ_PARAMS: %s = %s\n", Params::param_name[Params::param_count],
-                               Params::param_value[Params::param_count]);
+    if (fp == NULL) {
+        Utils::phil_abort("Help!  Can't read paramfile %s\n", paramfile);
+    }
+    while (fscanf(fp, "%s", name) == 1) {
+        if (name[0] == '#') {
+            int ch = 1;
+            while (ch != '\n')
+                ch = fgetc(fp);
+            continue;
+        } else {
+            if (Params::param_count == MAX_PARAMS) {
+                Utils::phil_abort("Help! Too many parameters in file %s\n", paramfile);
+            }
+            if (fscanf(fp, " = %[^\n]", Params::param_value[Params::param_count]) == 1) {
+
+                //Remove end of line comments if they are there
+                string temp_str(Params::param_value[Params::param_count]);
+                size_t pos;
+                string whitespaces(" \t\f\v\n\r");
+
+                pos = temp_str.find("#");
+                if (pos != string::npos)
+                    temp_str = temp_str.substr(0, pos);
+
+                //trim trailing whitespace
+                pos = temp_str.find_last_not_of(whitespaces);
+                if (pos != string::npos) {
+                    if (pos != (temp_str.length() - 1))
+                        temp_str.erase(pos + 1);
+                } else
+                    temp_str.clear(); //str is all whitespace
+
+                if (strcmp(name, "include") == 0) {
+                    // the parameters after the include override those of the included file
+                    if (depth == MAX_PARAM_INCLUDE_DEPTH) {
+                        Utils::phil_abort("Help! Too many nested includes in file %s\n", paramfile);
+                    }
+                    string included(temp_str);
+                    string dir(paramfile);
+                    if (included.empty()) {
+                        Utils::phil_abort("Help! Bad include in file %s\n", paramfile);
+                    }
+                    if (included[0] != '/' && included.compare(0, 10, "$PHIL_HOME") != 0
+                        && dir.find_last_of('/') != string::npos) {
+                        // relative to the including file
+                        included.insert(0, dir.substr(0, dir.find_last_of('/') + 1));
+                    }
+                    if (included.size() >= MAX_PARAM_SIZE) {
+                        Utils::phil_abort("Help! Included file name too long in file %s\n", paramfile);
                     }
-                    Params::param_count++;
-                } else {
-                    Utils::phil_abort("Help! Bad format in file %s on line starting with %s\n",paramfile, name);
+                    strcpy(name, included.c_str());
+                    Params::read_parameter_file(name, depth + 1);
+                    continue;
                 }
+
+                strcpy(Params::param_value[Params::param_count], temp_str.c_str());
+
+                strcpy(Params::param_name[Params::param_count], name);
+                if (Global::Debug > 2) {
+                    printf("READ_PARAMS: %s = %s\n", Params::param_name[Params::param_count],
+                           Params::param_value[Params::param_count]);
+                }
+                Params::param_count++;
+            } else {
+                Utils::phil_abort("Help! Bad format in file %s on line starting with %s\n",paramfile, name);
             }
         }
-    } else {
-        Utils::phil_abort("Help!  Can't read paramfile %s\n", paramfile);
     }
     fclose(fp);
-
-    if (Global::Debug > 1) {
-        for (int i = 0; i < Params::param_count; i++) {
-            printf("READ_PARAMS: %s = %s\n", Params::param_name[i], Params::param_value[i]);
-        }
-    }
-
-    return Params::param_count;
 }
 
 int Params::get_param(char *s, int *p) {
@@ -455,6 +442,32 @@ int Params::get_double_indexed_param_map(string s, int index_i, int index_j, map
     return err;
 }
 
+void Params::set_param(const char *s, const char *value) {
+    if (strlen(s) >= MAX_PARAM_SIZE || strlen(value) >= MAX_PARAM_SIZE) {
+        Utils::phil_abort("PARAMS: %s is too long to be set\n", s);
+    }
+    // get_param uses the last value of a parameter, so every one of them is replaced
+    int found = 0;
+    for (int i = 0; i < Params::param_count; i++) {
+        if (strcmp(Params::param_name[i], s) == 0) {
+            strcpy(Params::param_value[i], value);
+            found = 1;
+        }
+    }
+    if (!found) {
+        if (Params::param_count == MAX_PARAMS) {
+            Utils::phil_abort("PARAMS: too many parameters to set %s\n", s);
+        }
+        strcpy(Params::param_name[Params::param_count], s);
+        strcpy(Params::param_value[Params::param_count], value);
+        Params::param_count++;
+    }
+    if (Global::Debug > 0) {
+        printf("PARAMS: set %s = %s\n", s, value);
+        fflush(stdout);
+    }
+}
+
 bool Params::does_param_exist(char *s) {
 
     bool found = false;
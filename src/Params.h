@@ -7,6 +7,7 @@
 
 #define MAX_PARAMS 1000
 #define MAX_PARAM_SIZE 1024
+#define MAX_PARAM_INCLUDE_DEPTH 16
 
 #include <stdlib.h>
 #include <stdio.h>
@@ -73,11 +74,32 @@ class Params {
      * Read all of the parameters from a file and store them internally.  This method sets the private static
      * values param_name, param_value, and param_count
      *
+     * A line <code>include = &lt;file&gt;</code> reads the parameters of another file, relative to the
+     * directory of the including file unless it is absolute, in its place, so that a file can hold only the
+     * parameters that override those of a base file.
+     *
      * @param  paramfile the file to read
      * @return 1 if found
      */
     static int read_parameters(char *paramfile);
 
+    /**
+     * Read the parameters of one file, and of the files it includes, after those already read.
+     *
+     * @param paramfile the file to read
+     * @param depth the number of files including this one
+     */
+    static void read_parameter_file(char *paramfile, int depth);
+
+    /**
+     * Overrides the value read from the param files, or adds the parameter if it
+     * was not in them.
+     *
+     * @param s the parameter name
+     * @param value the new value of the parameter
+     */
+    static void set_param(const char *s, const char *value);
+
     /**
      * @param s the parameter name
      * @param p a pointer to the vector of ints that will be set
@@ -344,6 +344,22 @@ class Person {
 
         refuse_vaccine_until = day + 180;
 
+        if (Global::Aggregate_Event_Report) {
+            Global::Rpt.count_vaccination(get_init_age());
+        }
+        if (!Global::Event_Report_Line_List) {
+            return;
+        }
+
+        if (Global::Binary_Event_Report) {
+            Vaccination_Event_Record r;
+            r.person = get_id();
+            r.vaccine = vacc->get_ID();
+            r.vaccine_day = day;
+            Global::Rpt.append(r);
+            return;
+        }
+
         json j = {
             {"event", "vaccination"},
             {"vaccine_day", day},
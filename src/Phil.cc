@@ -23,6 +23,7 @@
 #include "Activities.h"
 #include "Tracker.h"
 #include "Report.h"
+#include "Worker.h"
 #include "json.h"
 
 using nlohmann::json;
@@ -70,6 +71,11 @@ int main(int argc, char* argv[]) {
     Params::read_parameters(paramfile);
     Global::get_global_parameters();
 
+    bool worker = strcmp(Global::Worker_socket, "none") != 0;
+    if (worker) {
+        Worker::setup();
+    }
+
     // get runtime population parameters
     Global::Pop.get_parameters();
 
@@ -210,6 +216,20 @@ int main(int argc, char* argv[]) {
         Global::Clim->print_summary();
     }
 
+    if (worker) {
+        Worker::serve(run, directory);
+    } else {
+        phil_simulate(run, new_seed, directory);
+    }
+
+    // close all open output files with global file pointers
+    Utils::phil_end();
+
+    return 0;
+}
+
+void phil_simulate(int run, unsigned long new_seed, char * directory) {
+
     for (int d = 0; d < Global::Diseases; ++d) {
         Disease * disease = Global::Pop.get_disease(d);
         disease->initialize_evolution_reporting_grid(Global::Large_Cells);
@@ -234,7 +254,9 @@ int main(int argc, char* argv[]) {
         j[Params::param_name[i]] = Params::param_value[i];
     }
 
-    Global::Rpt.append(j);
+    if (Global::Event_Report_Line_List) {
+        Global::Rpt.append(j);
+    }
 
     time_t simulation_start_time;
     Utils::phil_start_timer(&simulation_start_time);
@@ -351,6 +373,10 @@ int main(int argc, char* argv[]) {
 
     fflush(Global::Infectionfp);
 
+    if (Global::Aggregate_Event_Report) {
+        Global::Rpt.print_counts();
+    }
+
     Utils::phil_print_lap_time(&simulation_start_time,
                                "\nPHIL simulation complete. Excluding initialization, %d days",
                                Global::Days);
@@ -361,9 +387,4 @@ int main(int argc, char* argv[]) {
     // finish up
     Global::Pop.end_of_run();
     Global::Places.end_of_run();
-
-    // close all open output files with global file pointers
-    Utils::phil_end();
-
-    return 0;
 }
@@ -7,6 +7,17 @@
 
 int main(int argc, char* argv[]);
 
+/**
+ * Simulates the epidemic in the initialized population, from setting up the prior immunity
+ * to the end of the run.  Called once by main, or by a worker once for every request it
+ * receives (see Worker.h).
+ *
+ * @param run the run number
+ * @param new_seed the seed of the run
+ * @param directory the output directory
+ */
+void phil_simulate(int run, unsigned long new_seed, char * directory);
+
 #define _PHIL_H
 
 #endif // _PHIL_H
@@ -689,6 +689,27 @@ void Place_List::update(int day) {
     PHIL_STATUS(1, "update places finished\n", "");
 }
 
+void Place_List::read_contact_parameters() {
+    Household::reset_parameters();
+    Neighborhood::reset_parameters();
+    School::reset_parameters();
+    Classroom::reset_parameters();
+    Workplace::reset_parameters();
+    Office::reset_parameters();
+    Hospital::reset_parameters();
+
+    // the parameters of a place type are shared by all of its places, so they are read by
+    // its first place; schools and workplaces are read before their classrooms and offices,
+    // whose contacts can be given relative to those of their container
+    std::set< char > place_types;
+    int number_places = places.size();
+    for (int p = 0; p < number_places; p++) {
+        if (place_types.insert(places[p]->get_type()).second) {
+            places[p]->get_parameters(Global::Diseases);
+        }
+    }
+}
+
 Place * Place_List::get_place_from_label(char *s) const {
     if (strcmp(s, "-1") == 0) return NULL;
     string str;
@@ -61,6 +61,8 @@ class Place_List {
     void update(int day);
     void quality_control(char * directory);
     void get_parameters();
+    // reads the contact parameters of all place types again, e.g. after they were changed with Params::set_param
+    void read_contact_parameters();
     Place * get_place_from_label(char *s) const;
     Place * get_place_at_position(int i) {
         return places[i];
@@ -7,6 +7,16 @@
 #include "Global.h"
 #include "Params.h"
 #include "Utils.h"
+#include "Compression.h"
+#include "Date.h"
+#include "Population.h"
+#include "Person.h"
+
+#include <chrono>
+
+static double seconds_since(std::chrono::steady_clock::time_point start) {
+    return std::chrono::duration< double >(std::chrono::steady_clock::now() - start).count();
+}
 
 void Report::setup() {
 
@@ -21,12 +31,214 @@ void Report::setup() {
     dim = dim <= phil::omp_get_max_threads() ? dim : phil::omp_get_max_threads();
     // Initialize specified number of states
     report_state = State< Report_State >(dim);
+
+    if (Global::Aggregate_Event_Report) {
+        setup_counts();
+    }
+
+    writer_queued_records = 0;
+    writer_done = false;
+    writer_seconds = 0;
+    writer_wait_seconds = 0;
+    if (Global::Report_Writer_Thread) {
+        writer = std::thread(&Report::write_in_background, this);
+    }
+}
+
+void Report::setup_counts() {
+    age_group_bounds.clear();
+    Params::get_param_vector((char *) "aggregate_event_report_age_groups", age_group_bounds);
+    if (age_group_bounds.empty()) {
+        // one group per year of age
+        for (int age = 0; age <= Global::MAX_AGE + 1; ++age) {
+            age_group_bounds.push_back(age);
+        }
+    }
+    if (age_group_bounds.size() < 2) {
+        Utils::phil_abort("aggregate_event_report_age_groups needs at least two boundaries\n");
+    }
+    for (size_t i = 1; i < age_group_bounds.size(); ++i) {
+        if (age_group_bounds[i] <= age_group_bounds[i - 1] || age_group_bounds[i - 1] < 0) {
+            Utils::phil_abort("aggregate_event_report_age_groups must be increasing and non-negative\n");
+        }
+    }
+
+    age_groups.assign(age_group_bounds.back(), -1);
+    for (size_t group = 0; group + 1 < age_group_bounds.size(); ++group) {
+        for (int age = age_group_bounds[group]; age < age_group_bounds[group + 1]; ++age) {
+            age_groups[age] = group;
+        }
+    }
+
+    report_counts = State< Report_Counts >(report_state.size());
+    for (int i = 0; i < report_counts.size(); ++i) {
+        report_counts(i).setup(age_group_bounds.size() - 1, Global::Days);
+    }
+}
+
+void Report::add_counts_to(Report_Counts & total) {
+    total.setup(age_group_bounds.size() - 1, Global::Days);
+    for (int i = 0; i < report_counts.size(); ++i) {
+        report_counts(i).add_to(total);
+    }
+}
+
+void Report::print_counts() {
+    Report_Counts total;
+    add_counts_to(total);
+
+    char filename[PHIL_STRING_SIZE];
+    sprintf(filename, "%s.age_counts.csv", Global::EventReportBase);
+    FILE * fp = fopen(filename, "w");
+    if (fp == NULL) {
+        Utils::phil_abort("Can't open %s\n", filename);
+    }
+    fprintf(fp, "age_from,age_to,vaccinated,infected,symptomatic\n");
+    for (size_t group = 0; group + 1 < age_group_bounds.size(); ++group) {
+        fprintf(fp, "%d,%d,%lld,%lld,%lld\n", age_group_bounds[group], age_group_bounds[group + 1],
+                (long long) total.vaccinated_by_age_group[group], (long long) total.infected_by_age_group[group],
+                (long long) total.symptomatic_by_age_group[group]);
+    }
+    fclose(fp);
+
+    sprintf(filename, "%s.day_counts.csv", Global::EventReportBase);
+    fp = fopen(filename, "w");
+    if (fp == NULL) {
+        Utils::phil_abort("Can't open %s\n", filename);
+    }
+    fprintf(fp, "day,date,new_infections,total_infected\n");
+    int64_t total_infected = 0;
+    for (int day = 0; day < Global::Days; ++day) {
+        total_infected += total.infected_changes_by_day[day];
+        fprintf(fp, "%d,%s,%lld,%lld\n", day, Global::Sim_Start_Date->get_YYYYMMDD(day).c_str(),
+                (long long) total.new_infections_by_day[day], (long long) total_infected);
+    }
+    fclose(fp);
+}
+
+json Report::get_age_counts() {
+    Report_Counts total;
+    add_counts_to(total);
+
+    std::vector< int64_t > population(age_group_bounds.size() - 1, 0);
+    int pop_size = Global::Pop.get_pop_size();
+    for (int p = 0; p < pop_size; ++p) {
+        int group = get_age_group(Global::Pop.get_person_by_index(p)->get_init_age());
+        if (group >= 0) {
+            population[group]++;
+        }
+    }
+
+    json counts = json::array();
+    for (size_t group = 0; group + 1 < age_group_bounds.size(); ++group) {
+        counts.push_back({
+            {"age_from", age_group_bounds[group]},
+            {"age_to", age_group_bounds[group + 1]},
+            {"population", population[group]},
+            {"vaccinated", total.vaccinated_by_age_group[group]},
+            {"infected", total.infected_by_age_group[group]},
+            {"symptomatic", total.symptomatic_by_age_group[group]}
+        });
+    }
+    return counts;
 }
 
 void Report::print() {
+    if (writer.joinable()) {
+        std::chrono::steady_clock::time_point start = std::chrono::steady_clock::now();
+        std::unique_lock< std::mutex > lock(writer_mutex);
+        for (int i = 0; i < report_state.size(); ++i) {
+            writer_queued_records += report_state(i).size();
+            writer_queue.push_back(Report_State());
+            writer_queue.back().swap(report_state(i));
+        }
+        writer_condition.notify_all();
+        // backpressure: wait for the writer to catch up
+        while (writer_queued_records > (size_t) Global::Report_Writer_Max_Queued_Records) {
+            writer_condition.wait(lock);
+        }
+        writer_wait_seconds += seconds_since(start);
+        // recovered: time spent writing that the simulation did not have to wait for
+        fprintf(Global::Statusfp,
+                "report writer took %.3f seconds, simulation waited %.3f seconds, recovered %.3f seconds\n",
+                writer_seconds, writer_wait_seconds, writer_seconds - writer_wait_seconds);
+        fflush(Global::Statusfp);
+        return;
+    }
+    std::string * buffer = Global::Compress_Event_Report ? &compression_buffer : NULL;
     for (int i = 0; i < report_state.size(); ++i) {
-        report_state(i).print();
+        report_state(i).print(buffer);
+    }
+    if (Global::Compress_Event_Report) {
+        write_compressed_blocks(SnappyFileCompression::get_default_block_size());
+    }
+}
+
+void Report::write_in_background() {
+    std::unique_lock< std::mutex > lock(writer_mutex);
+    while (true) {
+        while (writer_queue.empty() && !writer_done) {
+            writer_condition.wait(lock);
+        }
+        if (writer_queue.empty()) {
+            return;
+        }
+        Report_State batch;
+        batch.swap(writer_queue.front());
+        writer_queue.pop_front();
+        lock.unlock();
+
+        std::chrono::steady_clock::time_point start = std::chrono::steady_clock::now();
+        size_t records = batch.size();
+        batch.print(Global::Compress_Event_Report ? &compression_buffer : NULL);
+        if (Global::Compress_Event_Report) {
+            write_compressed_blocks(SnappyFileCompression::get_default_block_size());
+        }
+        double seconds = seconds_since(start);
+
+        lock.lock();
+        writer_queued_records -= records;
+        writer_seconds += seconds;
+        writer_condition.notify_all();
+    }
+}
+
+void Report::stop_writer() {
+    if (writer.joinable()) {
+        {
+            std::lock_guard< std::mutex > lock(writer_mutex);
+            writer_done = true;
+        }
+        writer_condition.notify_all();
+        writer.join();
+    }
+}
+
+void Report::flush() {
+    // the writer thread writes everything still queued before it stops
+    stop_writer();
+    // compress whatever is left over into the final block
+    if (Global::Compress_Event_Report) {
+        write_compressed_blocks(1);
+    }
+}
+
+void Report::write_compressed_blocks(size_t block_size) {
+    // Blocks are only written once block_size bytes are buffered, and always
+    // end on a newline, like the blocks written by fsz -c, so that they can be
+    // uncompressed and parsed in parallel
+    size_t begin = 0;
+    while (compression_buffer.size() - begin >= block_size) {
+        size_t end = compression_buffer.rfind('\n', begin + SnappyFileCompression::get_default_block_size() - 1);
+        if (end == std::string::npos || end < begin) {
+            // a single record longer than a block
+            end = compression_buffer.find('\n', begin);
+        }
+        SnappyFileCompression::write_compressed_block(Global::Reportfp,
+                compression_buffer.data() + begin, end - begin + 1);
+        begin = end + 1;
     }
+    compression_buffer.erase(0, begin);
 }
 
 void Report::clear() {
@@ -38,3 +250,27 @@ void Report::clear() {
 void Report::append(json & j) {
     report_state().append(j);
 }
+
+void Report::append(const Infection_Event_Record & r) {
+    report_state().append(r);
+}
+
+void Report::append(const Vaccination_Event_Record & r) {
+    report_state().append(r);
+}
+
+FILE * Report::open_binary_report(const char * filename, uint32_t record_size) {
+    FILE * fp = fopen(filename, "wb");
+    if (fp == NULL) {
+        Utils::phil_abort("Can't open %s\n", filename);
+    }
+    // records are flushed to disk in large sequential writes
+    setvbuf(fp, NULL, _IOFBF, 1 << 24);
+    Binary_Report_Header header;
+    memset(&header, 0, sizeof(header));
+    strcpy(header.magic, "PHILEVT");
+    header.version = 1;
+    header.record_size = record_size;
+    fwrite(&header, sizeof(header), 1, fp);
+    return fp;
+}
@@ -10,6 +10,11 @@
 #include <deque>
 #include <map>
 #include <iostream>
+#include <stdint.h>
+#include <string.h>
+#include <thread>
+#include <mutex>
+#include <condition_variable>
 
 #include "Random.h"
 #include "Global.h"
@@ -18,14 +23,60 @@
 
 using nlohmann::json;
 
+// Binary event report (event_report_format = binary)
+//
+// Each event type is written to its own file: a Binary_Report_Header followed by
+// back-to-back fixed-width records in host (little-endian) byte order.  The fields
+// and their order match the json records.  The records are laid out without any
+// padding so that they can be read directly with numpy.memmap; see
+// output_processing/event_reader.py.
+
+struct Binary_Report_Header {
+    char magic[8];          // "PHILEVT" and a terminating NUL
+    uint32_t version;
+    uint32_t record_size;
+};
+
+struct Infection_Event_Record {
+    int32_t person;
+    int32_t disease;
+    int32_t exposed;
+    int32_t infectious;
+    int32_t symptomatic;
+    int32_t recovered;
+    int32_t susceptible;
+    int32_t infector;
+    int32_t place;
+    int8_t place_type;
+    char place_label[31];   // truncated and NUL-padded, never NUL-terminated when 31 chars long
+
+    void set_place_label(const char * label) {
+        strncpy(place_label, label, sizeof(place_label));
+    }
+};
+
+struct Vaccination_Event_Record {
+    int32_t person;
+    int32_t vaccine;
+    int32_t vaccine_day;
+};
+
+static_assert(sizeof(Binary_Report_Header) == 16, "Binary_Report_Header must not be padded");
+static_assert(sizeof(Infection_Event_Record) == 68, "Infection_Event_Record must not be padded");
+static_assert(sizeof(Vaccination_Event_Record) == 12, "Vaccination_Event_Record must not be padded");
+
 struct Report_State {
 
     phil::Spin_Mutex mutex;
     std::vector< json > report_vector;
+    std::vector< Infection_Event_Record > infection_records;
+    std::vector< Vaccination_Event_Record > vaccination_records;
 
     void clear() {
         phil::Spin_Lock lock(mutex);
         report_vector.clear();
+        infection_records.clear();
+        vaccination_records.clear();
     }
 
     size_t report_vector_size() {
@@ -33,11 +84,36 @@ struct Report_State {
         return report_vector.size();
     }
 
+    // number of records of all kinds waiting to be printed
+    size_t size() {
+        phil::Spin_Lock lock(mutex);
+        return report_vector.size() + infection_records.size() + vaccination_records.size();
+    }
+
+    // exchanges the records of this state with those of other, e.g. to hand them
+    // over to the report writer thread without copying them
+    void swap(Report_State & other) {
+        phil::Spin_Lock lock(mutex);
+        report_vector.swap(other.report_vector);
+        infection_records.swap(other.infection_records);
+        vaccination_records.swap(other.vaccination_records);
+    }
+
     void append(json & j) {
         phil::Spin_Lock lock(mutex);
         report_vector.push_back(j);
     }
 
+    void append(const Infection_Event_Record & r) {
+        phil::Spin_Lock lock(mutex);
+        infection_records.push_back(r);
+    }
+
+    void append(const Vaccination_Event_Record & r) {
+        phil::Spin_Lock lock(mutex);
+        vaccination_records.push_back(r);
+    }
+
     std::vector< json > & get_report_vector() {
         phil::Spin_Lock lock(mutex);
         return report_vector;
@@ -48,15 +124,103 @@ struct Report_State {
         if (report_vector.size() > 0) {
             report_vector = std::vector< json >();
         }
+        if (infection_records.size() > 0) {
+            infection_records = std::vector< Infection_Event_Record >();
+        }
+        if (vaccination_records.size() > 0) {
+            vaccination_records = std::vector< Vaccination_Event_Record >();
+        }
     }
 
-    void print() {
+    // json records are appended to buffer if given, otherwise written to the report
+    void print(std::string * buffer = NULL) {
         phil::Spin_Lock lock(mutex);
         std::vector< json >::iterator itr;
         for (itr = report_vector.begin(); itr < report_vector.end(); ++itr) {
             //std::cout << *itr << std::endl;
-            fputs(itr->dump().c_str(), Global::Reportfp);
-            fputs("\n", Global::Reportfp);
+            if (buffer != NULL) {
+                buffer->append(itr->dump());
+                buffer->push_back('\n');
+            } else {
+                fputs(itr->dump().c_str(), Global::Reportfp);
+                fputs("\n", Global::Reportfp);
+            }
+        }
+        // each thread's records are written with a single fwrite
+        if (!infection_records.empty()) {
+            fwrite(&infection_records[0], sizeof(Infection_Event_Record),
+                   infection_records.size(), Global::InfectionReportfp);
+        }
+        if (!vaccination_records.empty()) {
+            fwrite(&vaccination_records[0], sizeof(Vaccination_Event_Record),
+                   vaccination_records.size(), Global::VaccinationReportfp);
+        }
+    }
+
+};
+
+// Online aggregation (aggregate_event_report = 1)
+//
+// Per-thread counts of infections and vaccinations by age group and by day.
+// Report::print_counts adds up the counts of all threads at the end of the run.
+
+struct Report_Counts {
+
+    phil::Spin_Mutex mutex;
+    std::vector< int64_t > vaccinated_by_age_group;
+    std::vector< int64_t > infected_by_age_group;
+    // infections that became symptomatic during the simulation
+    std::vector< int64_t > symptomatic_by_age_group;
+    std::vector< int64_t > new_infections_by_day;
+    // +1 on the day people become infectious and -1 on the day they recover,
+    // so that the running sum is the number of people infected on each day
+    std::vector< int64_t > infected_changes_by_day;
+
+    void setup(int age_groups, int days) {
+        vaccinated_by_age_group.assign(age_groups, 0);
+        infected_by_age_group.assign(age_groups, 0);
+        symptomatic_by_age_group.assign(age_groups, 0);
+        new_infections_by_day.assign(days, 0);
+        infected_changes_by_day.assign(days + 1, 0);
+    }
+
+    void count_infection(int age_group, int infectious_day, int symptomatic_day, int recovery_day) {
+        phil::Spin_Lock lock(mutex);
+        int days = new_infections_by_day.size();
+        if (age_group >= 0) {
+            infected_by_age_group[age_group]++;
+            if (symptomatic_day >= 0 && symptomatic_day < days) {
+                symptomatic_by_age_group[age_group]++;
+            }
+        }
+        if (infectious_day >= 0 && infectious_day < days) {
+            new_infections_by_day[infectious_day]++;
+            if (recovery_day > infectious_day) {
+                infected_changes_by_day[infectious_day]++;
+                infected_changes_by_day[recovery_day < days ? recovery_day : days]--;
+            }
+        }
+    }
+
+    void count_vaccination(int age_group) {
+        phil::Spin_Lock lock(mutex);
+        if (age_group >= 0) {
+            vaccinated_by_age_group[age_group]++;
+        }
+    }
+
+    void add_to(Report_Counts & total) {
+        phil::Spin_Lock lock(mutex);
+        for (size_t i = 0; i < infected_by_age_group.size(); ++i) {
+            total.vaccinated_by_age_group[i] += vaccinated_by_age_group[i];
+            total.infected_by_age_group[i] += infected_by_age_group[i];
+            total.symptomatic_by_age_group[i] += symptomatic_by_age_group[i];
+        }
+        for (size_t i = 0; i < new_infections_by_day.size(); ++i) {
+            total.new_infections_by_day[i] += new_infections_by_day[i];
+        }
+        for (size_t i = 0; i < infected_changes_by_day.size(); ++i) {
+            total.infected_changes_by_day[i] += infected_changes_by_day[i];
         }
     }
 
@@ -68,13 +232,66 @@ class Report {
 
     void setup();
     void print();
+    void flush();
     void clear();
     void append(json & j);
+    void append(const Infection_Event_Record & r);
+    void append(const Vaccination_Event_Record & r);
+
+    static FILE * open_binary_report(const char * filename, uint32_t record_size);
+
+    // ages are the ages people had at the start of the simulation (Person::get_init_age)
+    void count_infection(int age, int infectious_day, int symptomatic_day, int recovery_day) {
+        report_counts().count_infection(get_age_group(age), infectious_day, symptomatic_day, recovery_day);
+    }
+    void count_vaccination(int age) {
+        report_counts().count_vaccination(get_age_group(age));
+    }
+    void print_counts();
+    // the counts of print_counts by age group, with the number of people in each group
+    // at the start of the simulation, as a json array
+    json get_age_counts();
 
   protected:
 
     State< Report_State > report_state;
 
+    State< Report_Counts > report_counts;
+    // lower bound of each age group, followed by the upper bound of the last one
+    std::vector< int > age_group_bounds;
+    // age group of each age, or -1 if it is in none
+    std::vector< int > age_groups;
+
+    int get_age_group(int age) {
+        return age >= 0 && age < (int) age_groups.size() ? age_groups[age] : -1;
+    }
+
+    // json lines not yet compressed into a block of the event report (compress_event_report = 1)
+    std::string compression_buffer;
+
+    void write_compressed_blocks(size_t block_size);
+
+    // Background report writer (report_writer_thread = 1)
+    //
+    // Report::print hands each day's records over to the writer thread, which
+    // formats and writes them while the next day is simulated.  Report::print
+    // only blocks when more than Global::Report_Writer_Max_Queued_Records
+    // records are waiting to be written.
+    std::thread writer;
+    std::mutex writer_mutex;
+    std::condition_variable writer_condition;
+    std::deque< Report_State > writer_queue;
+    size_t writer_queued_records;
+    bool writer_done;
+    // seconds spent by the writer thread writing, and by the simulation waiting for it
+    double writer_seconds;
+    double writer_wait_seconds;
+
+    void setup_counts();
+    void add_counts_to(Report_Counts & total);
+    void write_in_background();
+    void stop_writer();
+
 };
 
 
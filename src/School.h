@@ -23,6 +23,10 @@ class School : public Place {
     School(const char*, double, double, Place *, Population *pop);
     void prepare();
     void get_parameters(int diseases);
+    // makes the next get_parameters read the parameters again, see Place_List::read_contact_parameters
+    static void reset_parameters() {
+        School::school_parameters_set = false;
+    }
     int get_group(int disease_id, Person * per);
     double get_transmission_prob(int disease_id, Person * i, Person * s);
     bool should_be_open(int day, int disease_id);
@@ -5,6 +5,8 @@
 
 #include "Utils.h"
 #include "Global.h"
+#include "Report.h"
+#include "Compression.h"
 #include <stdlib.h>
 #include <string.h>
 
@@ -116,10 +118,27 @@ void Utils::phil_open_output_files(char * directory, int run) {
         }
     }
 
+    // the other event report files are named after the event report, without its .json_lines(.fsz) extension
+    if (strcmp(Global::EventReportFile, "none") == 0) {
+        sprintf(Global::EventReportBase, "%s/report%d", directory, run);
+    } else {
+        strcpy(Global::EventReportBase, Global::EventReportFile);
+        const char * extensions[] = {".fsz", ".json_lines"};
+        for (int i = 0; i < 2; ++i) {
+            size_t base_length = strlen(Global::EventReportBase);
+            size_t extension_length = strlen(extensions[i]);
+            if (base_length > extension_length
+                    && strcmp(Global::EventReportBase + base_length - extension_length, extensions[i]) == 0) {
+                Global::EventReportBase[base_length - extension_length] = '\0';
+            }
+        }
+    }
+
     Global::Reportfp = NULL;
-    if (1) {
+    if (Global::Event_Report_Line_List) {
         if (strcmp(Global::EventReportFile, "none") == 0) {
-            sprintf(filename, "%s/report%d.json_lines", directory, run);
+            sprintf(filename, "%s/report%d.json_lines%s", directory, run,
+                    Global::Compress_Event_Report ? ".fsz" : "");
             Global::Reportfp = fopen(filename, "w");
             if (Global::Reportfp == NULL) {
                 Utils::phil_abort("Can't open %s\n", filename);
@@ -130,6 +149,24 @@ void Utils::phil_open_output_files(char * directory, int run) {
                 Utils::phil_abort("Can't open %s\n", Global::EventReportFile);
             }
         }
+        if (Global::Compress_Event_Report) {
+            SnappyFileCompression::write_magic_bytes(Global::Reportfp);
+        }
+    }
+
+    Global::InfectionReportfp = NULL;
+    Global::VaccinationReportfp = NULL;
+    if (Global::Event_Report_Line_List && Global::Binary_Event_Report) {
+        sprintf(filename, "%s.infection.bin", Global::EventReportBase);
+        Global::InfectionReportfp = Report::open_binary_report(filename, sizeof(Infection_Event_Record));
+        sprintf(filename, "%s.vaccination.bin", Global::EventReportBase);
+        Global::VaccinationReportfp = Report::open_binary_report(filename, sizeof(Vaccination_Event_Record));
+    } else if (Global::Event_Report_Line_List) {
+        // binary files left by an earlier binary run would be read as the events of this report
+        sprintf(filename, "%s.infection.bin", Global::EventReportBase);
+        remove(filename);
+        sprintf(filename, "%s.vaccination.bin", Global::EventReportBase);
+        remove(filename);
     }
 
 
@@ -214,7 +251,10 @@ void Utils::phil_end(void) {
     if (Global::Outfp != NULL) fclose(Global::Outfp);
     if (Global::Tracefp != NULL) fclose(Global::Tracefp);
     if (Global::Infectionfp != NULL) fclose(Global::Infectionfp);
+    Global::Rpt.flush();
     if (Global::Reportfp != NULL) fclose(Global::Reportfp);
+    if (Global::InfectionReportfp != NULL) fclose(Global::InfectionReportfp);
+    if (Global::VaccinationReportfp != NULL) fclose(Global::VaccinationReportfp);
     if (Global::VaccineTracefp != NULL) fclose(Global::VaccineTracefp);
     if (Global::Prevfp != NULL) fclose(Global::Prevfp);
     if (Global::Incfp != NULL) fclose(Global::Incfp);
@@ -0,0 +1,375 @@
+//
+//
+// File: Worker.cc
+//
+
+#include "Worker.h"
+#include "Phil.h"
+#include "Global.h"
+#include "Params.h"
+#include "Population.h"
+#include "Place_List.h"
+#include "Disease.h"
+#include "Random.h"
+#include "Report.h"
+#include "Utils.h"
+#include "Date.h"
+
+#include <errno.h>
+#include <poll.h>
+#include <signal.h>
+#include <stdio.h>
+#include <string.h>
+#include <unistd.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <sys/wait.h>
+
+int Worker::threads = 1;
+
+// the parameters a request can override; every other parameter was used to set up the population
+static const char * override_params[] = {
+    "trans", "R0", "R0_a", "R0_b", "weekend_contact_rate",
+    "household_contacts", "household_prob", "neighborhood_contacts", "neighborhood_prob",
+    "school_contacts", "school_prob", "classroom_contacts", "classroom_prob",
+    "workplace_contacts", "workplace_prob", "office_contacts", "office_prob",
+    "hospital_contacts", "hospital_prob"
+};
+
+static bool write_all(int fd, const std::string & s) {
+    size_t written = 0;
+    while (written < s.size()) {
+        ssize_t n = write(fd, s.data() + written, s.size() - written);
+        if (n < 0 && errno == EINTR) {
+            continue;
+        }
+        if (n <= 0) {
+            return false;
+        }
+        written += n;
+    }
+    return true;
+}
+
+void Worker::setup() {
+    // GNU OpenMP can not start threads in a process forked from one that already has
+    // its threads, so the population is set up by a single thread and each simulation
+    // starts its own threads
+#ifdef _OPENMP
+    Worker::threads = phil::omp_get_max_threads();
+    phil::omp_set_num_threads(1);
+#endif
+    // the answers are made of the aggregate counts
+    Global::Aggregate_Event_Report = true;
+}
+
+void Worker::serve(int run, char * directory) {
+    struct sockaddr_un address;
+    memset(&address, 0, sizeof(address));
+    address.sun_family = AF_UNIX;
+    if (strlen(Global::Worker_socket) >= sizeof(address.sun_path)) {
+        Utils::phil_abort("worker_socket %s is too long\n", Global::Worker_socket);
+    }
+    strcpy(address.sun_path, Global::Worker_socket);
+
+    int server = socket(AF_UNIX, SOCK_STREAM, 0);
+    if (server < 0) {
+        Utils::phil_abort("Can't create worker_socket %s: %s\n", Global::Worker_socket, strerror(errno));
+    }
+    unlink(Global::Worker_socket);
+    if (bind(server, (struct sockaddr *) &address, sizeof(address)) != 0 || listen(server, 1) != 0) {
+        Utils::phil_abort("Can't listen on worker_socket %s: %s\n", Global::Worker_socket, strerror(errno));
+    }
+    // a client that goes away while it is answered must not kill the worker
+    signal(SIGPIPE, SIG_IGN);
+
+    Utils::phil_print_wall_time("PHIL worker listening on %s", Global::Worker_socket);
+
+    bool stop = false;
+    while (!stop) {
+        int connection = accept(server, NULL, NULL);
+        if (connection < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            Utils::phil_abort("Can't accept on worker_socket %s: %s\n", Global::Worker_socket, strerror(errno));
+        }
+        FILE * requests = fdopen(connection, "r");
+        char * line = NULL;
+        size_t size = 0;
+        while (!stop && getline(&line, &size, requests) != -1) {
+            json response = answer(line, run, directory, stop);
+            if (!write_all(connection, response.dump() + "\n")) {
+                break;
+            }
+        }
+        free(line);
+        fclose(requests);
+    }
+
+    close(server);
+    unlink(Global::Worker_socket);
+    Utils::phil_print_wall_time("PHIL worker stopped");
+}
+
+// a simulation running in a process forked from the worker
+struct Worker_Simulation {
+    size_t index;
+    pid_t pid;
+    // the read end of the pipe the simulation writes its answer to
+    int fd;
+    std::string output;
+};
+
+json Worker::answer(const std::string & line, int run, char * directory, bool & stop) {
+    json request;
+    try {
+        request = json::parse(line);
+    } catch (std::exception & e) {
+        return error(std::string("bad request: ") + e.what());
+    }
+    if (!request.is_object()) {
+        return error("bad request: not an object");
+    }
+    if (request.value("stop", false)) {
+        stop = true;
+        return json({{"status", "stopped"}});
+    }
+    std::string message = check_request(request);
+    if (!message.empty()) {
+        return error(message);
+    }
+
+    std::vector< unsigned long > seeds;
+    std::vector< int > runs;
+    if (!request.count("seeds")) {
+        seeds.push_back(request.value("seed", (unsigned long) Global::Seed));
+        runs.push_back(run);
+        return run_simulations(request, seeds, runs, directory)[0];
+    }
+    for (size_t i = 0; i < request["seeds"].size(); ++i) {
+        seeds.push_back(request["seeds"][i]);
+        runs.push_back(i + 1);
+    }
+    std::vector< json > realizations = run_simulations(request, seeds, runs, directory);
+    int failed = 0;
+    for (size_t i = 0; i < realizations.size(); ++i) {
+        failed += realizations[i]["status"] != "ok";
+    }
+    json result = {{"status", failed ? "error" : "ok"}, {"realizations", realizations}};
+    if (failed) {
+        char s[PHIL_STRING_SIZE];
+        sprintf(s, "%d of %d realizations failed", failed, (int) realizations.size());
+        result["message"] = s;
+    }
+    return result;
+}
+
+std::string Worker::check_request(json & request) {
+    if (request.count("seed") && !(request["seed"].is_number_integer() && request["seed"] >= 0)) {
+        return "seed must be a positive integer";
+    }
+    if (request.count("seeds")) {
+        if (request.count("seed")) {
+            return "only one of seed and seeds can be given";
+        }
+        if (!request["seeds"].is_array() || request["seeds"].empty()) {
+            return "seeds must be a list of positive integers";
+        }
+        for (size_t i = 0; i < request["seeds"].size(); ++i) {
+            if (!(request["seeds"][i].is_number_integer() && request["seeds"][i] >= 0)) {
+                return "seeds must be a list of positive integers";
+            }
+        }
+        if (!request.count("outdir")) {
+            // the realizations would all write to the output files of the worker at once
+            return "seeds need an outdir to write their runs to";
+        }
+    }
+    if (request.count("outdir") && !request["outdir"].is_string()) {
+        return "outdir must be a string";
+    }
+    // the output files are named in PHIL_STRING_SIZE buffers, after the outdir
+    if (request.count("outdir")
+            && request["outdir"].get< std::string >().size() >= PHIL_STRING_SIZE - 64) {
+        return "outdir is too long";
+    }
+    if (!request.count("params")) {
+        return "";
+    }
+    if (!request["params"].is_object()) {
+        return "params must be an object";
+    }
+    for (json::iterator p = request["params"].begin(); p != request["params"].end(); ++p) {
+        // indexed parameters, e.g. trans[0], are overridden by index
+        // does_param_exist copies the name to a buffer of 80 characters
+        if (p.key().size() >= 80) {
+            return p.key().substr(0, 32) + "... is too long to be a parameter";
+        }
+        std::string name = p.key().substr(0, p.key().find('['));
+        bool allowed = false;
+        for (size_t i = 0; i < sizeof(override_params) / sizeof(override_params[0]); ++i) {
+            allowed = allowed || name == override_params[i];
+        }
+        if (!allowed) {
+            return p.key() + " can not be overridden by a request";
+        }
+        if (!Params::does_param_exist(p.key())) {
+            return p.key() + " is not a parameter";
+        }
+        if (!p.value().is_string() && !p.value().is_number()) {
+            return p.key() + " must be a string or a number";
+        }
+        std::string value = p.value().is_string() ? p.value().get< std::string >() : p.value().dump();
+        if (value.size() >= MAX_PARAM_SIZE) {
+            return p.key() + " is too long";
+        }
+    }
+    return "";
+}
+
+std::vector< json > Worker::run_simulations(json & request, const std::vector< unsigned long > & seeds,
+        const std::vector< int > & runs, char * directory) {
+    size_t processes = Global::Worker_processes < 1 ? 1 : Global::Worker_processes;
+    processes = processes < seeds.size() ? processes : seeds.size();
+    int simulation_threads = Worker::threads / (int) processes;
+    simulation_threads = simulation_threads < 1 ? 1 : simulation_threads;
+
+    std::vector< json > results(seeds.size());
+    std::vector< Worker_Simulation > running;
+    size_t next = 0;
+    while (next < seeds.size() || !running.empty()) {
+        while (next < seeds.size() && running.size() < processes) {
+            // nothing buffered before the fork may be written twice
+            fflush(NULL);
+            int fds[2];
+            if (pipe(fds) != 0) {
+                results[next++] = error(std::string("can't create pipe: ") + strerror(errno));
+                continue;
+            }
+            pid_t pid = fork();
+            if (pid < 0) {
+                close(fds[0]);
+                close(fds[1]);
+                results[next++] = error(std::string("can't fork: ") + strerror(errno));
+                continue;
+            }
+            if (pid == 0) {
+                close(fds[0]);
+                json result = simulate(request, seeds[next], runs[next], simulation_threads, directory);
+                Utils::phil_end();
+                fflush(NULL);
+                _exit(write_all(fds[1], result.dump()) ? 0 : 1);
+            }
+            close(fds[1]);
+            Worker_Simulation simulation;
+            simulation.index = next++;
+            simulation.pid = pid;
+            simulation.fd = fds[0];
+            running.push_back(simulation);
+        }
+
+        // read the answers of the running simulations, which are done once they close their pipe
+        std::vector< struct pollfd > fds(running.size());
+        for (size_t i = 0; i < running.size(); ++i) {
+            fds[i].fd = running[i].fd;
+            fds[i].events = POLLIN;
+            fds[i].revents = 0;
+        }
+        if (poll(&fds[0], fds.size(), -1) < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            Utils::phil_abort("PHIL worker can't poll its simulations: %s\n", strerror(errno));
+        }
+        for (size_t i = running.size(); i-- > 0;) {
+            if (fds[i].revents == 0) {
+                continue;
+            }
+            char buffer[1 << 16];
+            ssize_t n = read(running[i].fd, buffer, sizeof(buffer));
+            if (n > 0) {
+                running[i].output.append(buffer, n);
+                continue;
+            }
+            if (n < 0 && errno == EINTR) {
+                continue;
+            }
+            close(running[i].fd);
+
+            int status;
+            while (waitpid(running[i].pid, &status, 0) < 0 && errno == EINTR);
+            json & result = results[running[i].index];
+            char s[PHIL_STRING_SIZE];
+            if (WIFSIGNALED(status)) {
+                sprintf(s, "simulation killed by signal %d, see the errors file", WTERMSIG(status));
+                result = error(s);
+            } else if (WEXITSTATUS(status) != 0 || running[i].output.empty()) {
+                sprintf(s, "simulation exited with status %d", WEXITSTATUS(status));
+                result = error(s);
+            } else {
+                try {
+                    result = json::parse(running[i].output);
+                } catch (std::exception & e) {
+                    result = error(std::string("bad answer from simulation: ") + e.what());
+                }
+            }
+            running.erase(running.begin() + i);
+        }
+    }
+    return results;
+}
+
+json Worker::simulate(json & request, unsigned long seed, int run, int simulation_threads, char * directory) {
+#ifdef _OPENMP
+    phil::omp_set_num_threads(simulation_threads);
+#endif
+
+    if (request.count("outdir")) {
+        // the output files opened for the worker are replaced by ones in outdir
+        Utils::phil_end();
+        strcpy(directory, request["outdir"].get< std::string >().c_str());
+        strcpy(Global::Output_directory, directory);
+        Utils::phil_make_directory(directory);
+        Utils::phil_open_output_files(directory, run);
+    }
+
+    if (Global::Rotate_start_date) {
+        // the start date was rotated for the run of the worker
+        Global::Sim_Start_Date = new Date(std::string(Global::Start_date));
+        Global::Sim_Current_Date = new Date(std::string(Global::Start_date));
+        Global::Sim_Start_Date->advance((run-1)%7);
+        Global::Sim_Current_Date->advance((run-1)%7);
+    }
+
+    if (request.count("params")) {
+        for (json::iterator p = request["params"].begin(); p != request["params"].end(); ++p) {
+            std::string value = p.value().is_string() ? p.value().get< std::string >() : p.value().dump();
+            Params::set_param(p.key().c_str(), value.c_str());
+        }
+        Global::Places.read_contact_parameters();
+        for (int d = 0; d < Global::Diseases; ++d) {
+            Global::Pop.get_disease(d)->read_transmissibility();
+        }
+    }
+
+    Global::Seed = seed;
+    fprintf(Global::Statusfp, "seed = %lu\n", seed);
+    INIT_RANDOM(seed);
+
+    phil_simulate(run, seed, directory);
+
+    return json({
+        {"status", "ok"},
+        {"seed", seed},
+        {"run", run},
+        {"days", Global::Days},
+        {"age_groups", Global::Rpt.get_age_counts()}
+    });
+}
+
+json Worker::error(const std::string & message) {
+    fprintf(Global::Statusfp, "PHIL worker: %s\n", message.c_str());
+    fflush(Global::Statusfp);
+    return json({{"status", "error"}, {"message", message}});
+}
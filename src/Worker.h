@@ -0,0 +1,89 @@
+//
+//
+// File: Worker.h
+//
+
+#ifndef _PHIL_WORKER_H
+#define _PHIL_WORKER_H
+
+#include <string>
+#include <vector>
+
+#include "json.h"
+
+using nlohmann::json;
+
+// Worker mode (worker_socket = <path>)
+//
+// Instead of simulating once, phil reads the population once and then listens on
+// the unix socket worker_socket.  Every line received on it is a request to run one
+// simulation of that population, e.g. for one objective evaluation of a calibration:
+//
+//   {"seed": 42, "params": {"trans[0]": 1.2, "household_prob[0]": "25 0.6 ... 0.3"}}
+//
+// params overrides the transmission and contact parameters of the param files
+// (trans, R0, *_contacts, *_prob and weekend_contact_rate) for this simulation only,
+// seed defaults to the seed param and outdir, if given, is a directory to write the
+// outputs of this simulation to instead of the worker's output directory.
+//
+// Each request is answered with one line:
+//
+//   {"status": "ok", "seed": 42, "days": 240,
+//    "age_groups": [{"age_from": 0, "age_to": 5, "population": 3021, "vaccinated": 0,
+//                    "infected": 612, "symptomatic": 410}, ...]}
+//
+// where the age groups are those of aggregate_event_report_age_groups, or with
+// {"status": "error", "message": "..."} if the request could not be run.
+//
+// A request with a list of seeds instead of a seed runs one realization for each of
+// them, as runs 1, 2, ... of outdir, which it requires, and up to worker_processes of
+// them at once, which share the OpenMP threads of the worker.  It is answered once all
+// of them are done:
+//
+//   {"status": "ok", "realizations": [{"status": "ok", "seed": 1, "run": 1, ...}, ...]}
+//
+// The status is "error" if any of the realizations failed.  The request
+// {"stop": true} stops the worker.  A client can send any number of requests over one
+// connection, one at a time; python drivers can use wrk/univax/phil_worker.py.
+//
+// Every simulation runs in a process forked from the worker once the population is
+// set up, so that it starts from the same state, and nothing it changes outlives it:
+// the worker is a snapshot of the initialized population, which the copy-on-write
+// pages of fork() make available to a simulation without copying it.
+// The setup of the population happens before the seed of a request is known, so it
+// only depends on the seed param, and a simulation differs from a phil run with the
+// same seed.
+
+class Worker {
+
+  public:
+
+    /**
+     * Prepare the process to be forked for every simulation; called before the
+     * population is set up
+     */
+    static void setup();
+
+    /**
+     * Answer requests on worker_socket until a stop request is received
+     *
+     * @param run the run number
+     * @param directory the output directory
+     */
+    static void serve(int run, char * directory);
+
+  private:
+
+    // number of OpenMP threads of the simulations
+    static int threads;
+
+    static json answer(const std::string & line, int run, char * directory, bool & stop);
+    static std::string check_request(json & request);
+    static std::vector< json > run_simulations(json & request, const std::vector< unsigned long > & seeds,
+            const std::vector< int > & runs, char * directory);
+    static json simulate(json & request, unsigned long seed, int run, int simulation_threads, char * directory);
+    static json error(const std::string & message);
+
+};
+
+#endif // _PHIL_WORKER_H
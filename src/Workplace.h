@@ -38,6 +38,15 @@ class Workplace: public Place {
      */
     void get_parameters(int diseases);
 
+    /**
+     * Makes the next call of get_parameters read the parameters again
+     *
+     * @see Place_List::read_contact_parameters()
+     */
+    static void reset_parameters() {
+        Workplace::Workplace_parameters_set = false;
+    }
+
     /**
      * Initialize the workplace and its offices
      */
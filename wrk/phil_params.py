@@ -0,0 +1,133 @@
+# coding: utf-8
+
+"""
+Params files parsed once into PhilParams: the params of a file layered over those of the
+file it includes, if any, as phil reads them (see Params::read_parameters).  Overrides
+are layers of their own, and a PhilParams is written as an include of the nearest file
+it is based on followed by its overrides only, so that the params file of every run of
+a sweep holds the delta of the run, and sweep generates those deltas lazily.
+"""
+
+import os
+import re
+import itertools
+
+from collections import OrderedDict
+
+
+def parse_params_file(filename):
+    """Returns the file included by a params file, if any, and its params in order"""
+    include = None
+    params = OrderedDict()
+    with open(filename, 'r') as f:
+        for l in f:
+            l = l.split('#', 1)[0].strip()
+            m = re.search(r'^(\S+)\s*=\s*(.+)$', l)
+            if m is None:
+                continue
+            if m.group(1) == 'include':
+                # read as the base of the whole file, as phil does when it comes first
+                include = m.group(2)
+            else:
+                # phil uses the last value of each param
+                params.pop(m.group(1), None)
+                params[m.group(1)] = m.group(2)
+    return include, params
+
+
+class PhilParams(object):
+    """
+    The params of a params file, or overrides of the params of base.  PhilParams are
+    not changed once made: override returns new params.
+    """
+
+    _cache = {}
+
+    def __init__(self, params=None, base=None, filename=None):
+        self.params = OrderedDict(params or {})
+        self.base = base
+        self.filename = filename
+
+    @classmethod
+    def read(cls, filename):
+        """The params of filename, parsed once for as long as the file does not change"""
+        filename = os.path.abspath(filename)
+        mtime = os.path.getmtime(filename)
+        cached = cls._cache.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        include, params = parse_params_file(filename)
+        base = None
+        if include is not None:
+            base = cls.read(os.path.join(os.path.dirname(filename),
+                os.path.expandvars(include)))
+        p = cls(params, base, filename)
+        cls._cache[filename] = (mtime, p)
+        return p
+
+    def override(self, params):
+        return PhilParams(params, base=self)
+
+    def __getitem__(self, name):
+        p = self
+        while p is not None:
+            if name in p.params:
+                return p.params[name]
+            p = p.base
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        try:
+            self[name]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def layers(self):
+        """The params of every layer, the first one's overridden by the next ones"""
+        layers = []
+        p = self
+        while p is not None:
+            layers.insert(0, p)
+            p = p.base
+        return layers
+
+    def to_dict(self):
+        d = OrderedDict()
+        for layer in self.layers():
+            d.update(layer.params)
+        return d
+
+    def write(self, filename):
+        """
+        Writes an include of the params file these params are based on, followed by the
+        params that override it
+        """
+        layers = self.layers()
+        overrides = OrderedDict()
+        with open(filename, 'w') as f:
+            for i in reversed(range(len(layers))):
+                if layers[i].filename is not None:
+                    f.write('include = %s\n' % layers[i].filename)
+                    layers = layers[i+1:]
+                    break
+            for layer in layers:
+                overrides.update(layer.params)
+            for param, value in overrides.items():
+                f.write('%s = %s\n' % (param, str(value)))
+
+
+def sweep(grid):
+    """
+    Yields the params of every point of a grid, given as the values of each param, one
+    point at a time, so that a grid of millions of points is never held in memory
+    """
+    names = list(grid.keys())
+    for values in itertools.product(*[grid[name] for name in names]):
+        yield OrderedDict(zip(names, values))
@@ -0,0 +1,465 @@
+# coding: utf-8
+
+"""
+Runs batches of PHIL runs, each in its own directory, with asyncio: PhilRunner submits
+up to max_active runs at a time to a backend, waits for them to finish without blocking
+the others and retries the runs that failed, after a backoff that doubles each time.
+
+The backends are PBSBackend, which submits every run as a qsub job rendered from
+qsub.tpl and learns that the job is done when the job removes its lockfile, and
+LocalBackend, which runs phil and poe.py in a pool of local processes, so that a sweep
+can be run on a single workstation.  A backend is any object with a coroutine
+execute(run) that raises PhilRunError if the run failed, and a method slot() that
+returns an async context manager to hold while a run executes, which waits for the
+backend to have room for the run: the timeout of a run starts once it has its slot.
+
+Needs python 3.8 or later, whose child watcher reaps the subprocesses of event loops
+in any thread: run_batch runs its loop in a thread of its own, e.g. for the threaded
+islands of a PyGMO archipelago or a notebook cell, which already runs in a loop.
+"""
+
+import os
+import errno
+import random
+import shutil
+import signal
+import struct
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import mkdtemp
+
+from phil_params import PhilParams
+
+
+class log(object):
+    @staticmethod
+    def info(s):
+        print(s)
+    @staticmethod
+    def warn(s):
+        print(s)
+    @staticmethod
+    def error(s):
+        print(s)
+
+
+class PhilRunError(Exception):
+    pass
+
+
+class PhilRun(object):
+    """
+    One run of phil with the given params, a PhilParams or a dict, in a new directory of
+    container, followed by poe.py on its event report.  files are the files the params
+    refer to by relative paths, which are copied to the directory of the run.  Each
+    attempt of the run is prepared in a directory of its own, with a new seed unless seed
+    is given.
+    """
+
+    def __init__(self, container, params, files=(), name=None, seed=None,
+            synthetic_population=None, poe_format='csv'):
+        self.container = container
+        self.params = params
+        self.seed = seed
+        self.files = list(files)
+        self.name = name
+        self.synthetic_population = synthetic_population
+        self.poe_format = poe_format
+        self.tempdir = None
+
+    def prepare(self):
+        if not os.path.isdir(self.container):
+            try:
+                os.makedirs(self.container)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        self.tempdir = mkdtemp(prefix='phl-', dir=self.container)
+        self.paramfile = os.path.join(self.tempdir, 'params')
+        self.event_report_file = os.path.join(self.tempdir, 'events.json_lines')
+        self.poe_output_file = os.path.join(self.tempdir, 'poe_output')
+        self.lockfile = os.path.join(self.tempdir, 'lockfile')
+        self.statusfile = os.path.join(self.tempdir, 'statusfile')
+        self.stdout = os.path.join(self.tempdir, 'stdout')
+        self.stderr = os.path.join(self.tempdir, 'stderr')
+
+        params = self.params
+        if not isinstance(params, PhilParams):
+            params = PhilParams(params)
+        # only the params that differ from the base params file are written
+        params.override({
+            'outdir': self.tempdir,
+            'event_report_file': self.event_report_file,
+            'seed': self.seed if self.seed is not None else random.randint(1, 2147483647),
+        }).write(self.paramfile)
+        for filename in self.files:
+            shutil.copy(filename, self.tempdir)
+
+    @property
+    def result(self):
+        """The directory of the run and the file written by poe.py"""
+        return (self.tempdir, '%s.%s' % (self.poe_output_file, self.poe_format))
+
+    def read_status(self):
+        """Raises PhilRunError with the status the job wrote if it failed"""
+        try:
+            with open(self.statusfile, 'r') as f:
+                stat = f.read()
+        except IOError as e:
+            raise PhilRunError('%s: no status: %s' % (self.tempdir, e))
+        if len(stat) > 0:
+            raise PhilRunError(stat)
+
+
+class _Inotify(object):
+    """
+    Wakes the coroutines waiting on changes of the watched directories, by reading
+    inotify events on the event loop.  Changes made on other hosts of a network file
+    system are not seen, so the waiters still check the files now and then.
+    """
+
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_NONBLOCK = 0x00000800
+
+    def __init__(self, loop):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.loop = loop
+        self.waiters = {}
+        self.directories = {}
+        loop.add_reader(self.fd, self.read_events)
+
+    def watch(self, directory):
+        """Returns an asyncio.Event that is set on the next change in directory"""
+        if directory not in self.directories:
+            mask = (self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_TO |
+                    self.IN_CREATE | self.IN_DELETE)
+            wd = self.libc.inotify_add_watch(self.fd, directory.encode(), mask)
+            if wd < 0:
+                return None
+            self.directories[directory] = wd
+            self.waiters[wd] = asyncio.Event()
+        return self.waiters[self.directories[directory]]
+
+    def unwatch(self, directory):
+        wd = self.directories.pop(directory, None)
+        if wd is not None:
+            self.libc.inotify_rm_watch(self.fd, wd)
+            self.waiters.pop(wd).set()
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+        i = 0
+        while i + 16 <= len(data):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, i)
+            i += 16 + length
+            event = self.waiters.get(wd)
+            if event is not None:
+                event.set()
+
+    def close(self):
+        self.loop.remove_reader(self.fd)
+        os.close(self.fd)
+
+
+class FileWatcher(object):
+    """
+    Waits for files to be removed, woken by inotify where it is available and otherwise
+    after check intervals that double from min_interval up to max_interval.  If
+    poll_interval is given the files are also looked for that often between checks, for
+    file systems that inotify does not see the changes of other hosts on
+    """
+
+    def __init__(self, min_interval=1, max_interval=64, poll_interval=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.poll_interval = poll_interval
+        self.inotify = None
+
+    def start(self, loop):
+        try:
+            self.inotify = _Inotify(loop)
+        except (OSError, AttributeError) as e:
+            log.warn('not watching the run directories (%s), checking them instead' % e)
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    async def wait_removed(self, path, check=None):
+        """
+        Returns once path does not exist; check, if given, is a coroutine that is
+        awaited every check interval and can raise to stop the wait
+        """
+        directory = os.path.dirname(path)
+        loop = asyncio.get_event_loop()
+        interval = self.min_interval
+        next_check = loop.time() + interval
+        try:
+            while os.path.exists(path):
+                event = self.inotify.watch(directory) if self.inotify is not None else None
+                timeout = max(0, next_check - loop.time())
+                if self.poll_interval is not None:
+                    timeout = min(timeout, self.poll_interval)
+                if event is None:
+                    await asyncio.sleep(timeout)
+                else:
+                    event.clear()
+                    if not os.path.exists(path):
+                        break
+                    try:
+                        # other changes in the directory wake the wait too
+                        await asyncio.wait_for(event.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                if loop.time() < next_check:
+                    continue
+                if check is not None:
+                    await check()
+                interval = min(interval * 2, self.max_interval)
+                next_check = loop.time() + interval
+        finally:
+            if self.inotify is not None:
+                self.inotify.unwatch(directory)
+
+
+async def _run_command(args, **kwargs):
+    """Runs a command and returns its exit code and output"""
+    process = await asyncio.create_subprocess_exec(*args,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, **kwargs)
+    output, _ = await process.communicate()
+    return process.returncode, output.decode('utf-8', 'replace')
+
+
+class _Unlimited(object):
+    """The slot of a backend that takes any number of runs at once"""
+
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class PBSBackend(object):
+    """
+    Runs every run as a job of the qsub script rendered from template_file with the
+    paths of the run and template_args, which removes the run's lockfile and writes
+    its statusfile when it is done.  The lockfiles are looked for every few seconds, as
+    inotify does not see the jobs remove them on a cluster file system, and qstat is
+    asked about the job less and less often
+    """
+
+    def __init__(self, template_file='qsub.tpl', template_args=None, threads=16,
+            phil_home=None, watcher=None):
+        self.template_file = template_file
+        self.template_args = template_args or {}
+        self.threads = threads
+        self.phil_home = phil_home or os.environ['PHIL_HOME']
+        self.watcher = watcher or FileWatcher(poll_interval=2)
+
+    def start(self, loop):
+        self.watcher.start(loop)
+
+    def close(self):
+        self.watcher.close()
+
+    def slot(self):
+        # the queue holds the jobs that cannot start yet, within their walltime
+        return _Unlimited()
+
+    def render(self, run):
+        import jinja2
+        args = dict(self.template_args)
+        args.update(
+            stdout = run.stdout, stderr = run.stderr,
+            lockfile = run.lockfile, statusfile = run.statusfile,
+            tempdir = run.tempdir, jobname = os.path.basename(run.tempdir),
+            paramfile = run.paramfile,
+            synthetic_population = run.synthetic_population,
+            event_report_file = run.event_report_file,
+            poe_output_file = run.poe_output_file, poe_format = run.poe_format)
+        with open(self.template_file, 'r') as f:
+            qsub_template = jinja2.Template(f.read())
+        qsub_file = os.path.join(run.tempdir, 'qsub.py')
+        with open(qsub_file, 'w') as f:
+            f.write(qsub_template.render(args))
+        return qsub_file
+
+    async def execute(self, run):
+        qsub_file = self.render(run)
+        status, output = await _run_command(['qsub', '-h', '-v',
+            'PHIL_HOME=%s,OMP_NUM_THREADS=%d' % (self.phil_home, self.threads), qsub_file])
+        if status != 0:
+            raise PhilRunError('qsub %s failed: %s' % (qsub_file, output))
+        jobid = output.strip()
+        os.symlink(run.tempdir, os.path.join(run.container, jobid))
+        # the job removes the lockfile when it is done
+        open(run.lockfile, 'a').close()
+        status, output = await _run_command(['qalter', '-h', 'n', jobid])
+        if status != 0:
+            raise PhilRunError('qalter %s failed: %s' % (jobid, output))
+
+        # a job that leaves the queue without removing its lockfile failed, once the
+        # file system had a few checks to show the removal
+        settle_checks = [3]
+        async def check():
+            status, output = await _run_command(['qstat', '-x', jobid])
+            if status == 0:
+                return
+            settle_checks[0] -= 1
+            if settle_checks[0] < 0:
+                raise PhilRunError('Lockfile present but %s not in queue!' % jobid)
+        try:
+            await self.watcher.wait_removed(run.lockfile, check)
+        except asyncio.CancelledError:
+            # the run timed out
+            await _run_command(['qdel', jobid])
+            raise
+        run.read_status()
+
+
+class LocalBackend(object):
+    """
+    Runs phil and then poe.py for every run on this machine, in up to processes runs at
+    once (by default one per CPU divided by threads), each with threads OpenMP threads.
+    poe is the poe.py to run, by default the one on the PATH; start raises PhilRunError
+    if there is none, as every run's result is the output of poe.py
+    """
+
+    def __init__(self, processes=None, threads=1, phil=None, poe=None):
+        self.threads = threads
+        self.processes = processes or max(1, (os.cpu_count() or 1) // threads)
+        self.phil = phil
+        self.poe = poe
+        self.poe_command = None
+        self.slots = None
+
+    def start(self, loop):
+        self.poe_command = self.poe or shutil.which('poe.py')
+        if self.poe_command is None:
+            raise PhilRunError('poe.py is not on the PATH, give LocalBackend its poe')
+        self.slots = asyncio.Semaphore(self.processes)
+
+    def close(self):
+        self.slots = None
+
+    def slot(self):
+        return self.slots
+
+    async def execute(self, run):
+        phil = self.phil or os.path.join(os.environ['PHIL_HOME'], 'bin', 'phil')
+        env = dict(os.environ, OMP_NUM_THREADS=str(self.threads))
+        commands = [[phil, run.paramfile],
+            [self.poe_command, '-p', run.synthetic_population, '-r', run.event_report_file,
+                '-o', run.poe_output_file, '-c', 'none', '-g', 'config.yaml', '-f', run.poe_format]]
+        with open(run.stdout, 'w') as stdout:
+            for args in commands:
+                process = await asyncio.create_subprocess_exec(*args, cwd=run.tempdir,
+                        env=env, stdout=stdout, stderr=asyncio.subprocess.STDOUT,
+                        start_new_session=True)
+                try:
+                    await process.wait()
+                except asyncio.CancelledError:
+                    # the run timed out
+                    os.killpg(process.pid, signal.SIGKILL)
+                    # reaped before the loop of the batch closes
+                    await process.wait()
+                    raise
+                if process.returncode != 0:
+                    raise PhilRunError('%s in %s exited with %d, see %s' % (
+                        os.path.basename(args[0]), run.tempdir, process.returncode,
+                        run.stdout))
+
+
+class PhilRunner(object):
+    """
+    Runs PhilRuns on a backend, up to max_active at a time.  A run that fails or takes
+    longer than timeout seconds once the backend has room for it is tried again, up to
+    retries times, after backoff seconds that double with each try up to max_backoff.
+    """
+
+    def __init__(self, backend, max_active=100, retries=3, timeout=60*20,
+            backoff=10, max_backoff=600):
+        self.backend = backend
+        self.max_active = max_active
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    async def run(self, run):
+        """Runs run and returns its result, or raises the error of its last try"""
+        loop = asyncio.get_event_loop()
+        for attempt in range(self.retries + 1):
+            try:
+                await loop.run_in_executor(None, run.prepare)
+                async with self.backend.slot():
+                    await asyncio.wait_for(self.backend.execute(run), self.timeout)
+                return run.result
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = PhilRunError('%s timed out after %d seconds' % (run.tempdir, self.timeout))
+                if attempt == self.retries:
+                    raise e
+                # occasional file system errors make about 1 in 10,000 runs fail
+                delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                delay *= random.uniform(0.5, 1.5)
+                log.warn('%s failed (%s), trying again in %.1f seconds' % (
+                    run.name or run.tempdir, e, delay))
+                await asyncio.sleep(delay)
+
+    async def run_many(self, runs):
+        """
+        Runs the runs of an iterable, up to max_active at a time, and returns their
+        results in order, with the error of every run that failed in its place.  The
+        runs are taken from the iterable as they start, so it can be a generator of a
+        sweep too large to hold in memory.
+        """
+        runs = enumerate(runs)
+        results = {}
+        async def work():
+            for i, run in runs:
+                try:
+                    results[i] = await self.run(run)
+                except Exception as e:
+                    results[i] = e
+        await asyncio.gather(*[work() for _ in range(self.max_active)])
+        return [results[i] for i in range(len(results))]
+
+    def run_batch(self, runs):
+        """
+        run_many for callers that are not coroutines.  The runs are driven by a new
+        event loop in a thread of its own, so that run_batch can be called where another
+        loop is already running in the calling thread
+        """
+        with ThreadPoolExecutor(1, thread_name_prefix='phil-runs') as executor:
+            return executor.submit(self._run_loop, runs).result()
+
+    def _run_loop(self, runs):
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            self.backend.start(loop)
+            try:
+                return loop.run_until_complete(self.run_many(runs))
+            finally:
+                self.backend.close()
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
@@ -1,21 +1,26 @@
 # coding: utf-8
 
-import sh
 import os
 import re
-import time
+import sys
+import json
+import hashlib
 import argparse
-import jinja2
-import stopit
 
 import pandas as pd
 
-from tempfile import mkdtemp
-from random import randint
+from random import randint, uniform
 from collections import OrderedDict, namedtuple
 from datetime import datetime
+from PyGMO import population
 from PyGMO.problem import *
 
+from phil_worker import PhilWorkerPool, start_workers
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from phil_runs import PhilRun, PhilRunner, PBSBackend
+from phil_params import PhilParams
+
 
 class log(object):
     @staticmethod
@@ -95,11 +100,33 @@ class PhilOptimizeAttackRateByAge(base):
 
     target_year = 1
 
-    def __init__(self):
+    def __init__(self, worker_sockets=None, backend=None, replicates=1,
+            common_random_numbers=False, cache_dir=None):
+        # objectives are evaluated by the PHIL workers listening on worker_sockets if
+        # given (see start_phil_workers), otherwise by one run of backend per simulation,
+        # a qsub job unless another backend is given, e.g. phil_runs.LocalBackend()
+        self.worker_sockets = worker_sockets
+        # the objectives are those of the mean attack rates of replicates simulations,
+        # with the same seeds for every candidate if common_random_numbers, so that the
+        # differences between candidates are not those of their seeds
+        self.replicates = replicates
+        self.seeds = None
+        if common_random_numbers:
+            self.seeds = [randint(1, 2147483647) for _ in range(replicates)]
+        # evaluated objectives by candidate, kept in cache_dir too if given, which
+        # the copies of the problem on other islands can share
+        self.evaluations = {}
+        self.cache_dir = cache_dir
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
         self.wrkdir = os.getcwd()
         self.phil_home = os.environ['PHIL_HOME']
         self.base_param_file = 'params.seasonal'
         self.qsub_template_file = 'qsub.tpl'
+        if backend is None:
+            backend = PBSBackend(self.qsub_template_file, dict(reservation='philo.0'),
+                    phil_home=self.phil_home)
+        self.runner = PhilRunner(backend)
         nobj = 2 * len(self.target.index)
         nint = 0
         ndim = 0
@@ -114,24 +141,164 @@ class PhilOptimizeAttackRateByAge(base):
         self.set_bounds(lower_bounds, upper_bounds)
 
     def _objfun_impl(self, x):
-        for i in range(3):
-            try:
-                with stopit.ThreadingTimeout(60*20) as timeout_mgr:
-                    assert timeout_mgr.state == timeout_mgr.EXECUTING
-                    opt_params = self.build_phil_opt_params_dict_from_vec(x)
-                    tempdir, poe_output_file = self.run_phil_pipeline(opt_params)
-                    objective = self.evaluate_phil_output(poe_output_file, tempdir)
-                if timeout_mgr.state == timeout_mgr.EXECUTED:
-                    return objective
+        return self.objfun_batch([x])[0]
+
+    def objfun_batch(self, xs):
+        """
+        Returns the objectives of all the candidates xs, whose replicate simulations are
+        all submitted at once and run in parallel.  Candidates evaluated before are not
+        simulated again, so that an algorithm's objfun calls on a population evaluated
+        here are answered from the evaluation cache.
+
+        PyGMO calls objfun for one individual at a time, both as a population is built
+        and as an algorithm evolves it, so callers batch the candidates they make
+        themselves, e.g. with populations for the initial populations of the islands.
+        """
+        objectives = [None] * len(xs)
+        candidates = OrderedDict()
+        for i, x in enumerate(xs):
+            opt_params = self.build_phil_opt_params_dict_from_vec(x)
+            key = self.evaluation_key(opt_params)
+            objective = self.cached_evaluation(key)
+            if objective is not None:
+                objectives[i] = objective
+            elif key in candidates:
+                candidates[key][2].append(i)
+            else:
+                seeds = self.seeds or [randint(1, 2147483647) for _ in range(self.replicates)]
+                candidates[key] = (opt_params, seeds, [i])
+        if not candidates:
+            return objectives
+
+        try:
+            if self.worker_sockets:
+                replicates = self.run_phil_workers(list(candidates.values()))
+            else:
+                replicates = self.run_phil_pipelines(list(candidates.values()))
+        except Exception as e:
+            log.error('objective evaluation failed: %s' % e)
+            replicates = [[] for _ in candidates]
+
+        for (key, (opt_params, seeds, indexes)), r in zip(candidates.items(), replicates):
+            if len(r) == 0:
+                # the island evolve method doesn't handle the exception at all, so
+                # return a guaranteed crappy objective
+                objective = [999.999] * len(self.target.index) * 2
+            else:
+                attack_rates = pd.concat([d for d, tempdir in r]).groupby(level=0).mean()
+                objective = self.evaluate_attack_rates(attack_rates, r[0][1])
+                self.cache_evaluation(key, objective)
+            for i in indexes:
+                objectives[i] = objective
+        return objectives
+
+    def populations(self, sizes):
+        """
+        Returns PyGMO populations of sizes random candidates each, e.g. one for each
+        island of an archipelago.  The candidates of all of them are evaluated with one
+        objfun_batch before the populations are built, so that pushing them back finds
+        their objectives in the evaluation cache.  The problem of each population is a
+        copy of this one with that cache, as evolve calls objfun on the copy.
+        """
+        xs = [self.random_candidate() for _ in range(sum(sizes))]
+        self.objfun_batch(xs)
+        pops = []
+        for size in sizes:
+            pop = population(self)
+            for x in xs[:size]:
+                pop.push_back(x)
+            xs = xs[size:]
+            pops.append(pop)
+        return pops
+
+    def random_candidate(self):
+        x = []
+        for k,v in self.optimized_param_array_indexes.items():
+            x.extend([uniform(v.min, v.max) for _ in range(v.start, v.end)])
+        return x
+
+    def evaluation_key(self, opt_params):
+        # the params as phil reads them, so that vectors phil can't tell apart are one
+        # candidate, the seeds the candidate is evaluated with, and the base params and
+        # target it is evaluated against, so that the cache_dir of an earlier calibration
+        # against other params or another population is not used
+        return json.dumps([self.evaluation_context(), list(opt_params.items()),
+            self.seeds or self.replicates])
+
+    def evaluation_context(self):
+        """A hash of the base params of every run, as phil reads them, and of the target"""
+        params = self.read_phil_base_params_from_file().override(self.base_params)
+        context = json.dumps([list(params.to_dict().items()),
+            self.target.to_dict(orient='split')], sort_keys=True, default=str)
+        return hashlib.sha1(context.encode('utf-8')).hexdigest()
+
+    def cached_evaluation(self, key):
+        if key in self.evaluations or self.cache_dir is None:
+            return self.evaluations.get(key)
+        filename = os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+        try:
+            with open(filename, 'r') as f:
+                cached_key, objective = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if cached_key != key:
+            return None
+        self.evaluations[key] = objective
+        return objective
+
+    def cache_evaluation(self, key, objective):
+        self.evaluations[key] = objective
+        if self.cache_dir is None:
+            return
+        filename = os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+        # written whole before it is seen, since other islands read the cache too
+        tempname = '%s.%d.%d' % (filename, os.getpid(), randint(0, sys.maxsize))
+        with open(tempname, 'w') as f:
+            json.dump([key, objective], f)
+        os.rename(tempname, filename)
+
+    def run_phil_pipelines(self, candidates):
+        """
+        Runs the replicates of all (opt_params, seeds, _) candidates on the backend, and
+        returns the attack rates and directory of each replicate that succeeded, by
+        candidate
+        """
+        runs = [self.make_phil_run(opt_params, seed)
+                for opt_params, seeds, _ in candidates for seed in seeds]
+        # the runner tries failed runs again
+        results = iter(self.runner.run_batch(runs))
+        replicates = []
+        for opt_params, seeds, _ in candidates:
+            r = []
+            for seed in seeds:
+                result = next(results)
+                try:
+                    if isinstance(result, Exception):
+                        raise result
+                    tempdir, poe_output_file = result
+                    r.append((self.read_phil_output(poe_output_file), tempdir))
+                except Exception as e:
+                    log.error('simulation with seed %d failed: %s' % (seed, e))
+            replicates.append(r)
+        return replicates
+
+    def run_phil_workers(self, candidates):
+        """run_phil_pipelines on the PHIL workers"""
+        responses = iter(PhilWorkerPool(self.worker_sockets).map(
+                [dict(params=opt_params, seed=seed)
+                    for opt_params, seeds, _ in candidates for seed in seeds],
+                return_exceptions=True))
+        replicates = []
+        for opt_params, seeds, _ in candidates:
+            r = []
+            for seed in seeds:
+                response = next(responses)
+                if isinstance(response, Exception):
+                    log.error('simulation with seed %d failed: %s' % (seed, response))
                 else:
-                    raise Exception('Timeout!')
-            except Exception as e:
-                # this is a hack.  there are occasional filesystem errors that cause 
-                # approx 1 in 10,000 executions to fail silently (and the island evolve
-                # method doesn't handle the exception at all).  So just sleep and try again
-                time.sleep(30)
-        # if we never get it, return a guaranteed crappy objective
-        return [999.999] * len(self.target.index) * 2
+                    r.append((self.read_phil_worker_response(response), None))
+            replicates.append(r)
+        return replicates
 
     def build_phil_opt_params_dict_from_vec(self, x):
         p = OrderedDict()
@@ -159,94 +326,45 @@ class PhilOptimizeAttackRateByAge(base):
         return [float(s) for s in v]
 
     def read_phil_base_params_from_file(self, filename=None):
-        p = {}
+        # parsed once, not for every run
         _filename = self.base_param_file if filename is None else filename
-        with open(_filename, 'r') as f:
-            for l in f:
-                l = l.strip()
-                if not l.startswith('#') and len(l) > 0 and '=' in l:
-                    l = re.sub(r'(?m)^ *#.*\n?', '', l)
-                    m = re.search('^(.+?) = (.+)$', l)
-                    if m is not None:
-                        p[m.group(1)] = m.group(2)
-        return p
+        return PhilParams.read(_filename)
 
-    def run_phil_pipeline(self, opt_params):
+    def make_phil_run(self, opt_params, seed=None):
         tempdir_container = os.path.join(self.wrkdir,'philo_output',str(randint(0,32)),str(randint(0,32)))
-        sh.mkdir('-p',tempdir_container)
-        tempdir = mkdtemp(prefix='phl-', dir=tempdir_container)
-        basename = os.path.basename(tempdir)
-        event_report_file = os.path.join(tempdir, 'events.json_lines')
-        poe_output_file = os.path.join(tempdir, 'poe_output')
-        poe_format = 'csv'
-        qsub = sh.qsub.bake('-h','-v','PHIL_HOME=%s,OMP_NUM_THREADS=16' % self.phil_home)
-
-        paramfile = open(os.path.join(tempdir,'params'), 'w')
-        params = self.read_phil_base_params_from_file()
-        params.update(self.base_params)
+        params = self.read_phil_base_params_from_file().override(self.base_params).override(opt_params)
+        return PhilRun(tempdir_container, params,
+                files=[params['primary_cases_file[0]'], params['vaccination_capacity_file'], 'config.yaml'],
+                seed=seed, synthetic_population=self.synthetic_population)
+
+    def start_phil_workers(self, n):
+        """
+        Starts n PHIL workers on this machine, which read the synthetic population once
+        and then run the simulations of all objective evaluations
+        """
+        base_params = self.read_phil_base_params_from_file()
+        params = dict(self.base_params)
+        age_group_bounds = [re.findall(r'\d+', a) for a in self.age_groups]
+        age_group_bounds = [int(b[0]) for b in age_group_bounds] + [int(age_group_bounds[-1][1])]
         params.update({
-            'outdir': tempdir,
-            'event_report_file' : event_report_file,
-            'seed': randint(1, 2147483647)
+            'event_report_line_list': 0,
+            'aggregate_event_report_age_groups': '%d %s' % (
+                len(age_group_bounds), ' '.join(str(b) for b in age_group_bounds)),
         })
-        params.update(opt_params)
-
-        for param, value in params.items():
-            paramfile.write('%s = %s\n' % (param, str(value)))
-        paramfile.close()
-
-        lockfile = os.path.join(tempdir, 'lockfile')
-        statusfile = os.path.join(tempdir, 'statusfile')
-
-        sh.cp(params['primary_cases_file[0]'], tempdir)
-        sh.cp(params['vaccination_capacity_file'], tempdir)
-        sh.cp('config.yaml', tempdir)
-
-        qsub_template_args = dict(
-            stdout = os.path.join(tempdir, 'stdout'),
-            stderr = os.path.join(tempdir, 'stderr'),
-            lockfile = lockfile, statusfile = statusfile,
-            tempdir = tempdir, jobname = basename,
-            reservation = 'philo.0', paramfile = paramfile.name,
-            synthetic_population = self.synthetic_population,
-            event_report_file = event_report_file,
-            poe_output_file = poe_output_file, poe_format = poe_format)
-
-        with open(self.qsub_template_file, 'r') as f:
-            qsub_template = jinja2.Template(f.read())
-      
-        qsub_file = os.path.join(tempdir, 'qsub.py')
-        with open(qsub_file, 'w') as f:
-            f.write(qsub_template.render(qsub_template_args))
-
-        jobid = qsub(qsub_file).strip()
-        sh.ln('-s', tempdir, os.path.join(tempdir_container, jobid))
-        sh.touch(lockfile)
-        sh.qalter('-h','n', jobid)
-
-        while sh.qstat('-x', jobid, _ok_code=[0,153]).exit_code == 0:
-            time.sleep(randint(1,4))
-
-        n_check = 3
-        for _n in range(n_check+1):
-            try:
-                if os.path.isfile(lockfile):
-                    raise Exception('Lockfile present but %s not in queue!' % jobid)
-
-                with open(statusfile, 'r') as f:
-                    stat = f.read()
-                    if len(stat) > 0:
-                        raise Exception(stat)
-                break
-            except Exception as e:
-                if _n == n_check:
-                    raise(e)
-                else:
-                    time.sleep(randint(10,20))
-
-        return (tempdir, '%s.%s' % (poe_output_file, poe_format))
-
-    def evaluate_phil_output(self, poe_output_file, tempdir):
+        workers = start_workers(n, self.base_param_file, params,
+                files=[base_params['primary_cases_file[0]'], base_params['vaccination_capacity_file']],
+                wrkdir=os.path.join(self.wrkdir, 'philo_output'))
+        self.worker_sockets = [w.socket_path for w in workers]
+        return workers
+
+    def read_phil_worker_response(self, response):
+        d = pd.DataFrame(response['age_groups'])
+        d['age'] = ['[%d, %d)' % (a, b) for a, b in zip(d.age_from, d.age_to)]
+        # the mean daily incidence of read_phil_output, for a whole year
+        d['attack_rate'] = (d.symptomatic / d.population * 365.0 / response['days']).round(3)
+        return d.set_index('age')[['attack_rate']]
+
+    def read_phil_output(self, poe_output_file):
         d1 = pd.read_csv(poe_output_file)
 
         def yearly_stats(s):
@@ -256,7 +374,9 @@ class PhilOptimizeAttackRateByAge(base):
                 'attack_rate': ((s['IS_i'] / s['N_p']).mean() * 365.0).round(3),
             })
 
-        d2 = d1.groupby(['age']).apply(yearly_stats)
+        return d1.groupby(['age']).apply(yearly_stats)
+
+    def evaluate_attack_rates(self, d2, tempdir=None):
         d3 = d2.join(self.target)
 
         def build_objectives(_s):
@@ -278,7 +398,8 @@ class PhilOptimizeAttackRateByAge(base):
         d3 = d3.groupby(level=0, group_keys=False).apply(build_objectives
                          ).reset_index().rename(columns={'index':'age_index'})
 
-        d3.to_csv(os.path.join(tempdir, 'objective.csv'))
+        if tempdir is not None:
+            d3.to_csv(os.path.join(tempdir, 'objective.csv'))
         return d3.z_abs.tolist()
 
 
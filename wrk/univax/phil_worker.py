@@ -0,0 +1,228 @@
+# coding: utf-8
+
+"""
+Runs simulations on PHIL workers: phil processes that read the synthetic population
+once and then run one simulation per request received on their worker_socket (see
+src/Worker.h), instead of one qsub job that reads the population for every run.
+run_realizations runs a batch of seeded realizations from one such population.
+"""
+
+import os
+import json
+import time
+import errno
+import fcntl
+import random
+import shutil
+import socket
+import threading
+import subprocess
+
+from tempfile import mkdtemp
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+
+class PhilWorkerError(Exception):
+    pass
+
+
+class PhilWorker(object):
+    """
+    A phil process in worker mode started on this machine.  The worker's params are
+    those of the given params file, followed by the given params, and files are the
+    files the params refer to by relative paths, which are copied to the directory of
+    the worker
+    """
+
+    def __init__(self, paramfile, params=None, files=(), wrkdir=None, phil=None):
+        if wrkdir is not None and not os.path.isdir(wrkdir):
+            os.makedirs(wrkdir)
+        self.wrkdir = mkdtemp(prefix='phw-', dir=wrkdir)
+        for filename in files:
+            shutil.copy(filename, self.wrkdir)
+        self.socket_path = os.path.join(self.wrkdir, 'socket')
+        self.paramfile = os.path.join(self.wrkdir, 'params')
+        with open(paramfile, 'r') as f:
+            base_params = f.read()
+        with open(self.paramfile, 'w') as f:
+            f.write(base_params)
+            # phil uses the last value of each param
+            f.write('\n')
+            for param, value in (params or {}).items():
+                f.write('%s = %s\n' % (param, str(value)))
+            f.write('outdir = %s\n' % os.path.join(self.wrkdir, 'OUT'))
+            f.write('worker_socket = %s\n' % self.socket_path)
+        if phil is None:
+            phil = os.path.join(os.environ['PHIL_HOME'], 'bin', 'phil')
+        self.log = open(os.path.join(self.wrkdir, 'stdout'), 'w')
+        self.process = subprocess.Popen([phil, self.paramfile], cwd=self.wrkdir,
+                stdout=self.log, stderr=subprocess.STDOUT)
+
+    def wait_until_ready(self, timeout=3600):
+        """Wait for the worker to read the population and listen on its socket"""
+        start = time.time()
+        while True:
+            if self.process.poll() is not None:
+                raise PhilWorkerError('phil worker in %s exited with %d before it was ready' % (
+                    self.wrkdir, self.process.returncode))
+            if os.path.exists(self.socket_path):
+                return
+            if time.time() - start > timeout:
+                raise PhilWorkerError('phil worker in %s not ready after %d seconds' % (
+                    self.wrkdir, timeout))
+            time.sleep(1)
+
+    def stop(self):
+        if self.process.poll() is None:
+            try:
+                PhilWorkerPool([self.socket_path]).request({'stop': True})
+            except (PhilWorkerError, socket.error):
+                self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+
+class PhilWorkerPool(object):
+    """
+    Sends simulation requests to a set of PHIL workers, given by their sockets, each to
+    a worker that is not busy.  Only the socket paths are kept, so a pool can be copied
+    and used by any number of threads and processes at once, e.g. by the islands of a
+    PyGMO archipelago: a worker is claimed by locking the file <socket>.lock.
+    """
+
+    def __init__(self, socket_paths):
+        self.socket_paths = list(socket_paths)
+
+    def claim_worker(self):
+        """Returns the socket path and the open lock file of a worker that is not busy"""
+        socket_paths = self.socket_paths[:]
+        random.shuffle(socket_paths)
+        for i, socket_path in enumerate(socket_paths):
+            lock = open(socket_path + '.lock', 'a')
+            # wait on the last worker if all of them are busy
+            flags = fcntl.LOCK_EX if i == len(socket_paths) - 1 else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock, flags)
+                return socket_path, lock
+            except IOError as e:
+                lock.close()
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+
+    def request(self, request):
+        socket_path, lock = self.claim_worker()
+        try:
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                s.connect(socket_path)
+                s.sendall((json.dumps(request) + '\n').encode('utf-8'))
+                response = s.makefile('rb').readline()
+            finally:
+                s.close()
+        finally:
+            lock.close()
+        if not response:
+            raise PhilWorkerError('phil worker %s closed the connection' % socket_path)
+        response = json.loads(response.decode('utf-8'))
+        if response['status'] == 'error':
+            raise PhilWorkerError('phil worker %s: %s' % (socket_path, response['message']))
+        return response
+
+    def simulate(self, params=None, seed=None, outdir=None):
+        """
+        Runs one simulation with the given transmission and contact params, and returns
+        the worker's answer, with its counts by age group in age_groups
+        """
+        request = {}
+        if params:
+            request['params'] = params
+        if seed is not None:
+            request['seed'] = seed
+        if outdir is not None:
+            request['outdir'] = outdir
+        return self.request(request)
+
+    def realizations(self, seeds, params=None, outdir=None):
+        """
+        Runs one simulation for each of the given seeds on one worker, which runs up to
+        its worker_processes of them at once from its set up population, and returns
+        their answers in the order of the seeds.  The worker requires an outdir to write
+        the runs to
+        """
+        request = {'seeds': list(seeds)}
+        if params:
+            request['params'] = params
+        if outdir is not None:
+            request['outdir'] = outdir
+        return self.request(request)['realizations']
+
+    def map(self, requests, return_exceptions=False):
+        """
+        Runs the simulations of the given simulate keyword arguments on all workers at
+        once; the error of a simulation that failed is raised, or returned in its place
+        if return_exceptions
+        """
+        requests = list(requests)
+        results = [None] * len(requests)
+        todo = Queue()
+        for i, kwargs in enumerate(requests):
+            todo.put((i, kwargs))
+
+        def work():
+            while True:
+                try:
+                    i, kwargs = todo.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results[i] = self.simulate(**kwargs)
+                except Exception as e:
+                    results[i] = e
+
+        threads = [threading.Thread(target=work) for _ in self.socket_paths]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for r in results:
+            if isinstance(r, Exception) and not return_exceptions:
+                raise r
+        return results
+
+
+def start_workers(n, paramfile, params=None, files=(), wrkdir=None, phil=None):
+    """Starts n workers on this machine and returns them once all of them are ready"""
+    workers = [PhilWorker(paramfile, params, files, wrkdir, phil) for _ in range(n)]
+    try:
+        for w in workers:
+            w.wait_until_ready()
+    except Exception:
+        for w in workers:
+            w.stop()
+        raise
+    return workers
+
+
+def run_realizations(paramfile, seeds, params=None, outdir=None, processes=None,
+        files=(), wrkdir=None, phil=None):
+    """
+    Reads the population of the given params file once, in a new worker, and runs one
+    realization for each of the given seeds from it, up to processes (all of them by
+    default) at once, with the transmission and contact params of params; returns the
+    answers of the realizations in the order of the seeds.  The realizations are written
+    to runs 1, 2, ... of outdir, by default the realizations directory of the worker's
+    directory
+    """
+    seeds = list(seeds)
+    worker_params = {'worker_processes': processes or len(seeds)}
+    worker = start_workers(1, paramfile, worker_params, files, wrkdir, phil)[0]
+    if outdir is None:
+        outdir = os.path.join(worker.wrkdir, 'realizations')
+    try:
+        return PhilWorkerPool([worker.socket_path]).realizations(seeds, params, outdir)
+    finally:
+        worker.stop()